@@ -1,152 +1,292 @@
 #QBank.py
 import os
 import discord
-import math
-import mysql.connector as mysql
 import datetime as dt
-from mysql.connector import Error
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from mcuuid.api import GetPlayerData
+import metrics
+import storage
+import migrations
 from exceptions import *
+from amount import Amount, ZERO, SCRAP_PER_INGOT, INGOTS_PER_BLOCK, DIAMONDS_PER_BLOCK
+from rate_limit import RateLimiter, with_retries
+from player_cache import PlayerCache, PlayerCacheTable, mojang_lookup
+from account_cache import Account, AccountCache
+from replicas import Replica, ReplicaSet, current_session
 
+logger = logging.getLogger(__name__)
+
+#database key to the schema version this process has already checked it is at, see QBank.ensure_schema
+SCHEMA_VERSIONS = {}
+
+#columns returned for each transaction in history queries, ending with the sender's and recipient's Minecraft names
+TRANSACTION_COLUMNS = "t.transaction_id, t.transaction_type, t.sender_account_id, t.recipient_account_id, t.netherite_blocks, t.netherite_ingots, t.netherite_scrap, t.diamond_blocks, t.diamonds, s.mc_name AS sender_name, r.mc_name AS recipient_name"
+TRANSACTION_SOURCE = "transactions t LEFT JOIN accounts s ON s.account_id = t.sender_account_id LEFT JOIN accounts r ON r.account_id = t.recipient_account_id"
+
+#transaction types logged for each batch operation
+BATCH_TRANSACTION_TYPES = {"deposit": "deposit", "withdraw": "withdrawal", "transfer": "transfer"}
+
+#denomination columns holding each kind of amount, largest denomination first
+BALANCE_COLUMNS = ["netherite_blocks", "netherite_ingots", "netherite_scrap", "diamond_blocks", "diamonds"]
+OUTSTANDING_COLUMNS = ["outstanding_nb", "outstanding_ni", "outstanding_ns", "outstanding_db", "outstanding_d"]
+INTEREST_COLUMNS = ["interest_nb", "interest_ni", "interest_ns", "interest_db", "interest_d"]
+
+#the running totals kept in the bank_totals row, each stored as a netherite and a diamonds column, see QBank.get_bank_totals
+BANK_TOTALS = ["deposits", "opted_in", "principal", "interest"]
+
+#the hottest queries, run as statements prepared once per pooled connection (see QBank._statement)
+STATEMENTS = {
+	**{f"account_by_{column}": f"SELECT account_id, mc_uuid, mc_name, dc_id, {', '.join(BALANCE_COLUMNS)} FROM accounts WHERE {column} = %s" for column in ["account_id", "dc_id", "mc_uuid"]},
+	"locked_balance": f"SELECT {', '.join(BALANCE_COLUMNS)}, opted_into_interest FROM accounts WHERE account_id = %s FOR UPDATE",
+	"update_balance": f"UPDATE accounts SET {', '.join(f'{column} = %s' for column in BALANCE_COLUMNS)} WHERE account_id = %s",
+	"insert_transaction": f"INSERT INTO transactions (transaction_type, sender_account_id, recipient_account_id, {', '.join(BALANCE_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+	"insert_ledger_entry": "INSERT INTO ledger (account_id, entry_type, counterparty_account_id, netherite, diamonds) VALUES (%s, %s, %s, %s, %s)",
+	"balance_and_opt_in": f"SELECT {', '.join(BALANCE_COLUMNS)}, opted_into_interest FROM accounts WHERE account_id = %s",
+	"add_to_bank_totals": f"UPDATE bank_totals SET {', '.join(f'{total}_{unit} = {total}_{unit} + %s' for total in BANK_TOTALS for unit in ['netherite', 'diamonds'])} WHERE totals_id = 1"
+}
+
+@metrics.instrument_methods
 class QBank:
 
-	def __init__(self):
+	def __init__(self, pool=None, player_lookup=mojang_lookup, backend=None, lazy=False):
 		"""Creates a new QBank object
 	
-		Connects to the MySQL server with the host and credentials given in .env
-		Creates the accounts, transactions, and loans tables if they don't already exist
+		Stores the bank in the given storage backend, or the one chosen by QBANK_BACKEND in .env (MySQL by default)
+		Borrows connections from the given pool, or creates a pool of connections to the backend's database
+		Sends read-only queries to the backend's replicas while they are within REPLICA_MAX_LAG seconds of the primary, measuring their lag every REPLICA_LAG_CHECK_SECONDS
+		Times its public methods, queries and player lookups in the metrics module
+		Resolves player names through player_lookup, caching the results in memory and in the player_cache table
+		Caches up to ACCOUNT_CACHE_SIZE accounts in memory, kept up to date as balances and names are written
+		Creates or upgrades the database schema by applying any pending migrations, unless lazy is set, in which case nothing touches the database until warm_up() or ensure_schema() is called
 		"""
 		load_dotenv()
-		try:
-			self.db = mysql.connect(
-				host = os.getenv('MYSQL_HOST'),
-				user = os.getenv('MYSQL_USER'),
-				passwd = os.getenv('MYSQL_PASSWORD'),
-				auth_plugin = os.getenv('AUTH_PLUGIN'),
-				database = os.getenv('DATABASE')
-			)
-			print(self.db)
-		except Error as e:
-			print(f"The error '{e}' occurred")
-	
-		self.cursor = self.db.cursor()
-		
-		self.cursor.execute("SHOW TABLES")
-		tables = self.cursor.fetchall()
-		
-		if not any("accounts" in s for s in tables):
-			self.cursor.execute("""CREATE TABLE accounts (
-								account_id INT(11) NOT NULL AUTO_INCREMENT PRIMARY KEY, 
-								mc_uuid CHAR(36), 
-								mc_name VARCHAR(16), 
-								dc_id VARCHAR(255), 
-								netherite_blocks INT UNSIGNED DEFAULT 0, 
-								netherite_ingots INT UNSIGNED DEFAULT 0, 
-								netherite_scrap INT UNSIGNED DEFAULT 0,
-								diamond_blocks INT UNSIGNED DEFAULT 0, 
-								diamonds INT UNSIGNED DEFAULT 0,
-								opted_into_interest BOOLEAN DEFAULT TRUE)""")
-		
-		if not any("transactions" in s for s in tables):
-			self.cursor.execute("""CREATE TABLE transactions (
-								transaction_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, 
-								transaction_type VARCHAR(10) NOT NULL, 
-								sender_account_id INT(11), 
-								recipient_account_id INT(11), 
-								netherite_blocks INT UNSIGNED, 
-								netherite_ingots INT UNSIGNED, 
-								netherite_scrap INT UNSIGNED, 
-								diamond_blocks INT UNSIGNED, 
-								diamonds INT UNSIGNED)""")
-		
-		if not any("loans" in s for s in tables):
-			self.cursor.execute("""CREATE TABLE loans (
-								loan_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-								loanee_id INT(11),
-								loanee_name INT(11),
-								borrowed_date VARCHAR(20),
-								due_date VARCHAR(20),
-								loaned_nb INT UNSIGNED DEFAULT 0,
-								loaned_ni INT UNSIGNED DEFAULT 0,
-								loaned_ns INT UNSIGNED DEFAULT 0,
-								loaned_db INT UNSIGNED DEFAULT 0,
-								loaned_d INT UNSIGNED DEFAULT 0,
-								interest_nb INT UNSIGNED DEFAULT 0,
-								interest_ni INT UNSIGNED DEFAULT 0,
-								interest_ns INT UNSIGNED DEFAULT 0,
-								interest_db INT UNSIGNED DEFAULT 0,
-								interest_d INT UNSIGNED DEFAULT 0,
-								outstanding_nb INT UNSIGNED DEFAULT 0,
-								outstanding_ni INT UNSIGNED DEFAULT 0,
-								outstanding_ns INT UNSIGNED DEFAULT 0,
-								outstanding_db INT UNSIGNED DEFAULT 0,
-								outstanding_d INT UNSIGNED DEFAULT 0,
-								paid BOOLEAN DEFAULT FALSE)""")
-		
-		self.db.close()
+		if backend is None:
+			backend = storage.backend_from_env()
+		self.backend = backend
+		if pool is None:
+			pool = backend.create_pool()
+		self.pool = pool
+		self._local = threading.local()
+		lag_check_seconds = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', 5))
+		self.replicas = ReplicaSet([Replica(replica, lag_check_seconds) for replica in backend.replicas()], float(os.getenv('REPLICA_MAX_LAG', 5)))
+		
+		player_table = PlayerCacheTable(self.connection, self.read_connection)
+		self.players = PlayerCache(
+			metrics.timed_lookup(player_lookup),
+			store = player_table,
+			max_size = int(os.getenv('PLAYER_CACHE_SIZE', 1024)),
+			ttl = float(os.getenv('PLAYER_CACHE_TTL', 86400)),
+			negative_ttl = float(os.getenv('PLAYER_CACHE_NEGATIVE_TTL', 600)),
+			lookup_timeout = float(os.getenv('PLAYER_LOOKUP_TIMEOUT', 5)),
+			retry_after = float(os.getenv('PLAYER_LOOKUP_RETRY_AFTER', 60))
+		)
+		self.accounts = AccountCache(int(os.getenv('ACCOUNT_CACHE_SIZE', 4096)))
+		
+		self.schema_version = None
+		self._schema_lock = threading.Lock()
+		if not lazy:
+			self.ensure_schema()
+	
+	def ensure_schema(self):
+		"""Creates or upgrades the database schema if needed, returns its version
+		
+		The result is cached by the database's key and the latest migration's version, so only the first check in a process touches the database
+		When the schema is already current that check is one read-only query, the migrations (and their DDL) only run when there is something to apply
+		"""
+		latest = self.backend.migrations[-1][0]
+		key = self.backend.key()
+		with self._schema_lock:
+			if self.schema_version != latest and key is not None and SCHEMA_VERSIONS.get(key) == latest:
+				self.schema_version = latest
+			if self.schema_version == latest:
+				return latest
+			
+			try:
+				with self.connection(write=False) as cursor:
+					version = migrations.schema_version(cursor)
+			except Exception:
+				#the schema_version table doesn't exist yet, the migrations create it
+				version = 0
+			if version != latest:
+				with self.connection() as cursor:
+					version = self.backend.migrate(cursor)
+			
+			self.schema_version = version
+			if key is not None:
+				SCHEMA_VERSIONS[key] = version
+			return version
+	
+	def warm_up(self):
+		"""Opens the pool's connections and makes sure the schema is up to date, returns the schema version
+		"""
+		self.pool.warm()
+		return self.ensure_schema()
+	
+	def preload(self, limit=500, scan=5000):
+		"""Loads up to limit of the accounts with the most recent activity into the account cache, and their players into the player cache, returns the number of accounts loaded
+		
+		Recent activity is read from the newest scan ledger entries, walking the primary key backwards, so it costs the same however long the ledger is
+		"""
+		generation = self.accounts.generation()
+		with self.connection(write=False) as cursor:
+			query = (f"SELECT a.account_id, a.mc_uuid, a.mc_name, a.dc_id, {', '.join('a.' + column for column in BALANCE_COLUMNS)} FROM accounts a "
+					"JOIN (SELECT DISTINCT account_id FROM (SELECT account_id FROM ledger ORDER BY entry_id DESC LIMIT %s) AS recent) AS active ON active.account_id = a.account_id LIMIT %s")
+			data = [scan, limit]
+			cursor.execute(query, data)
+			accounts = [Account(record[0], record[1], record[2], record[3], Amount.from_denominations(record[4:])) for record in cursor.fetchall()]
+			
+			names = [account.mc_name.lower() for account in accounts if account.mc_name]
+			entries = []
+			if names:
+				query = f"SELECT lookup_name, mc_uuid, mc_name, fetched_at FROM player_cache WHERE lookup_name IN ({', '.join(['%s'] * len(names))})"
+				cursor.execute(query, names)
+				entries = cursor.fetchall()
+		
+		self.accounts.put_many(accounts, generation)
+		self.players.prime(entries)
+		logger.info("preloaded caches accounts=%d players=%d", len(accounts), len(entries))
+		return len(accounts)
 		
 	def account_exists_mc_uuid(self, uuid):
 		"""Checks if the database contains an account with the given uuid
 		"""
-		self.open()
-		query = "SELECT account_id FROM accounts WHERE mc_uuid = %s"
-		data = [uuid]
-		self.cursor.execute(query, data)
-		record = self.cursor.fetchone()
-		self.close()
-		if not record:
-			return False
-		return True
+		return self.get_account_by_uuid(uuid) is not None
 	
 	def account_exists_dc_id(self, dc_id):
 		"""Checks if the database contains an account with the given discord id
 		"""
-		self.open()
-		query = "SELECT account_id FROM accounts WHERE dc_id = %s"
-		data = [dc_id]
-		self.cursor.execute(query, data)
-		record = self.cursor.fetchone()
-		self.close()
+		return self.get_account_by_dc_id(dc_id) is not None
+	
+	def get_account_by_id(self, account_id):
+		"""Returns the Account with the given account id, or None if there isn't one
+		"""
+		account = self.accounts.get_by_id(account_id)
+		if account is None:
+			account = self._load_account("account_id", account_id)
+		return account
+	
+	def get_account_by_dc_id(self, dc_id):
+		"""Returns the Account associated with the given discord id, or None if there isn't one
+		"""
+		account = self.accounts.get_by_dc_id(dc_id)
+		if account is None:
+			#dc_id is a VARCHAR column, comparing it to a number would skip its index
+			account = self._load_account("dc_id", str(dc_id))
+		return account
+	
+	def get_account_by_uuid(self, uuid):
+		"""Returns the Account belonging to the player with the given uuid, or None if there isn't one
+		"""
+		account = self.accounts.get_by_uuid(uuid)
+		if account is None:
+			account = self._load_account("mc_uuid", uuid)
+		return account
+	
+	def account_cache_stats(self):
+		"""Returns a dict with the account cache's hit and miss counts and current size
+		"""
+		return self.accounts.stats()
+	
+	def _load_account(self, column, value):
+		"""Reads the account with the given value in column from the database and caches it
+		
+		Only reads made in their own database transaction are cached, since a read inside a longer transaction may see a snapshot older than what other threads have committed since
+		The read isn't cached either if the cache changed while it ran, as the row may have been written in the meantime
+		Always reads from the primary, never a replica, since a lagging replica could put a stale balance in the cache
+		"""
+		cacheable = getattr(self._local, 'cursor', None) is None
+		generation = self.accounts.generation()
+		with self.connection(write=False):
+			statement = self._statement(f"account_by_{column}")
+			statement.execute([value])
+			record = statement.fetchone()
 		if not record:
-			return False
-		return True
+			return None
+		account = Account(record[0], record[1], record[2], record[3], Amount.from_denominations(record[4:]))
+		if cacheable:
+			self.accounts.put(account, generation)
+		return account
+	
+	def _locked_balance(self, account_id):
+		"""Reads the account's balance with SELECT ... FOR UPDATE, so it can't change before the current database transaction writes the new balance
+		
+		Returns the balance and whether the account is opted into interest, which update_balance needs to keep the bank totals current
+		"""
+		with self.connection():
+			statement = self._statement("locked_balance")
+			statement.execute([account_id])
+			record = statement.fetchone()
+		if not record:
+			raise AccountNotFoundError(f"Found no account with id {account_id}")
+		return Amount.from_denominations(record[:5]), record[5]
+	
+	def _write_through(self, account_id, **changes):
+		"""Records a change to the account's cached fields, to be applied to the cache when the current database transaction commits
+		
+		The account is dropped from the cache straight away, so no other thread reads the old values in the meantime, and stays out of it until the transaction ends (see AccountCache.begin_write)
+		"""
+		pending = self._local.pending
+		if account_id in pending:
+			account, token = pending[account_id]
+		else:
+			account, token = self.accounts.begin_write(account_id)
+		if account is not None:
+			account = account._replace(**changes)
+		pending[account_id] = (account, token)
+	
+	def _add_balance_change(self, change, opted_into_interest):
+		"""Records a change to one account's balance in the bank totals, see _add_to_bank_totals
+		"""
+		self._add_to_bank_totals(deposits=change, opted_in=change if opted_into_interest else ZERO)
+	
+	def _add_to_bank_totals(self, **changes):
+		"""Records changes to the bank totals, to be written to the bank_totals row just before the current database transaction commits
 		
-	def create_new_account(self, mc_name, dc_id, starting_balance=[0,0,0,0,0]):
+		Writing the row once, last, keeps the time every operation holds its lock short, and it is always locked after the account and loan rows
+		"""
+		totals = self._local.totals
+		for total, change in changes.items():
+			totals[total] = totals.get(total, ZERO) + change
+		
+	def create_new_account(self, mc_name, dc_id, starting_balance=ZERO):
 		"""Creates a new account with the provided information
 		"""
 		mc_uuid = self.get_player_uuid(mc_name)
-		if not self.account_exists_mc_uuid(mc_uuid):
-			if not self.account_exists_dc_id(dc_id):
-				self.open()
-				query = "INSERT INTO accounts (mc_uuid, mc_name, dc_id) VALUES (%s, %s, %s)"
-				values = [mc_uuid, mc_name, dc_id]
-				self.cursor.execute(query, values)
-				self.db.commit()
-				self.close()
+		with self.connection():
+			if not self.account_exists_mc_uuid(mc_uuid):
+				if not self.account_exists_dc_id(dc_id):
+					with self.connection() as cursor:
+						query = "INSERT INTO accounts (mc_uuid, mc_name, dc_id) VALUES (%s, %s, %s)"
+						values = [mc_uuid, mc_name, str(dc_id)]
+						cursor.execute(query, values)
 			
-				if not all(i == 0 for i in starting_balance):
-					self.deposit(mc_name, starting_balance)
+					if starting_balance:
+						self.deposit(mc_name, starting_balance)
 			
-				return True
+					return True
+				else:
+					raise DuplicateAccountError("An account associated with your discord id already exists")
 			else:
-				raise DuplicateAccountError("An account associated with your discord id already exists")
-		else:
-			raise DuplicateAccountError(f"User {mc_name} already has an account")
-		return False
+				raise DuplicateAccountError(f"User {mc_name} already has an account")
+			return False
 		
-	def deposit(self, mc_name, amount=[0,0,0,0,0]):
+	def deposit(self, mc_name, amount=ZERO):
 		"""Deposits the provided amount into the account belonging to the user with the given Minecraft username, intended for use by bank manager via bot command or code
 		"""
 		transaction_type = "deposit"
 		account_id = self.get_account_id_from_mc_name(mc_name)
-		current_balance = self.check_balance_account_id(account_id)
+		with self.connection():
+			current_balance, opted_into_interest = self._locked_balance(account_id)
 		
-		new_balance = self.add_to_balance(current_balance, amount)
-		self.create_transaction(transaction_type, recipient_id = account_id, transaction_amount = amount)
-		self.update_balance(account_id, new_balance)
+			new_balance = current_balance + amount
+			self.create_transaction(transaction_type, recipient_id = account_id, transaction_amount = amount)
+			self.update_balance(account_id, new_balance, current_balance, opted_into_interest)
 	
-	def withdraw(self, mc_name, amount=[0,0,0,0,0]):
+	def withdraw(self, mc_name, amount=ZERO):
 		"""Withdraws the provided amount from the account belonging to the user with the given Minecraft username
 	
 		Withdraws the provided amount from the account belonging to the user with the given Minecraft username
@@ -154,564 +294,944 @@ class QBank:
 		"""
 		transaction_type = "withdrawal"
 		account_id = self.get_account_id_from_mc_name(mc_name)
-		current_balance = self.check_balance_account_id(account_id)
+		with self.connection():
+			current_balance, opted_into_interest = self._locked_balance(account_id)
 		
-		try:
-			new_balance = self.subtract_from_balance(current_balance, amount)
-			self.create_transaction(transaction_type, sender_id = account_id, transaction_amount = amount)
-			self.update_balance(account_id, new_balance)
-		except InsufficientFundsError:
-			raise InsufficientFundsError(f"{mc_name} has insufficient funds for this transaction")
+			try:
+				new_balance = self.subtract_from_balance(current_balance, amount)
+				self.create_transaction(transaction_type, sender_id = account_id, transaction_amount = amount)
+				self.update_balance(account_id, new_balance, current_balance, opted_into_interest)
+			except InsufficientFundsError:
+				raise InsufficientFundsError(f"{mc_name} has insufficient funds for this transaction")
 	
-	def client_transfer(self, sender_dc_id, recipient_mc_name, amount=(0,0,0,0,0)):
+	def client_transfer(self, sender_dc_id, recipient_mc_name, amount=ZERO):
 		"""Transfers the provided amount from the sender's account to the recipient's account, intended for client use through bot command
 		"""
-		transaction_type = "transfer"
 		sender_account_id = self.get_account_id_from_dc_id(sender_dc_id)
 		recip_account_id = self.get_account_id_from_mc_name(recipient_mc_name)
 		
-		sender_balance = self.check_balance_dc_id(sender_dc_id)
-		recip_balance = self.check_balance_mc_name(recipient_mc_name)
-		
 		if sender_account_id != recip_account_id:
-			try:
-				sender_new_balance = self.subtract_from_balance(sender_balance, amount)
-				recip_new_balance = self.add_to_balance(recip_balance, amount)
-				
-				self.create_transaction(transaction_type, sender_account_id, recip_account_id, amount)
-				self.update_balance(sender_account_id, sender_new_balance)
-				self.update_balance(recip_account_id, recip_new_balance)
-			except InsufficientFundsError:
-				self.open()
-				query = "SELECT mc_name FROM accounts WHERE account_id = %s"
-				data = [sender_account_id]
-				self.cursor.execute(query, data)
-				record = self.cursor.fetchone()
-				sender_mc_name = record[0]
-				self.close()
-				
-				raise InsufficientFundsError(f"User {sender_mc_name} has insufficient funds for this transaction")
+			self.transfer(sender_account_id, recip_account_id, amount)
 		else:
 			raise Exception("Cannot pay yourself")
 	
-	def manager_transfer(self, sender_mc_name, recip_mc_name, amount=(0,0,0,0,0)):
+	def manager_transfer(self, sender_mc_name, recip_mc_name, amount=ZERO):
 		"""Transfers the provided amount from the sender's account to the recipient's account, intended for bank manager use through bot command or code
 		"""
-		transaction_type = "transfer"
 		sender_account_id = self.get_account_id_from_mc_name(sender_mc_name)
 		recip_account_id = self.get_account_id_from_mc_name(recip_mc_name)
 		
-		sender_balance = self.check_balance_mc_name(sender_mc_name)
-		recip_balance = self.check_balance_mc_name(recip_mc_name)
+		self.transfer(sender_account_id, recip_account_id, amount)
+	
+	def transfer(self, sender_account_id, recip_account_id, amount=ZERO):
+		"""Transfers the provided amount between the accounts with the given ids as a single database transaction
+		
+		Both account rows are locked with SELECT ... FOR UPDATE in account id order, so concurrent transfers between overlapping accounts can't lose updates or deadlock
+		Raises an insufficient funds error if the sender can't cover the amount, in which case nothing is written
+		"""
+		transaction_type = "transfer"
 		
-		try:
-			sender_new_balance = self.subtract_from_balance(sender_balance, amount)
-			recip_new_balance = self.add_to_balance(recip_balance, amount)
+		if sender_account_id == recip_account_id:
+			raise Exception("Cannot transfer funds from an account to itself")
+		
+		with self.connection() as cursor:
+			query = "SELECT account_id, mc_name, netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds, opted_into_interest FROM accounts WHERE account_id IN (%s, %s) ORDER BY account_id FOR UPDATE"
+			data = sorted([sender_account_id, recip_account_id])
+			cursor.execute(query, data)
+			records = {record[0]: record for record in cursor.fetchall()}
 			
-			self.create_transaction(transaction_type, sender_account_id, recip_account_id, amount)
-			self.update_balance(sender_account_id, sender_new_balance)
-			self.update_balance(recip_account_id, recip_new_balance)
-		except InsufficientFundsError:
-			self.open()
-			query = "SELECT mc_name FROM accounts WHERE account_id = %s"
-			data = [sender_account_id]
-			self.cursor.execute(query, data)
-			record = self.cursor.fetchone()
-			sender_mc_name = record[0]
-			self.close()
+			if sender_account_id not in records or recip_account_id not in records:
+				raise AccountNotFoundError("Found no account for one of the parties to this transfer")
+			
+			sender_record = records[sender_account_id]
+			recip_record = records[recip_account_id]
+			sender_balance = Amount.from_denominations(sender_record[2:7])
+			recip_balance = Amount.from_denominations(recip_record[2:7])
+			try:
+				sender_new_balance = self.subtract_from_balance(sender_balance, amount)
+			except InsufficientFundsError:
+				raise InsufficientFundsError(f"User {sender_record[1]} has insufficient funds for this transaction")
+			recip_new_balance = recip_balance + amount
 			
-			raise InsufficientFundsError(f"User {sender_mc_name} has insufficient funds for this transaction")
+			self.create_transaction(transaction_type, sender_account_id, recip_account_id, amount)
+			self.update_balance(sender_account_id, sender_new_balance, sender_balance, sender_record[7])
+			self.update_balance(recip_account_id, recip_new_balance, recip_balance, recip_record[7])
+
+	def apply_batch(self, operations, chunk_size=200):
+		"""Applies a batch of deposits, withdrawals and transfers, intended for bank manager use through bot command
+		
+		operations is a list of (operation, Minecraft username, recipient's Minecraft username or None, amount) tuples, where operation is deposit, withdraw or transfer
+		Every operation is validated before anything is applied, and if any of them is invalid nothing is applied
+		Valid batches are applied chunk_size operations at a time, each chunk as one database transaction with its accounts locked, and operations that would overdraw an account are skipped
+		Returns a list holding an (applied, message) tuple for each operation
+		"""
+		results = [None] * len(operations)
+		account_ids = {}
+		resolved = []
+		for i, (operation, mc_name, recip_mc_name, amount) in enumerate(operations):
+			try:
+				if operation not in BATCH_TRANSACTION_TYPES:
+					raise ValueError(f"Unknown operation {operation}")
+				if amount.any_negative() or not amount:
+					raise ValueError("Amount must be positive")
+				
+				account_id = self._batch_account_id(account_ids, mc_name)
+				recip_account_id = None
+				if operation == "transfer":
+					if not recip_mc_name:
+						raise ValueError("Transfers need a recipient")
+					recip_account_id = self._batch_account_id(account_ids, recip_mc_name)
+					if recip_account_id == account_id:
+						raise ValueError("Cannot transfer funds from an account to itself")
+				resolved.append((i, operation, account_id, recip_account_id, amount))
+			except (ValueError, AccountNotFoundError, InvalidPlayerError) as e:
+				results[i] = (False, str(e))
+		
+		if any(results):
+			return [result or (False, "Not applied because other operations in the batch are invalid") for result in results]
+		
+		for start in range(0, len(resolved), chunk_size):
+			chunk = resolved[start:start + chunk_size]
+			with self.connection() as cursor:
+				ids = sorted({operation[2] for operation in chunk} | {operation[3] for operation in chunk if operation[3] is not None})
+				placeholders = ", ".join(["%s"] * len(ids))
+				query = f"SELECT account_id, mc_name, netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds, opted_into_interest FROM accounts WHERE account_id IN ({placeholders}) ORDER BY account_id FOR UPDATE"
+				cursor.execute(query, ids)
+				records = cursor.fetchall()
+				names = {record[0]: record[1] for record in records}
+				old_balances = {record[0]: (Amount.from_denominations(record[2:7]), record[7]) for record in records}
+				balances = {account_id: old_balances[account_id][0] for account_id in old_balances}
+				
+				changed = set()
+				transactions = []
+				for i, operation, account_id, recip_account_id, amount in chunk:
+					if operation == "deposit":
+						balances[account_id] += amount
+						transactions.append((BATCH_TRANSACTION_TYPES[operation], None, account_id, amount))
+					else:
+						new_balance = balances[account_id] - amount
+						if new_balance.any_negative():
+							results[i] = (False, f"User {names[account_id]} has insufficient funds for this transaction")
+							continue
+						balances[account_id] = new_balance
+						if operation == "transfer":
+							balances[recip_account_id] += amount
+							changed.add(recip_account_id)
+						transactions.append((BATCH_TRANSACTION_TYPES[operation], account_id, recip_account_id, amount))
+					changed.add(account_id)
+					results[i] = (True, "Applied")
+				
+				self.update_balances({account_id: balances[account_id] for account_id in changed}, old_balances)
+				self.create_transactions(transactions)
+		
+		return results
+	
+	def _batch_account_id(self, account_ids, mc_name):
+		"""Returns the account id for the Minecraft name, remembering it in account_ids for the rest of the batch
+		"""
+		key = mc_name.lower()
+		if key not in account_ids:
+			account_ids[key] = self.get_account_id_from_mc_name(mc_name)
+		return account_ids[key]
 
-	def create_transaction(self, transaction_type, sender_id=None, recipient_id=None, transaction_amount=[0,0,0,0,0]):
+	def create_transaction(self, transaction_type, sender_id=None, recipient_id=None, transaction_amount=ZERO):
 		"""Logs a transaction with the given information in the database
 		"""
-		self.open()
-		query = "INSERT INTO transactions (transaction_type, sender_account_id, recipient_account_id, netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-		data = [transaction_type, sender_id, recipient_id] + transaction_amount
-		self.cursor.execute(query, tuple(data))
-		self.db.commit()
-		self.close()
+		with self.connection():
+			self._statement("insert_transaction").execute([transaction_type, sender_id, recipient_id] + transaction_amount.denominations())
+			self._record_ledger_entries([(transaction_type, sender_id, recipient_id, transaction_amount)])
+	
+	def create_transactions(self, transactions):
+		"""Logs several transactions at once from a list of (transaction type, sender id, recipient id, amount) tuples
+		"""
+		if not transactions:
+			return
+		with self.connection() as cursor:
+			query = "INSERT INTO transactions (transaction_type, sender_account_id, recipient_account_id, netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+			data = [[transaction_type, sender_id, recipient_id] + amount.denominations() for transaction_type, sender_id, recipient_id, amount in transactions]
+			cursor.executemany(query, data)
+			self._record_ledger_entries(transactions)
+	
+	def _record_ledger_entries(self, transactions):
+		"""Appends the balance changes made by a list of (transaction type, sender id, recipient id, amount) tuples to the ledger
+		
+		Every transaction takes its amount out of the sender's balance and adds it to the recipient's, so each party gets an entry with the other as its counterparty
+		The ledger is only ever appended to, so it holds the full history of every balance
+		"""
+		entries = []
+		for transaction_type, sender_id, recipient_id, amount in transactions:
+			if sender_id is not None:
+				entries.append([sender_id, transaction_type, recipient_id, -amount.netherite, -amount.diamonds])
+			if recipient_id is not None:
+				entries.append([recipient_id, transaction_type, sender_id, amount.netherite, amount.diamonds])
+		if not entries:
+			return
+		with self.connection() as cursor:
+			#a single transaction's one or two entries go through the prepared statement, larger batches as one multi-row insert
+			if len(entries) <= 2:
+				statement = self._statement("insert_ledger_entry")
+				for entry in entries:
+					statement.execute(entry)
+			else:
+				cursor.executemany(STATEMENTS["insert_ledger_entry"], entries)
 	
 	def check_balance_mc_name(self, mc_name):
-		"""Returns a list containing the balance for the account associated with the given Minecraft username
-		"""
-		uuid = self.get_player_uuid(mc_name)
-		if (self.account_exists_mc_uuid(uuid)):
-			self.open()
-			query = "SELECT netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds FROM accounts WHERE mc_uuid = %s"
-			data = [uuid]
-			self.cursor.execute(query, data)
-			record = list(self.cursor.fetchone())
-			self.close()
-			return record
-		else:
+		"""Returns the balance for the account associated with the given Minecraft username
+		"""
+		account = self.get_account_by_uuid(self.get_player_uuid(mc_name))
+		if account is None:
 			raise AccountNotFoundError(f"Found no account belonging to user {mc_name}")
+		return account.balance
 	
 	def check_balance_dc_id(self, dc_id):
-		"""Returns a list containing the balance for the account associated with the given Discord id
-		"""
-		if (self.account_exists_dc_id(dc_id)):
-			self.open()
-			query = "SELECT netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds FROM accounts WHERE dc_id = %s"
-			data = [dc_id]
-			self.cursor.execute(query, data)
-			record = list(self.cursor.fetchone())
-			self.close()
-			return record
-		else:
+		"""Returns the balance for the account associated with the given Discord id
+		"""
+		account = self.get_account_by_dc_id(dc_id)
+		if account is None:
 			raise AccountNotFoundError(f"Found no account associated with your discord id")
+		return account.balance
 	
 	def check_balance_account_id(self, account_id):
-		"""Returns a list containing the balance for the account associated with the given account id
+		"""Returns the balance for the account associated with the given account id
 		"""
-		self.open()
-		query = "SELECT netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds FROM accounts WHERE account_id = %s"
-		data = [account_id]
-		self.cursor.execute(query, data)
-		record = list(self.cursor.fetchone())
-		self.close()
-		return record
+		account = self.get_account_by_id(account_id)
+		if account is None:
+			raise AccountNotFoundError(f"Found no account with id {account_id}")
+		return account.balance
 	
-	def loan(self, mc_name, amount=[0,0,0,0,0], days_before_due = 0):
+	def loan(self, mc_name, amount=ZERO, days_before_due = 0):
 		"""Loans the specified amount to the specified player
 		"""
-		uuid = self.get_player_uuid(mc_name)
-		interest = self.calculate_loan_interest(amount)
-		outstanding = [0,0,0,0,0]
-		
-		outstanding = self.add_to_balance(outstanding, amount)
-		outstanding = self.add_to_balance(outstanding, interest)
-		
 		account_id = self.get_account_id_from_mc_name(mc_name)
-		if self.account_has_unpaid_loan(account_id):
-			raise MultipleLoansError("Cannot take out additional loans while you still have an unpaid loan")
-			return
+		with self.connection():
+			interest = self.calculate_loan_interest(amount)
+			outstanding = amount + interest
 		
-		paid = all(i <= 0 for i in outstanding)
+			if self.account_has_unpaid_loan(account_id):
+				raise MultipleLoansError("Cannot take out additional loans while you still have an unpaid loan")
+				return
 		
-		borrowed_date = dt.datetime.now().date()
-		due_date = (borrowed_date + dt.timedelta(days=days_before_due)).date()
+			paid = not outstanding.any_positive()
 		
-		borrowed_date_str = borrowed_date.strftime("%y/%m/%d")
-		due_date_str = due_date.strftime("%y/%m/%d")
+			borrowed_date = dt.date.today()
+			due_date = borrowed_date + dt.timedelta(days=int(days_before_due))
 		
-		if not paid:
-			self.deposit(mc_name, amount)
+			if not paid:
+				self.deposit(mc_name, amount)
 			
-			self.open()
-			query = "INSERT INTO loans (loanee_id, loanee_name, borrowed_date, due_date, loaned_nb, loaned_ni, loaned_ns, loaned_db, loaned_n, interest_nb, interest_ni, interest_ns, interest_db, interest_d, outstanding_nb, outstanding_ni, outstanding_ns, outstanding_db, outstanding_d) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-			data = [account_id, mc_name, borrowed_date_str, due_date_str, amount[0], amount[1], amount[2], amount[3], amount[4], interest[0], interest[1], interest[2], interest[3], interest[4], outstanding[0], outstanding[1], outstanding[2], outstanding[3], outstanding[4]]
-			self.cursor.execute(query, data)
-			self.db.commit()
-			self.close()
+				with self.connection() as cursor:
+					query = "INSERT INTO loans (loanee_id, loanee_name, borrowed_date, due_date, loaned_nb, loaned_ni, loaned_ns, loaned_db, loaned_d, interest_nb, interest_ni, interest_ns, interest_db, interest_d, outstanding_nb, outstanding_ni, outstanding_ns, outstanding_db, outstanding_d) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+					data = [account_id, mc_name, borrowed_date, due_date] + amount.denominations() + interest.denominations() + outstanding.denominations()
+					cursor.execute(query, data)
+					self._add_to_bank_totals(principal=amount, interest=interest)
 			
-	def loan_payment_direct(self, dc_id, amount=[0,0,0,0,0]):
-		"""Makes a payment on a loan
+	def loan_payment_direct(self, dc_id, amount=ZERO):
+		"""Makes a payment on a loan out of the loanee's balance, logged as a repayment transaction
 		"""
-		account_id = self.get_account_id_from_dc_id(dc_id)
-		balance = self.check_balance_account_id(account_id)
-		outstanding = self.get_outstanding_loan_balance(account_id)
+		transaction_type = "repayment"
+		with self.connection():
+			account_id = self.get_account_id_from_dc_id(dc_id)
+			current_balance, opted_into_interest = self._locked_balance(account_id)
+			outstanding = self.get_outstanding_loan_balance(account_id)
 		
-		if not all(i >= 0 for i in amount):
-			raise ValueError("Can't pay a negative amount")
+			if amount.any_negative():
+				raise ValueError("Can't pay a negative amount")
 		
-		if self.lessthan(outstanding, amount):
-			amount = outstanding
+			amount = amount.at_most(outstanding)
 		
-		balance = self.subtract_from_balance(balance, amount)
-		self.update_balance(account_id, balance)
+			balance = self.subtract_from_balance(current_balance, amount)
+			self.create_transaction(transaction_type, sender_id = account_id, transaction_amount = amount)
+			self.update_balance(account_id, balance, current_balance, opted_into_interest)
 		
-		outstanding = self.subtract(outstanding, amount)
-		paid = all(i <= 0 for i in outstanding)
-		self.update_loan_balance(account_id, outstanding, paid)
+			outstanding = outstanding - amount
+			paid = not outstanding.any_positive()
+			self.update_loan_balance(account_id, outstanding, paid)
 
-	def loan_payment_indirect(self, mc_name, amount=[0,0,0,0,0]):
+	def loan_payment_indirect(self, mc_name, amount=ZERO):
 		"""Makes a payment on a loan
 		"""
 		account_id = self.get_account_id_from_mc_name(mc_name)
-		outstanding = self.get_outstanding_loan_balance(account_id)
-		change = 0
+		with self.connection():
+			outstanding = self.get_outstanding_loan_balance(account_id)
 		
-		if not all(i >= 0 for i in amount):
-			raise ValueError("Can't pay a negative amount")
+			if amount.any_negative():
+				raise ValueError("Can't pay a negative amount")
 		
-		if self.lessthan(outstanding, amount):
-			change = self.subtract(amount, outstanding)
-			amount = outstanding
+			change = amount - amount.at_most(outstanding)
+			amount = amount - change
 		
-		outstanding = self.subtract(outstanding, amount)
-		paid = all(i <= 0 for i in outstanding)
-		self.update_loan_balance(account_id, outstanding, paid)
+			outstanding = outstanding - amount
+			paid = not outstanding.any_positive()
+			self.update_loan_balance(account_id, outstanding, paid)
 
-		return change
+			return change
 	
 	def get_past_due_loans(self):
-		"""Returns a list of past due loans
+		"""Returns a list of (loan id, loanee name, due date, outstanding balance) tuples for every unpaid loan past its due date, oldest due date first
+		
+		Uses the (paid, due_date) index, so the cost depends on the number of overdue loans rather than the total number of loans
 		"""
-		self.open()
-		query = "SELECT loan_id, due_date FROM loans WHERE paid = FALSE"
-		self.cursor.execute(query)
-		records = self.cursor.fetchall()
-		self.close()
-
-		loan_ids = []
-		for record in records:
-			due_date = dt.strptime(record[1], "%y/%m/%d")
-			if due_date < dt.today():
-				loan_ids.append(record[0])
-		
-		loans = []
-		self.open()
-		if loan_ids:
-			for id in loan_ids:
-				query = "SELECT loan_id, due_date, outstanding_nb, outstanding_ni, outstanding_ns, outstanding_db, outstanding_d FROM loans WHERE loan_id = %s"
-				data = [id]
-				self.cursor.execute(query, data)
-				loans.append(self.cursor.fetchone())
-		self.close()
-
-		return loans
+		with self.read_connection() as cursor:
+			query = f"SELECT loan_id, loanee_name, due_date, {', '.join(OUTSTANDING_COLUMNS)} FROM loans WHERE paid = FALSE AND due_date < CURDATE() ORDER BY due_date, loan_id"
+			cursor.execute(query)
+			records = cursor.fetchall()
+		
+		return [(record[0], record[1], record[2], Amount.from_denominations(record[3:])) for record in records]
 
 	def account_has_unpaid_loan(self, account_id):
 		"""Returns true if the account has any unpaid loans
 		"""
-		self.open()
-		query = "SELECT loan_id FROM loans WHERE loanee_id = %s AND paid = FALSE"
-		data = [account_id]
-		record = self.cursor.fetchone()
-		self.close()
+		with self.connection(write=False) as cursor:
+			query = "SELECT loan_id FROM loans WHERE loanee_id = %s AND paid = FALSE"
+			data = [account_id]
+			cursor.execute(query, data)
+			record = cursor.fetchone()
 		if not record:
 			return False
 		return True
 	
 	def get_outstanding_loan_balance(self, account_id):
-		self.open()
-		query = "SELECT oustanding_nb, outstanding_ni, outstanding_ns, outstanding_db, outstanding_d FROM loans WHERE loanee_id = %s AND paid = FALSE"
-		data = [account_id]
-		self.cursor.execute(query, data)
-		outstanding_balance = self.cursor.fetchone()
-		self.close()
+		"""Returns the outstanding balance on the provided account's unpaid loan, or None if it has no unpaid loan
+		"""
+		with self.connection(write=False) as cursor:
+			query = "SELECT outstanding_nb, outstanding_ni, outstanding_ns, outstanding_db, outstanding_d FROM loans WHERE loanee_id = %s AND paid = FALSE"
+			data = [account_id]
+			cursor.execute(query, data)
+			record = cursor.fetchone()
 		
-		return outstanding_balance
+		if not record:
+			return None
+		return Amount.from_denominations(record)
 		
-	def update_loan_balance(self, account_id, new_outstanding_balance=[0,0,0,0,0], paid = False):
+	def update_loan_balance(self, account_id, new_outstanding_balance=ZERO, paid = False):
 		"""Sets the outstanding balance on the provided account's unpaid loans to the provided amount
+		
+		Payments go towards the principal first, so the loan's interest only leaves the bank totals once the loan is paid off
+		"""
+		with self.connection() as cursor:
+			query = f"SELECT {', '.join(OUTSTANDING_COLUMNS)}, {', '.join(INTEREST_COLUMNS)} FROM loans WHERE loanee_id = %s AND paid = FALSE FOR UPDATE"
+			data = [account_id]
+			cursor.execute(query, data)
+			for record in cursor.fetchall():
+				outstanding = Amount.from_denominations(record[:5])
+				interest = Amount.from_denominations(record[5:])
+				if paid:
+					self._add_to_bank_totals(principal=interest - outstanding, interest=-interest)
+				else:
+					self._add_to_bank_totals(principal=new_outstanding_balance - outstanding)
+			
+			query = "UPDATE loans SET outstanding_nb = %s, outstanding_ni = %s, outstanding_ns = %s, outstanding_db = %s, outstanding_d = %s, paid = %s WHERE loanee_id = %s AND paid = false"
+			data = new_outstanding_balance.denominations() + [paid, account_id]
+			cursor.execute(query, data)
+	
+	def get_bank_totals(self):
+		"""Returns a dict of the bank's running totals: every account's deposits, the deposits opted into interest, and the outstanding principal and interest of unpaid loans
+		
+		The totals are kept up to date by the operations that change them, so this reads a single row
 		"""
-		self.open()
-		query = "UPDATE loans SET outstanding_nb = %s, outstanding_ni = %s, outstanding_ns = %s, outstanding_db = %s, outstanding_d = %s, paid = %s WHERE loanee_id = %s AND paid = false"
-		data = [amount[0], amount[1], amount[2], amount[3], amount[4], paid, account_id]
-		self.cursor.execute(query, data)
-		self.db.commit()
-		self.close()
+		with self.read_connection() as cursor:
+			query = f"SELECT {', '.join(f'{total}_netherite, {total}_diamonds' for total in BANK_TOTALS)} FROM bank_totals WHERE totals_id = 1"
+			cursor.execute(query)
+			record = cursor.fetchone()
+		return {total: Amount(record[2 * i], record[2 * i + 1]) for i, total in enumerate(BANK_TOTALS)}
 	
 	def get_loanable_amount(self):
-		"""Calculates the total amount the bank can currently loan out
+		"""Calculates the total amount the bank can currently loan out, the opted in deposits less the outstanding loan principal
 		"""
-		self.open()
-		result = [0,0,0,0,0]
-		total_interest = [0,0,0,0,0]
-		outstanding = [0,0,0,0,0]
-		
-		query = "SELECT netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds FROM accounts WHERE opted_into_interest = TRUE"
-		self.cursor.execute(query)
-		balances = self.cursor.fetchall()
-		
-		for balance in balances:
-			result = self.add(result, balance)
-		
-		query = "SELECT outstanding_nb, outstanding_ni, outstanding_ns, outstanding_db, outstanding_d FROM loans WHERE paid = FALSE"
-		self.cursor.execute(query)
-		outstanding_loans = self.cursor.fetchall()
-		
-		for loan in outstanding_loans:
-			outstanding = self.add(outstanding, loan)
-		
-		query = "SELECT interest_nb, interest_ni, interest_ns, interest_db, interest_d FROM loans WHERE paid = FALSE"
-		self.cursor.execute(query)
-		outstanding_interests = self.cursor.fetchall()
-		
-		for interest in outstanding_interests:
-			outstanding = self.subtract(outstanding, interest)
-		
-		result = self.subtract(result, outstanding)
+		totals = self.get_bank_totals()
+		return totals["opted_in"] - totals["principal"]
+	
+	def verify_bank_totals(self, repair=False):
+		"""Checks the bank_totals row against totals recomputed from every account and unpaid loan
 		
-		self.close()
+		The row is locked while the totals are recomputed, so no operation can change them in between
+		With repair, mismatched totals are overwritten with the recomputed ones, which is needed after changing accounts or loans outside QBank, e.g. opting an account into interest by hand
+		Returns a dict with ok, the names of the mismatched totals, and the stored and recomputed totals
+		"""
+		with self.connection() as cursor:
+			query = f"SELECT {', '.join(f'{total}_netherite, {total}_diamonds' for total in BANK_TOTALS)} FROM bank_totals WHERE totals_id = 1 FOR UPDATE"
+			cursor.execute(query)
+			record = cursor.fetchone()
+			stored = {total: Amount(record[2 * i], record[2 * i + 1]) for i, total in enumerate(BANK_TOTALS)}
+			
+			cursor.execute(migrations.RECOMPUTE_BANK_TOTALS)
+			record = cursor.fetchone()
+			actual = {total: Amount(record[2 * i], record[2 * i + 1]) for i, total in enumerate(BANK_TOTALS)}
+			
+			mismatched = [total for total in BANK_TOTALS if stored[total] != actual[total]]
+			if mismatched:
+				logger.warning("bank totals don't match a recompute mismatched=%s repair=%s", ",".join(mismatched), repair)
+				if repair:
+					migrations.fill_bank_totals(cursor)
 		
-		return result
+		return {"ok": not mismatched, "mismatched": mismatched, "stored": stored, "actual": actual}
 	
-	def calculate_loan_interest(self, amount=[0,0,0,0,0]):
+	def calculate_loan_interest(self, amount=ZERO):
 		"""Calculates the interest for the given amount
-		"""
-		result = [0,0,0,0,0]
-		
-		scrap_value = ((float(amount[0]) * 9.0) + float(amount[1])) * (2.0/9.0) % 1
 		
-		result[1] = math.floor(((float(amount[0]) * 9.0) + float(amount[1])) * (2.0/9.0))
-		result[2] = math.ceil(scrap_value / 0.25) + math.ceil(float(amount[2]) * (2.0/9.0))
-		result[4] = math.ceil(((float(amount[3]) * 9.0) + float(amount[4])) * (2.0/9.0))
-		result = self.add_to_balance(result)
+		Interest is 2/9 of the amount; netherite ingots round down with the remainder rounded up to the nearest scrap, while scrap and diamonds round up
+		"""
+		ingots, scrap = divmod(amount.netherite, SCRAP_PER_INGOT)
+		interest_ingots, remainder = divmod(ingots * 2, INGOTS_PER_BLOCK)
+		interest_scrap = -(-remainder * SCRAP_PER_INGOT // INGOTS_PER_BLOCK) + -(-scrap * 2 // INGOTS_PER_BLOCK)
+		interest_diamonds = -(-amount.diamonds * 2 // DIAMONDS_PER_BLOCK)
 		
-		return result
+		return Amount(interest_ingots * SCRAP_PER_INGOT + interest_scrap, interest_diamonds)
 	
 	
 	def get_recent_transactions(self, dc_id):
 		"""Returns a list of the 5 most recent transactions on the account associated with the discord id, or all if there are <5 transactions
 		"""
+		return self.get_transactions_page(dc_id, limit=5)[::-1]
+	
+	def get_transactions_page(self, dc_id, before_id=None, limit=10):
+		"""Returns up to limit transactions on the account associated with the discord id, newest first
+		
+		Each row holds the transaction's columns followed by the sender's and recipient's Minecraft names
+		To get the next page, pass the transaction id of the last transaction on this page as before_id
+		"""
 		account_id = self.get_account_id_from_dc_id(dc_id)
-		self.open()
-		query = "SELECT * FROM transactions WHERE sender_account_id = %s OR recipient_account_id = %s"
-		data = [account_id, account_id]
-		self.cursor.execute(query, data)
-		records = self.cursor.fetchall()
-		self.close()
-		
-		length = len(records)
-		if length > 5:
-			return records[-5:]
+		if before_id is None:
+			condition = ""
+			bounds = []
 		else:
-			return records
+			condition = " AND t.transaction_id < %s"
+			bounds = [before_id]
+		
+		with self.read_connection() as cursor:
+			query = (f"SELECT * FROM (SELECT {TRANSACTION_COLUMNS} FROM {TRANSACTION_SOURCE} WHERE t.sender_account_id = %s{condition} ORDER BY t.transaction_id DESC LIMIT %s) AS sent "
+					f"UNION ALL SELECT * FROM (SELECT {TRANSACTION_COLUMNS} FROM {TRANSACTION_SOURCE} WHERE t.recipient_account_id = %s{condition} ORDER BY t.transaction_id DESC LIMIT %s) AS received "
+					"ORDER BY transaction_id DESC LIMIT %s")
+			data = [account_id] + bounds + [limit, account_id] + bounds + [limit, limit]
+			cursor.execute(query, data)
+			records = cursor.fetchall()
+		return records
+	
+	def iter_transactions(self, dc_id, batch_size=500):
+		"""Yields every transaction on the account associated with the discord id, oldest first
+		
+		Rows are streamed from an unbuffered server-side cursor in batches of batch_size, so the full history is never held in memory
+		The generator holds a pooled connection of its own until it is exhausted or closed
+		"""
+		account_id = self.get_account_id_from_dc_id(dc_id)
+		backend, pool = self._read_target()
+		with pool.connection() as db:
+			cursor = metrics.InstrumentedCursor(backend.cursor(db, buffered=False))
+			try:
+				query = (f"SELECT {TRANSACTION_COLUMNS} FROM {TRANSACTION_SOURCE} WHERE t.sender_account_id = %s "
+						f"UNION ALL SELECT {TRANSACTION_COLUMNS} FROM {TRANSACTION_SOURCE} WHERE t.recipient_account_id = %s "
+						"ORDER BY transaction_id")
+				data = [account_id, account_id]
+				cursor.execute(query, data)
+				records = cursor.fetchmany(batch_size)
+				while records:
+					yield from records
+					records = cursor.fetchmany(batch_size)
+			finally:
+				backend.discard_results(db)
+				cursor.close()
+				db.rollback()
 	
 	def get_transactions(self, dc_id):
 		"""Returns a list of all the transactions on the account associated with the discord id
 		"""
+		return list(self.iter_transactions(dc_id))
+	
+	def take_balance_snapshots(self, chunk_size=1000):
+		"""Saves the current balance of every account whose balance changed since its last snapshot, returns the number of snapshots taken
+		
+		Each snapshot records the last ledger entry it covers, so balance_as_of only has to add up the entries after it
+		Accounts are locked chunk_size at a time while their balances are read, so no entry can be added between reading a balance and its last entry
+		"""
+		taken = 0
+		last_account_id = 0
+		while True:
+			with self.connection() as cursor:
+				query = f"SELECT account_id, {', '.join(BALANCE_COLUMNS)} FROM accounts WHERE account_id > %s ORDER BY account_id LIMIT %s FOR UPDATE"
+				data = [last_account_id, chunk_size]
+				cursor.execute(query, data)
+				records = cursor.fetchall()
+				if not records:
+					break
+				last_account_id = records[-1][0]
+				
+				placeholders = ", ".join(["%s"] * len(records))
+				account_ids = [record[0] for record in records]
+				query = f"SELECT account_id, MAX(entry_id) FROM ledger WHERE account_id IN ({placeholders}) GROUP BY account_id"
+				cursor.execute(query, account_ids)
+				last_entries = dict(cursor.fetchall())
+				query = f"SELECT account_id, MAX(last_entry_id) FROM balance_snapshots WHERE account_id IN ({placeholders}) GROUP BY account_id"
+				cursor.execute(query, account_ids)
+				last_snapshots = dict(cursor.fetchall())
+				
+				snapshots = []
+				for record in records:
+					last_entry_id = last_entries.get(record[0])
+					if last_entry_id is not None and last_entry_id != last_snapshots.get(record[0]):
+						balance = Amount.from_denominations(record[1:])
+						snapshots.append([record[0], last_entry_id, balance.netherite, balance.diamonds])
+				if snapshots:
+					query = "INSERT INTO balance_snapshots (account_id, last_entry_id, netherite, diamonds) VALUES (%s, %s, %s, %s)"
+					cursor.executemany(query, snapshots)
+				taken += len(snapshots)
+		return taken
+	
+	def balance_as_of(self, account_id, moment):
+		"""Returns the account's balance at the given moment, i.e. after every change made before it
+		
+		moment is a datetime, or a date for the balance at the start of that day
+		Starts from the account's latest snapshot taken before the moment and adds up the ledger entries since, so at most one snapshot interval's entries are read
+		"""
+		moment = self._as_datetime(moment)
+		with self.read_connection() as cursor:
+			query = "SELECT last_entry_id, netherite, diamonds, taken_at FROM balance_snapshots WHERE account_id = %s AND taken_at < %s ORDER BY taken_at DESC, snapshot_id DESC LIMIT 1"
+			data = [account_id, moment]
+			cursor.execute(query, data)
+			snapshot = cursor.fetchone()
+			
+			if snapshot is None:
+				query = "SELECT COALESCE(SUM(netherite), 0), COALESCE(SUM(diamonds), 0) FROM ledger WHERE account_id = %s AND created_at < %s"
+				data = [account_id, moment]
+				balance = ZERO
+			else:
+				#entries after the snapshot were written after it was taken, so they can't be older than it
+				query = "SELECT COALESCE(SUM(netherite), 0), COALESCE(SUM(diamonds), 0) FROM ledger WHERE account_id = %s AND created_at >= %s AND created_at < %s AND entry_id > %s"
+				data = [account_id, snapshot[3], moment, snapshot[0]]
+				balance = Amount(snapshot[1], snapshot[2])
+			cursor.execute(query, data)
+			record = cursor.fetchone()
+		return balance + Amount(record[0], record[1])
+	
+	def get_statement(self, account_id, start, end):
+		"""Returns the account's statement for the period from start up to (not including) end, which are dates or datetimes
+		
+		The statement is a dict holding the opening balance, the closing balance, and the period's ledger entries oldest first
+		Each entry is an (entry id, time, type, counterparty's Minecraft name or None, amount) tuple, where the amount is negative for money leaving the account
+		"""
+		start = self._as_datetime(start)
+		end = self._as_datetime(end)
+		with self.read_connection() as cursor:
+			opening = self.balance_as_of(account_id, start)
+			query = ("SELECT l.entry_id, l.created_at, l.entry_type, c.mc_name, l.netherite, l.diamonds FROM ledger l LEFT JOIN accounts c ON c.account_id = l.counterparty_account_id "
+					"WHERE l.account_id = %s AND l.created_at >= %s AND l.created_at < %s ORDER BY l.entry_id")
+			data = [account_id, start, end]
+			cursor.execute(query, data)
+			entries = [record[:4] + (Amount(record[4], record[5]),) for record in cursor.fetchall()]
+		closing = sum((entry[4] for entry in entries), opening)
+		return {"opening": opening, "closing": closing, "entries": entries}
+	
+	def iter_ledger(self, account_id, start=None, end=None, batch_size=500):
+		"""Yields the account's ledger entries from start up to (not including) end, oldest first, in the same form as get_statement's entries
+		
+		start and end are dates or datetimes, and either can be None for no limit
+		Like iter_transactions, rows are streamed from an unbuffered server-side cursor on a pooled connection of the generator's own
+		"""
+		conditions = ""
+		bounds = []
+		if start is not None:
+			conditions += " AND l.created_at >= %s"
+			bounds.append(self._as_datetime(start))
+		if end is not None:
+			conditions += " AND l.created_at < %s"
+			bounds.append(self._as_datetime(end))
+		
+		backend, pool = self._read_target()
+		with pool.connection() as db:
+			cursor = metrics.InstrumentedCursor(backend.cursor(db, buffered=False))
+			try:
+				query = ("SELECT l.entry_id, l.created_at, l.entry_type, c.mc_name, l.netherite, l.diamonds FROM ledger l LEFT JOIN accounts c ON c.account_id = l.counterparty_account_id "
+						f"WHERE l.account_id = %s{conditions} ORDER BY l.entry_id")
+				data = [account_id] + bounds
+				cursor.execute(query, data)
+				records = cursor.fetchmany(batch_size)
+				while records:
+					for record in records:
+						yield record[:4] + (Amount(record[4], record[5]),)
+					records = cursor.fetchmany(batch_size)
+			finally:
+				backend.discard_results(db)
+				cursor.close()
+				db.rollback()
+	
+	def get_monthly_statement(self, dc_id, year, month):
+		"""Returns the statement for the given calendar month for the account associated with the given discord id
+		"""
 		account_id = self.get_account_id_from_dc_id(dc_id)
-		self.open()
-		query = "SELECT * FROM transactions WHERE sender_account_id = %s OR recipient_account_id = %s"
-		data = [account_id, account_id]
-		self.cursor.execute(query, data)
-		records = self.cursor.fetchall()
-		self.close()
-		return records
+		start = dt.date(year, month, 1)
+		end = dt.date(year + month // 12, month % 12 + 1, 1)
+		return self.get_statement(account_id, start, end)
+	
+	def _as_datetime(self, moment):
+		if isinstance(moment, dt.datetime):
+			return moment
+		return dt.datetime(moment.year, moment.month, moment.day)
 	
 	def get_account_id_from_mc_name(self, mc_name):
 		"""Returns the account id for the account associated with the given Minecraft name
 		"""
-		uuid = self.get_player_uuid(mc_name)
-		if (self.account_exists_mc_uuid(uuid)):
-			self.open()
-			query = "SELECT account_id FROM accounts WHERE mc_uuid = %s"
-			data = [uuid]
-			self.cursor.execute(query, data)
-			record = list(self.cursor.fetchone())
-			self.close()
-			return record[0]
-		else:
+		account = self.get_account_by_uuid(self.get_player_uuid(mc_name))
+		if account is None:
 			raise AccountNotFoundError(f"Found no account belonging to user {mc_name}")
+		return account.account_id
 		
 	def get_account_id_from_dc_id(self, dc_id):
 		"""Returns the account id for the account associated with the given Discord id
 		"""
-		if (self.account_exists_dc_id(dc_id)):
-			self.open()
-			query = "SELECT account_id FROM accounts WHERE dc_id = %s"
-			data = [dc_id]
-			self.cursor.execute(query, data)
-			record = list(self.cursor.fetchone())
-			self.close()
-			return record[0]
-		else:
+		account = self.get_account_by_dc_id(dc_id)
+		if account is None:
 			raise AccountNotFoundError(f"Found no account associated your discord id")
+		return account.account_id
 	
 	def get_player_uuid(self, mc_name):
 		"""Returns the uuid for the given Minecraft player, raises an exception if invalid
 		"""
-		player = GetPlayerData(mc_name)
+		uuid = self.players.get_uuid(mc_name)
 		
-		if player.valid:
-			return player.uuid
+		if uuid is not None:
+			return uuid
 		else:
 			raise InvalidPlayerError(f"No UUID for player with name {mc_name}")
 	
 	def get_player_name(self, dc_id):
 		"""Returns the Minecraft username for the owner of the account associated with the given discord id
 		"""
-		if (self.account_exists_dc_id(dc_id)):
-			self.open()
-			query = "SELECT mc_name FROM accounts WHERE dc_id = %s"
-			data = [dc_id]
-			self.cursor.execute(query, data)
-			record = list(self.cursor.fetchone())
-			self.close()
-			return record[0]
-		else:
+		account = self.get_account_by_dc_id(dc_id)
+		if account is None:
 			raise AccountNotFoundError(f"Found no account associated with your discord id")
+		return account.mc_name
 	
 	def get_dc_id_from_username(self, mc_name):
 		"""Returns the discord id for the owner of the account associated with the given Minecraft username
 		"""
-		uuid = self.get_player_uuid(mc_name)
-		if (self.account_exists_mc_uuid(uuid)):
-			self.open()
-			query = "SELECT dc_id FROM accounts WHERE mc_name = %s"
-			data = [mc_name]
-			self.cursor.execute(query, data)
-			record = list(self.cursor.fetchone())
-			self.close()
-			return record[0]
-		else:
+		account = self.get_account_by_uuid(self.get_player_uuid(mc_name))
+		if account is None:
 			raise AccountNotFoundError(f"Found no account belonging to user {mc_name}")
+		return account.dc_id
 	
 	def get_player_name_from_account_id(self, account_id):
 		"""Returns the Minecraft username of the owner of the account with the given id
 		"""
-		self.open()
-		query = "SELECT mc_name FROM accounts WHERE account_id = %s"
-		data = [account_id]
-		self.cursor.execute(query, data)
-		record = list(self.cursor.fetchone())
-		self.close()
-		return record[0]
+		account = self.get_account_by_id(account_id)
+		if account is None:
+			raise AccountNotFoundError(f"Found no account with id {account_id}")
+		return account.mc_name
 		
-	def update_balance(self, account_id, new_balance=[0,0,0,0,0]):
+	def update_balance(self, account_id, new_balance=ZERO, old_balance=None, opted_into_interest=None):
 		"""Sets the provided account's balance to the provided amount
+		
+		old_balance and opted_into_interest should come from the caller's locking read of the row, and are read again if they aren't given, to keep the bank totals current
 		"""
-		self.open()
-		query = "UPDATE accounts SET netherite_blocks = %s, netherite_ingots = %s, netherite_scrap = %s, diamond_blocks = %s, diamonds = %s WHERE account_id = %s"
-		data = new_balance.copy()
-		data.append(account_id)
-		self.cursor.execute(query, data)
-		self.db.commit()
-		self.close()
+		with self.connection():
+			if old_balance is None:
+				statement = self._statement("balance_and_opt_in")
+				statement.execute([account_id])
+				record = statement.fetchone()
+				if record:
+					old_balance, opted_into_interest = Amount.from_denominations(record[:5]), record[5]
+			if old_balance is not None:
+				self._add_balance_change(new_balance - old_balance, opted_into_interest)
+			self._statement("update_balance").execute(new_balance.denominations() + [account_id])
+			self._write_through(account_id, balance=new_balance)
 	
-	def calculate_balance_interest(self, amount=[0,0,0,0,0]):
-		"""Calculates the interest for the given amount
-		"""
-		result = [0,0,0,0,0]
-		
-		result[2] = math.floor(((float(amount[0] * 9) + float(amount[1])) * 1.0/18.0) + (float(amount[2]) * 1.0/72.0))
-		result[4] = math.floor((float(amount[3] * 9) + float(amount[4])) * 1.0/36.0)
-		result = self.add_to_balance(result)
+	def update_balances(self, new_balances, old_balances=None):
+		"""Sets the balances of several existing accounts at once from a dict of account id to new balance
 		
-		return result
-	
-	def add_to_balance(self, balance=[0,0,0,0,0], amount=[0,0,0,0,0]):
-		"""Adds the provided amount to the provide balance and returns the new balance
+		The rows are written with a single multi-row INSERT ... ON DUPLICATE KEY UPDATE statement instead of one UPDATE per account, the inserted row is named with an alias, which needs MySQL 8.0.19 or later
+		old_balances is a dict of account id to (old balance, opted into interest) from the caller's locking read of the rows, and is read again if it isn't given, to keep the bank totals current
+		Raises an account not found error, writing nothing, if any of the accounts doesn't exist, so the upsert never creates an account
 		"""
-		result = balance.copy()
-		for i in range(5):
-			result[i] += amount[i]
-		
-		while result[4] >= 9:
-			result[4] -= 9
-			result[3] += 1
-		
-		while result[2] >= 4:
-			result[2] -= 4
-			result[1] += 1
+		if not new_balances:
+			return
+		with self.connection() as cursor:
+			if old_balances is None:
+				query = f"SELECT account_id, {', '.join(BALANCE_COLUMNS)}, opted_into_interest FROM accounts WHERE account_id IN ({', '.join(['%s'] * len(new_balances))}) FOR UPDATE"
+				data = list(new_balances)
+				cursor.execute(query, data)
+				old_balances = {record[0]: (Amount.from_denominations(record[1:6]), record[6]) for record in cursor.fetchall()}
+			missing = [account_id for account_id in new_balances if account_id not in old_balances]
+			if missing:
+				raise AccountNotFoundError(f"Found no account with id {', '.join(str(account_id) for account_id in missing)}")
+			for account_id, balance in new_balances.items():
+				old_balance, opted_into_interest = old_balances[account_id]
+				self._add_balance_change(balance - old_balance, opted_into_interest)
 			
-		while result[1] >= 9:
-			result[1] -= 9
-			result[0] += 1
-		
-		return result
+			query = f"INSERT INTO accounts (account_id, {', '.join(BALANCE_COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s) AS new ON DUPLICATE KEY UPDATE {', '.join(f'{column} = new.{column}' for column in BALANCE_COLUMNS)}"
+			data = [[account_id] + balance.denominations() for account_id, balance in new_balances.items()]
+			cursor.executemany(query, data)
+			for account_id, balance in new_balances.items():
+				self._write_through(account_id, balance=balance)
+	
+	def accrue_interest(self, period=None, chunk_size=1000):
+		"""Pays balance interest into every account that is opted into interest, once per accrual period
 		
-	def subtract_from_balance(self, balance=[0,0,0,0,0], amount=[0,0,0,0,0]):
-		"""Subtracts the provided amount from the provided balance then returns the new balance
+		The period is any label for the accrual, the current month ("YYYY-MM") by default
+		Accounts are processed in account id order, chunk_size at a time, and each chunk's balances, interest transactions and progress are committed together
+		Progress is kept in the interest_accruals table, so running the same period again resumes after the last committed chunk and never pays an account twice
+		Returns a dict with the period, the number of accounts paid, and the elapsed seconds and rows per second for this run
 		"""
-		result = balance.copy()
-		for i in range(5):
-			result[i] -= amount[i]
-		
-		while result[1] < 0:
-			result[0] -= 1
-			result[1] += 9
-		
-		while result[2] < 0:
-			result[1] -= 1
-			result[2] += 4
+		transaction_type = "interest"
+		if period is None:
+			period = dt.date.today().strftime("%Y-%m")
+		
+		with self.connection() as cursor:
+			query = "INSERT IGNORE INTO interest_accruals (period) VALUES (%s)"
+			data = [period]
+			cursor.execute(query, data)
+		
+		start = time.perf_counter()
+		paid = 0
+		while True:
+			with self.connection() as cursor:
+				query = "SELECT last_account_id, completed FROM interest_accruals WHERE period = %s FOR UPDATE"
+				data = [period]
+				cursor.execute(query, data)
+				last_account_id, completed = cursor.fetchone()
+				if completed:
+					break
+				
+				query = "SELECT account_id, netherite_blocks, netherite_ingots, netherite_scrap, diamond_blocks, diamonds FROM accounts WHERE opted_into_interest = TRUE AND account_id > %s ORDER BY account_id LIMIT %s FOR UPDATE"
+				data = [last_account_id, chunk_size]
+				cursor.execute(query, data)
+				records = cursor.fetchall()
+				
+				if not records:
+					query = "UPDATE interest_accruals SET completed = TRUE, completed_at = CURRENT_TIMESTAMP WHERE period = %s"
+					data = [period]
+					cursor.execute(query, data)
+					break
+				
+				new_balances = {}
+				old_balances = {}
+				interest_transactions = []
+				for record in records:
+					balance = Amount.from_denominations(record[1:])
+					interest = self.calculate_balance_interest(balance)
+					if interest:
+						new_balances[record[0]] = balance + interest
+						#only opted in accounts were selected
+						old_balances[record[0]] = (balance, True)
+						interest_transactions.append((transaction_type, None, record[0], interest))
+				
+				self.update_balances(new_balances, old_balances)
+				self.create_transactions(interest_transactions)
+				
+				query = "UPDATE interest_accruals SET last_account_id = %s, accounts_paid = accounts_paid + %s WHERE period = %s"
+				data = [records[-1][0], len(new_balances), period]
+				cursor.execute(query, data)
+				paid += len(new_balances)
+		
+		elapsed = time.perf_counter() - start
+		return {
+			"period": period,
+			"accounts_paid": paid,
+			"seconds": elapsed,
+			"rows_per_second": paid / elapsed if elapsed > 0 else 0.0
+		}
+	
+	def calculate_balance_interest(self, amount=ZERO):
+		"""Calculates the interest for the given amount
 		
-		while result[4] < 0:
-			result[3] -= 1
-			result[4] += 9
+		Interest is 1/72 of the netherite and 1/36 of the diamonds, rounded down
+		"""
+		return Amount(amount.netherite // 72, amount.diamonds // 36)
+	
+	def subtract_from_balance(self, balance=ZERO, amount=ZERO):
+		"""Subtracts the provided amount from the provided balance then returns the new balance
 		
-		if not all(i >= 0 for i in result):
+		Raises an insufficient funds error if either currency in the new balance would be negative
+		"""
+		result = balance - amount
+		if result.any_negative():
 			raise InsufficientFundsError()
-		else:
-			return result
+		return result
 	
-	def add(self, amount=[0,0,0,0,0], add=[0,0,0,0,0]):
-		result = amount.copy()
-		for i in range(5):
-			result[i] += add[i]
-		
-		while result[4] >= 9:
-			result[4] -= 9
-			result[3] += 1
+	def update_player_names(self, progress=None, chunk_size=200):
+		"""Looks up all players by uuid and updates their names if they have changed
 		
-		while result[2] >= 4:
-			result[2] -= 4
-			result[1] += 1
+		Accounts are looked up chunk_size at a time on a bounded thread pool, limited to NAME_LOOKUP_RATE requests per second and retried with backoff
+		Each chunk's changed names are written in one batch, committed together with a checkpoint, so an interrupted run resumes where it stopped
+		progress (if given) is called with (accounts checked, accounts to check) after every chunk
+		Returns a dict with the number of accounts checked, names changed, and lookups that failed
+		"""
+		job_name = "update_player_names"
+		limiter = RateLimiter(float(os.getenv('NAME_LOOKUP_RATE', 10)))
+		workers = int(os.getenv('NAME_LOOKUP_WORKERS', 8))
+		
+		with self.connection(write=False) as cursor:
+			query = "SELECT last_account_id FROM job_checkpoints WHERE job_name = %s"
+			data = [job_name]
+			cursor.execute(query, data)
+			record = cursor.fetchone()
+			last_account_id = record[0] if record else 0
 			
-		while result[1] >= 9:
-			result[1] -= 9
-			result[0] += 1
+			query = "SELECT COUNT(*) FROM accounts WHERE account_id > %s"
+			data = [last_account_id]
+			cursor.execute(query, data)
+			total = cursor.fetchone()[0]
+		
+		checked = 0
+		changed = 0
+		failed = 0
+		with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="name-lookup") as executor:
+			while True:
+				with self.connection(write=False) as cursor:
+					query = "SELECT account_id, mc_name, mc_uuid FROM accounts WHERE account_id > %s ORDER BY account_id LIMIT %s"
+					data = [last_account_id, chunk_size]
+					cursor.execute(query, data)
+					records = cursor.fetchall()
+				if not records:
+					break
+				
+				futures = [executor.submit(with_retries, self.players.lookup, record[2], limiter=limiter) for record in records]
+				new_names = []
+				for record, future in zip(records, futures):
+					try:
+						player = future.result()
+					except Exception:
+						failed += 1
+						continue
+					if player is not None and player[1] != record[1]:
+						new_names.append((player[1], record[0]))
+						self.players.remember(record[2], player[1])
+				
+				last_account_id = records[-1][0]
+				with self.connection() as cursor:
+					if new_names:
+						query = "UPDATE accounts SET mc_name = %s WHERE account_id = %s"
+						cursor.executemany(query, new_names)
+						for mc_name, account_id in new_names:
+							self._write_through(account_id, mc_name=mc_name)
+					query = "REPLACE INTO job_checkpoints (job_name, last_account_id) VALUES (%s, %s)"
+					data = [job_name, last_account_id]
+					cursor.execute(query, data)
+				
+				checked += len(records)
+				changed += len(new_names)
+				if progress is not None:
+					progress(checked, total)
 		
-		return result
+		with self.connection() as cursor:
+			query = "DELETE FROM job_checkpoints WHERE job_name = %s"
+			data = [job_name]
+			cursor.execute(query, data)
 		
-	def subtract(self, amount=[0,0,0,0,0], sub=[0,0,0,0,0]):
-		result = amount.copy()
-		for i in range(5):
-			result[i] -= sub[i]
+		return {"checked": checked, "changed": changed, "failed": failed}
+	
+	def connect(self):
+		"""Opens a new connection to the storage backend's database
+		"""
+		return self.backend.connect()
+	
+	@contextmanager
+	def connection(self, write=True):
+		"""Borrows a pooled connection to the primary for one logical operation and yields a cursor on it
+		
+		Nested uses on the same thread share the outermost connection, so a method built from other QBank methods runs on a single connection
+		The outermost block commits when it exits normally and rolls back if an exception escapes it
+		Accounts written during the block are put back in the account cache once it commits, unless another write to them began in the meantime, and left out of it if it rolls back
+		Once a block that may have written (any use without write=False) commits, the current ReadSession sends its reads to the primary from then on
+		Changes to the bank totals made during the block are written to the bank_totals row just before it commits
+		"""
+		cursor = getattr(self._local, 'cursor', None)
+		if cursor is not None:
+			if write:
+				self._local.wrote = True
+			yield cursor
+			return
 		
-		while result[1] < 0:
-			result[0] -= 1
-			result[1] += 9
+		with self.pool.connection() as db:
+			self.backend.begin(db, write)
+			cursor = metrics.InstrumentedCursor(self.backend.cursor(db))
+			self._local.db = db
+			self._local.cursor = cursor
+			self._local.pending = pending = {}
+			self._local.totals = {}
+			self._local.wrote = write
+			try:
+				yield cursor
+				self._write_bank_totals()
+				db.commit()
+			except BaseException:
+				db.rollback()
+				for account_id, (account, token) in pending.items():
+					self.accounts.end_write(account_id, token)
+				raise
+			else:
+				for account_id, (account, token) in pending.items():
+					self.accounts.end_write(account_id, token, account)
+				session = current_session.get()
+				if self._local.wrote and session is not None:
+					session.wrote = True
+			finally:
+				self._local.wrote = False
+				self._local.db = None
+				self._local.cursor = None
+				self._local.pending = None
+				self._local.totals = None
+				cursor.close()
+	
+	@contextmanager
+	def read_connection(self):
+		"""Yields a cursor for a read-only operation, on a replica if one is within REPLICA_MAX_LAG and the current ReadSession hasn't written yet, otherwise on the primary
 		
-		while result[2] < 0:
-			result[1] -= 1
-			result[2] += 4
+		Inside a connection() block the read shares that block's connection, so it sees the block's own writes
+		Account rows are always read from the primary (see _load_account), since they fill the account cache, which a lagging replica would fill with stale balances
+		"""
+		cursor = getattr(self._local, 'cursor', None) or getattr(self._local, 'read_cursor', None)
+		if cursor is not None:
+			yield cursor
+			return
 		
-		while result[4] < 0:
-			result[3] -= 1
-			result[4] += 9
-			
-		return result
+		backend, pool = self._read_target()
+		if pool is self.pool:
+			with self.connection(write=False) as cursor:
+				yield cursor
+			return
+		
+		with pool.connection() as db:
+			cursor = metrics.InstrumentedCursor(backend.cursor(db))
+			self._local.read_cursor = cursor
+			try:
+				yield cursor
+			finally:
+				self._local.read_cursor = None
+				cursor.close()
+				db.rollback()
 	
-	def update_player_names(self):
-		"""Looks up all players by uuid and updates their names if they have changed
+	def _read_target(self):
+		"""Returns the (backend, pool) a read outside any connection() block should use
 		"""
-		self.open()
-		query = "SELECT mc_name, mc_uuid FROM accounts"
-		self.cursor.execute(query)
-		records = self.cursor.fetchall()
-		
-		for record in records:
-			name = record[0]
-			uuid = record[1]
-			
-			player = GetPlayerData(uuid)
-			if player.username != name:
-				new_name = player.username
-				query = "UPDATE accounts SET mc_name = %s WHERE mc_uuid = %s"
-				data = [new_name, uuid]
-				self.cursor.execute(query, data)
-		
-		self.db.commit()
-		self.close()
-	
-	def lessthan(self, amount1=[0,0,0,0,0], amount2=[0,0,0,0,0]):
-		"""Returns true if amount1 < amount2, false if amount1 >= amount2
-			DOES NOT WORK FOR NEGATIVE VALUES
-		"""
-		testlist = self.subtract(amount1, amount2)
-		result = all(i <= 0 for i in testlist)
-		return result
+		session = current_session.get()
+		replica = None if session is not None and session.wrote else self.replicas.choose()
+		if replica is None:
+			metrics.READS.inc(target="primary")
+			return self.backend, self.pool
+		metrics.READS.inc(target="replica")
+		return replica.backend, replica.pool
 	
-	def open(self):
-		try:
-			self.db = mysql.connect(
-				host = os.getenv('MYSQL_HOST'),
-				user = os.getenv('MYSQL_USER'),
-				passwd = os.getenv('MYSQL_PASSWORD'),
-				auth_plugin = os.getenv('AUTH_PLUGIN'),
-				database = os.getenv('DATABASE')
-			)
-			print(self.db)
-		except Error as e:
-			print(f"The error '{e}' occurred")
-	
-		self.cursor = self.db.cursor()
+	def _write_bank_totals(self):
+		"""Adds the bank total changes recorded during the current connection() block to the bank_totals row
+		"""
+		totals = self._local.totals
+		if not any(totals.values()):
+			return
+		data = []
+		for total in BANK_TOTALS:
+			change = totals.get(total, ZERO)
+			data += [change.netherite, change.diamonds]
+		self._statement("add_to_bank_totals").execute(data)
+	
+	def _statement(self, name):
+		"""Returns the named statement from STATEMENTS, prepared on the current connection the first time it is used there
+		
+		Must be called inside a connection() block, the statement runs in that block's database transaction
+		"""
+		return metrics.InstrumentedCursor(self.backend.prepare(self._local.db, name, STATEMENTS[name]))
 	
 	def close(self):
-		self.db.close()
+		"""Waits for any player lookups in flight, then closes every pooled connection
+		"""
+		self.players.close()
+		self.pool.close()
+		self.replicas.close()
 	#end QBank
\ No newline at end of file
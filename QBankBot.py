@@ -1,71 +1,74 @@
 #QBankBot.py
 import os
+import io
+import csv
+import json
+import gzip
+import time
+import tempfile
+import datetime as dt
+import asyncio
+import logging
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from dotenv import load_dotenv
-from QBank import QBank
+from async_qbank import AsyncQBank
+from scheduler import AccountScheduler
+from notifications import UserResolver, DMQueue
 import mysql.connector
 from exceptions import *
+from amount import Amount, ZERO, build_amount, get_amount_as_string
+import metrics
+import replicas
 
+#startup times are measured from here, see on_ready and start_bank
+STARTED_AT = time.perf_counter()
 load_dotenv()
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("QBankBot")
 TOKEN = os.getenv('DISCORD_TOKEN')
 MANAGER_ID = os.getenv('MANAGER_ID')
 bot = commands.Bot(command_prefix='q!')
-qb = QBank()
+#the QBank connects to the database lazily, start_bank warms it up in the background once the bot is online
+qb = AsyncQBank()
+bank_startup = None
+#how many recently active accounts are loaded into the caches at startup, 0 to skip
+PRELOAD_ACCOUNTS = int(os.getenv('PRELOAD_ACCOUNTS', 500))
+#commands that change balances go through the scheduler, so commands on the same account run one at a time
+scheduler = AccountScheduler(qb)
+#notifications are sent in the background by the DM queue, so commands don't wait on the Discord API
+#several notifications to one user within DM_COALESCE_SECONDS are sent as one message, and no more than DM_RATE are sent per second
+users = UserResolver(bot, max_size=int(os.getenv('USER_CACHE_SIZE', 1024)))
+dms = DMQueue(users, window=float(os.getenv('DM_COALESCE_SECONDS', 1)), rate=float(os.getenv('DM_RATE', 1)), burst=int(os.getenv('DM_BURST', 5)))
 
-#suffixes for different currency denominations
-suffixes = ["nb", "ni", "ns", "db", "d"]
+#where to export metrics: a file rewritten every METRICS_DUMP_SECONDS and/or a local HTTP endpoint, both off unless set
+METRICS_FILE = os.getenv('METRICS_FILE')
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_DUMP_SECONDS = float(os.getenv('METRICS_DUMP_SECONDS', 60))
+if METRICS_PORT:
+	metrics.start_http_server(int(METRICS_PORT))
 
-def build_amount_list(args):
-	result = [0,0,0,0,0]
-	for i in range(len(args)):
-		for suffix in suffixes:
-			value = args[i]
-			
-			if value.endswith(suffix):
-				value = value.removesuffix(suffix)
-				result[suffixes.index(suffix)] += int(value)
-	
-	return result
+#reactions for turning pages of transaction history, and how many seconds to wait for them
+PAGE_REACTIONS = ["\u25c0\ufe0f", "\u25b6\ufe0f"]
+PAGE_TIMEOUT = 120
+TRANSACTIONS_PAGE_SIZE = 10
 
-def get_last_nonzero_index(amount):
-	try:
-		return [i for i, e in enumerate(amount) if e != 0][-1]
-	except IndexError as e:
-		return -1
-
-def get_amount_as_string(amount):
-	result = ""
-	last_nonzero = get_last_nonzero_index(amount)
-	
-	if last_nonzero != -1:
-		for i in range(5):
-			if amount[i] != 0:
-				if i < last_nonzero:
-					result += str(amount[i]) + suffixes[i] + " "
-				else:
-					result += str(amount[i]) + suffixes[i]
-	else:
-		result = "0nb 0ni 0ns 0db 0d"
-		
-	return result
+#the largest statement file the bot will try to send, Discord's attachment limit
+STATEMENT_MAX_BYTES = int(os.getenv('STATEMENT_MAX_BYTES', 8 * 1024 * 1024))
+
+#how often the manager is sent a digest of past due loans
+PAST_DUE_SWEEP_HOURS = float(os.getenv('PAST_DUE_SWEEP_HOURS', 24))
+
+#how often balance snapshots are taken, which bounds how much of the ledger a balance or statement lookup reads
+BALANCE_SNAPSHOT_HOURS = float(os.getenv('BALANCE_SNAPSHOT_HOURS', 24))
 
 def format_transactions(transactions):
-	trans = list(transactions)
-	
 	result = "```Transaction ID      Transaction Type    Sender              Recipient           Amount\n"
-	for transaction in trans:
-		transaction = list(transaction)
-		amount_list = transaction[4:]
-		amount_string = get_amount_as_string(amount_list)
-		
-		tran = transaction[0:4]
-		if tran[2]:
-			tran[2] = qb.get_player_name_from_account_id(tran[2])
-		
-		if tran[3]:
-			tran[3] = qb.get_player_name_from_account_id(tran[3])
+	for transaction in transactions:
+		amount_string = get_amount_as_string(Amount.from_denominations(transaction[4:9]))
 		
+		#sender and recipient names are joined onto the end of each row, deposits have no sender and withdrawals no recipient
+		tran = [transaction[0], transaction[1], transaction[9] or "None", transaction[10] or "None"]
 		for string in tran:
 			result += str(string).ljust(20)
 		
@@ -74,10 +77,144 @@ def format_transactions(transactions):
 	result += "```"
 	return result
 
+def format_transactions_page(page, page_number):
+	transactions_string = format_transactions(page)
+	return f"Your transactions (page {page_number}):\n{transactions_string}"
+
+async def wait_for_page_turn(message, user):
+	"""Waits for the user to add or remove one of the page reactions on the message, returns the reaction or None if they stop paging
+	"""
+	def check(payload):
+		return payload.message_id == message.id and payload.user_id == user.id and str(payload.emoji) in PAGE_REACTIONS
+	
+	waiters = [asyncio.create_task(bot.wait_for(event, check=check)) for event in ['raw_reaction_add', 'raw_reaction_remove']]
+	done, pending = await asyncio.wait(waiters, timeout=PAGE_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+	for waiter in pending:
+		waiter.cancel()
+	
+	if not done:
+		return None
+	return str(done.pop().result().emoji)
+
+def format_past_due_loans(loans):
+	"""Builds the past due loan digest, leaving off loans that don't fit in one Discord message
+	"""
+	result = f"**{len(loans)}** past due loan(s):\n```Loan ID   Player            Due Date    Outstanding\n"
+	for i, loan in enumerate(loans):
+		line = str(loan[0]).ljust(10) + str(loan[1]).ljust(18) + str(loan[2]).ljust(12) + get_amount_as_string(loan[3]) + "\n"
+		if len(result) + len(line) > 1900:
+			result += f"... and {len(loans) - i} more\n"
+			break
+		result += line
+	result += "```"
+	return result
+
+@tasks.loop(hours=PAST_DUE_SWEEP_HOURS)
+async def past_due_sweep():
+	#an exception would stop the loop for good, so report it and try again next sweep
+	try:
+		loans = await qb.get_past_due_loans()
+		if loans:
+			dms.send(MANAGER_ID, format_past_due_loans(loans))
+	except Exception:
+		logger.exception("past due loan sweep failed")
+
+@past_due_sweep.before_loop
+async def before_past_due_sweep():
+	await bot.wait_until_ready()
+	#the first sweep runs straight away, so it has to wait for the bank however long it takes to start rather than time out and skip a whole period
+	await qb.wait_until_ready()
+
+@tasks.loop(hours=BALANCE_SNAPSHOT_HOURS)
+async def balance_snapshots():
+	try:
+		taken = await qb.take_balance_snapshots()
+		logger.info("took balance snapshots count=%d", taken)
+	except Exception:
+		logger.exception("taking balance snapshots failed")
+
+@balance_snapshots.before_loop
+async def before_balance_snapshots():
+	await qb.wait_until_ready()
+
+@tasks.loop(seconds=METRICS_DUMP_SECONDS)
+async def metrics_dump():
+	try:
+		await asyncio.get_running_loop().run_in_executor(None, metrics.write_file, METRICS_FILE)
+	except Exception:
+		logger.exception("writing metrics failed path=%s", METRICS_FILE)
+
+def format_stats(account_cache):
+	"""Builds the q!stats summary of command timings and query counts, pool waits, player lookups and the account cache
+	"""
+	result = "```Command             Calls   Errors  Avg ms    p99 ms    Queries/call\n"
+	errors = metrics.COMMAND_ERRORS.values()
+	for (command,), series in sorted(metrics.COMMAND_SECONDS.series().items(), key=lambda item: -item[1]["sum"]):
+		p99 = metrics.COMMAND_SECONDS.quantile(series, 0.99)
+		queries = metrics.QUERIES.total(command=command)
+		result += (command.ljust(20) + str(series["count"]).ljust(8) + str(errors.get((command,), 0)).ljust(8)
+				+ f"{series['sum'] / series['count'] * 1000:.1f}".ljust(10) + (f"<{p99 * 1000:.0f}" if p99 != float("inf") else "slow").ljust(10)
+				+ f"{queries / series['count']:.1f}\n")
+	result += "```"
+	
+	for name, histogram in [("Pool acquire", metrics.POOL_ACQUIRE_SECONDS), ("Player lookups", metrics.PLAYER_LOOKUP_SECONDS)]:
+		series = list(histogram.series().values())
+		count = sum(entry["count"] for entry in series)
+		total = sum(entry["sum"] for entry in series)
+		result += f"{name}: {count} calls, avg {total / count * 1000 if count else 0:.1f}ms\n"
+	
+	waits = list(metrics.SCHEDULER_LOCK_WAIT_SECONDS.series().values())
+	count = sum(entry["count"] for entry in waits)
+	total = sum(entry["sum"] for entry in waits)
+	queued = sum(metrics.SCHEDULER_QUEUE_DEPTH.values().values())
+	result += f"Account locks: {count} operations, avg wait {total / count * 1000 if count else 0:.1f}ms, {queued} waiting now\n"
+	
+	lookups = account_cache["hits"] + account_cache["misses"]
+	result += f"Account cache: {account_cache['size']} accounts, {account_cache['hits']}/{lookups} hits"
+	return result
+
+async def start_bank():
+	stats = await qb.start(preload=PRELOAD_ACCOUNTS)
+	ready = time.perf_counter() - STARTED_AT
+	metrics.STARTUP_SECONDS.set(ready - stats["preload_seconds"], stage="bank")
+	metrics.STARTUP_SECONDS.set(ready, stage="preload")
+	logger.info("bank ready seconds=%.3f warm_up_seconds=%.3f preload_seconds=%.3f preloaded=%d", ready - stats["preload_seconds"], stats["warm_up_seconds"], stats["preload_seconds"], stats["preloaded"])
+
 @bot.event
 async def on_ready():
-	print(f'{bot.user} has connected to Discord!')
+	global bank_startup
+	ready = time.perf_counter() - STARTED_AT
+	logger.info("connected to Discord user=%s seconds=%.3f", bot.user, ready)
+	if bank_startup is None:
+		metrics.STARTUP_SECONDS.set(ready, stage="discord")
+		bank_startup = asyncio.create_task(start_bank())
 	await bot.change_presence(activity=discord.Game(name="q!help"))
+	dms.start()
+	if not past_due_sweep.is_running():
+		past_due_sweep.start()
+	if not balance_snapshots.is_running():
+		balance_snapshots.start()
+	if METRICS_FILE and not metrics_dump.is_running():
+		metrics_dump.start()
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+	#the command name carries over to the QBank worker threads, labelling the queries the command issues
+	ctx.metrics_token = metrics.current_command.set(ctx.command.qualified_name)
+	#reads in a command stick to the primary once the command has written, so it sees its own writes
+	ctx.session_token = replicas.current_session.set(replicas.ReadSession())
+	ctx.started_at = time.perf_counter()
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+	elapsed = time.perf_counter() - ctx.started_at
+	command = ctx.command.qualified_name
+	metrics.COMMAND_SECONDS.observe(elapsed, command=command)
+	if ctx.command_failed:
+		metrics.COMMAND_ERRORS.inc(command=command)
+	metrics.current_command.reset(ctx.metrics_token)
+	replicas.current_session.reset(ctx.session_token)
+	logger.debug("command=%s seconds=%.3f failed=%s", command, elapsed, ctx.command_failed)
 
 @bot.event
 async def on_command_error(ctx, error):
@@ -93,8 +230,6 @@ async def on_command_error(ctx, error):
 		await ctx.send(error)
 		raise error
 	
-	qb.close()
-	
 @bot.command(help='Shows a message explaining how to denote currency',aliases=['ch'])
 async def currencyhelp(ctx):
 	await ctx.send("```This bot distinguishes between different currencies by using a suffix appended to the amount you give it:\n"
@@ -115,50 +250,47 @@ async def createaccount(ctx, minecraft_username):
 	mc_name = minecraft_username
 	dc_id = ctx.message.author.id
 	
-	qb.create_new_account(mc_name, dc_id)
+	await qb.create_new_account(mc_name, dc_id)
 	await ctx.send(f"Created a new account for user {mc_name}")
 
 @bot.command(help='Checks your balance for you', aliases=['cb','balance','bal'])
 async def checkbalance(ctx):
 	dc_id = ctx.message.author.id
 	
-	balance = get_amount_as_string(qb.check_balance_dc_id(dc_id))
-	user = await bot.fetch_user(int(dc_id))
-	await user.send(f"Your balance is:\n```{balance}```")
+	balance = get_amount_as_string(await qb.check_balance_dc_id(dc_id))
+	dms.send(dc_id, f"Your balance is:\n```{balance}```")
 	await ctx.send("Your balance has been DMed to you")
 
 @bot.command(help='DMs Queueue_ that you would like to make a deposit\nUsage: q!requestdeposit {amount}', aliases=['rd'])
 async def requestdeposit(ctx, *args):
 	dc_id = ctx.message.author.id
 	if not args:
-		amount = [0,0,0,0,0]
+		amount = ZERO
 		amount_string = 'Unspecified amount'
 	else:
-		amount = build_amount_list(args)
+		amount = build_amount(args)
 		amount_string = get_amount_as_string(amount)
 	
-		if amount == [0,0,0,0,0]:
+		if not amount:
 			raise ValueError()
 	
 
-	mc_name = qb.get_player_name(dc_id)
-	manager = await bot.fetch_user(int(MANAGER_ID))
-	await manager.send(f"**{mc_name}** requested a **DEPOSIT** of ```{amount_string}```\n ")
+	mc_name = await qb.get_player_name(dc_id)
+	dms.send(MANAGER_ID, f"**{mc_name}** requested a **DEPOSIT** of ```{amount_string}```\n ")
 	await ctx.send("Your request has been sent to the bank manager.")
 
 @bot.command(help='DMs Queueue_ that you would like to make a withdrawal\nUsage: q!requestwithdrawal {amount}', aliases=['rw'])
 async def requestwithdrawal(ctx, *args):
 	dc_id = ctx.message.author.id
 	if not args:
-		amount = [0,0,0,0,0]
+		amount = ZERO
 		amount_string = 'Unspecified amount'
 	else:
-		amount = build_amount_list(args)
+		amount = build_amount(args)
 		amount_string = get_amount_as_string(amount)
 	
-	mc_name = qb.get_player_name(dc_id)
-	manager = await bot.fetch_user(int(MANAGER_ID))
-	await manager.send(f"**{mc_name}** requested a **WITHDRAWAL** of: ```{amount_string}```\n ")
+	mc_name = await qb.get_player_name(dc_id)
+	dms.send(MANAGER_ID, f"**{mc_name}** requested a **WITHDRAWAL** of: ```{amount_string}```\n ")
 	await ctx.send("Your request has been sent to the bank manager.")
 
 
@@ -166,53 +298,96 @@ async def requestwithdrawal(ctx, *args):
 async def pay(ctx, recipient_minecraft_username, *args):
 	sender_id = ctx.message.author.id
 	recipient_name = recipient_minecraft_username
-	amount = build_amount_list(args)
+	amount = build_amount(args)
 	amount_string = get_amount_as_string(amount)
 	
-	qb.client_transfer(sender_id, recipient_name, amount)
+	account_ids = await scheduler.account_ids([recipient_name], [sender_id])
+	await scheduler.run(account_ids, qb.qbank.client_transfer, sender_id, recipient_name, amount)
 	await ctx.send(f"**{amount_string}** has been transfered from your account to {recipient_name}'s account")
-	sender_name = qb.get_player_name(sender_id)
-	recipient_dc_id = qb.get_dc_id_from_username(recipient_name)
-	recipient = await bot.fetch_user(int(recipient_dc_id))
-	await recipient.send(f"{sender_name} has paid you {amount_string}!")
+	sender_name = await qb.get_player_name(sender_id)
+	recipient_dc_id = await qb.get_dc_id_from_username(recipient_name)
+	dms.send(recipient_dc_id, f"{sender_name} has paid you {amount_string}!")
 
 @bot.command(help="DMs you your 5 most recent transactions", aliases=['rt'])
 async def recenttransactions(ctx):
 	dc_id = ctx.message.author.id
 	user = ctx.message.author
-	transactions = qb.get_recent_transactions(dc_id)
+	transactions = await qb.get_recent_transactions(dc_id)
 	transactions_string = format_transactions(transactions)
 	
 	await user.send(f"Your recent transactions:\n{transactions_string}")
 	await ctx.send("Your recent transactions have been DMed to you")
 
-@bot.command(help="DMs you a list of all of your past transactions", aliases=['t'])
+@bot.command(help="DMs you a list of all of your past transactions, react with the arrows to turn the page", aliases=['t'])
 async def transactions(ctx):
 	dc_id = ctx.message.author.id
 	user = ctx.message.author
-	transactions = qb.get_transactions(dc_id)
-	transactions_string = format_transactions(transactions)
 	
-	await user.send(f"Your recent transactions:\n{transactions_string}")
+	#before_id cursors for each page visited so far, the first page has none
+	cursors = [None]
+	page = await qb.get_transactions_page(dc_id, limit=TRANSACTIONS_PAGE_SIZE)
+	if not page:
+		raise NoTransactionsError("You have no transactions")
+	
+	message = await user.send(format_transactions_page(page, 1))
 	await ctx.send("Your transactions have been DMed to you")
+	for reaction in PAGE_REACTIONS:
+		await message.add_reaction(reaction)
+	
+	while True:
+		reaction = await wait_for_page_turn(message, user)
+		if reaction is None:
+			break
+		
+		if reaction == PAGE_REACTIONS[1] and len(page) == TRANSACTIONS_PAGE_SIZE:
+			next_page = await qb.get_transactions_page(dc_id, before_id=page[-1][0], limit=TRANSACTIONS_PAGE_SIZE)
+			if not next_page:
+				continue
+			cursors.append(page[-1][0])
+			page = next_page
+		elif reaction == PAGE_REACTIONS[0] and len(cursors) > 1:
+			cursors.pop()
+			page = await qb.get_transactions_page(dc_id, before_id=cursors[-1], limit=TRANSACTIONS_PAGE_SIZE)
+		else:
+			continue
+		
+		await message.edit(content=format_transactions_page(page, len(cursors)))
+
+@bot.command(help="DMs you your statement as a CSV file, add gzip to compress it\nUsage: q!statement {from YYYY-MM-DD, optional} {to YYYY-MM-DD, optional} {gzip, optional}", aliases=['st'])
+async def statement(ctx, *args):
+	try:
+		start, end, compress = parse_statement_args(args)
+	except ValueError:
+		await ctx.send("Dates must be written as YYYY-MM-DD, e.g. q!statement 2021-06-01 2021-06-30")
+		return
+	
+	file = await qb.run(write_statement, qb.qbank, ctx.message.author.id, start, end, compress)
+	filename = "statement.csv.gz" if compress else "statement.csv"
+	size = os.fstat(file.fileno()).st_size
+	if size > STATEMENT_MAX_BYTES:
+		file.close()
+		await ctx.send("Your statement is too large to send, try a shorter period" + ("" if compress else " or add gzip"))
+		return
+	
+	await ctx.message.author.send(file=discord.File(file, filename=filename))
+	await ctx.send("Your statement has been DMed to you")
 
 @bot.command(helf='DMs Queueue_ that you would like to take out a loan\nUsage: q!requestloan {amount}', aliases=['rl'])
 async def requestloan(ctx, *args):
 	dc_id = ctx.message.author.id
 	if not args:
-		amount = [0,0,0,0,0]
+		amount = ZERO
 		amount_string = 'Unspecified amount'
 	else:
-		amount = build_amount_list(args)
+		amount = build_amount(args)
 		amount_string = get_amount_as_string(amount)
 	
-		if amount == [0,0,0,0,0]:
+		if not amount:
 			raise ValueError()
 	
 
-	mc_name = qb.get_player_name(dc_id)
-	manager = await bot.fetch_user(int(MANAGER_ID))
-	await manager.send(f"**{mc_name}** requested a **LOAN** of ```{amount_string}```\n ")
+	mc_name = await qb.get_player_name(dc_id)
+	dms.send(MANAGER_ID, f"**{mc_name}** requested a **LOAN** of ```{amount_string}```\n ")
 	await ctx.send("Your request has been sent to the bank manager.")
 
 @bot.command(help='Can only be used by Queueue_')
@@ -221,66 +396,202 @@ async def createaccountwithbalance(ctx, *args):
 	mc_name = args[0]
 	dc_id = args[1]
 	
-	starting_balance = build_amount_list(args[2:])
+	starting_balance = build_amount(args[2:])
 				
-	qb.create_new_account(mc_name, dc_id, starting_balance)
+	await qb.create_new_account(mc_name, dc_id, starting_balance)
 	await ctx.send(f"Created a new account for user {mc_name}")
 
 @bot.command(help='Can only be used by Queueue_', aliases=['d'])
 @commands.is_owner()
 async def deposit(ctx, *args):
 	mc_name = args[0]
-	amount = build_amount_list(args[1:])
+	amount = build_amount(args[1:])
 	
-	qb.deposit(mc_name, amount)
+	await scheduler.run(await scheduler.account_ids([mc_name]), qb.qbank.deposit, mc_name, amount)
 	amount_string = get_amount_as_string(amount)
 	await ctx.send(f"Deposited **{amount_string}** into the account belonging to {mc_name}")
-	recipient_dc_id = qb.get_dc_id_from_username(mc_name)
-	recipient = await bot.fetch_user(int(recipient_dc_id))
-	await recipient.send(f"{amount_string} has been deposited into your account")
+	recipient_dc_id = await qb.get_dc_id_from_username(mc_name)
+	dms.send(recipient_dc_id, f"{amount_string} has been deposited into your account")
 
 @bot.command(help='Can only be used by Queueue_', aliases=['w'])
 @commands.is_owner()
 async def withdraw(ctx, *args):
 	mc_name = args[0]
-	amount = build_amount_list(args[1:])
+	amount = build_amount(args[1:])
 	
-	qb.withdraw(mc_name, amount)
+	await scheduler.run(await scheduler.account_ids([mc_name]), qb.qbank.withdraw, mc_name, amount)
 	amount_string = get_amount_as_string(amount)
 	await ctx.send(f"Withdrew **{amount_string}** from the account belonging to {mc_name}")
-	recipient_dc_id = qb.get_dc_id_from_username(mc_name)
-	recipient = await bot.fetch_user(int(recipient_dc_id))
-	await recipient.send(f"{amount_string} has been withdrawn from your account")
+	recipient_dc_id = await qb.get_dc_id_from_username(mc_name)
+	dms.send(recipient_dc_id, f"{amount_string} has been withdrawn from your account")
 
 @bot.command(help='Can only be used by Queueue_', aliases=['transfer'])
 @commands.is_owner()
 async def transferfunds(ctx, *args):
 	sender_name = args[0]
 	recipient_name = args[1]
-	amount = build_amount_list(args[2:])
+	amount = build_amount(args[2:])
 	amount_string = get_amount_as_string(amount)
 
-	qb.manager_transfer(sender_name, recipient_name, amount)
+	account_ids = await scheduler.account_ids([sender_name, recipient_name])
+	await scheduler.run(account_ids, qb.qbank.manager_transfer, sender_name, recipient_name, amount)
 	await ctx.send(f"**{amount_string}** has been transfered from {sender_name}'s account to {recipient_name}'s account")
 
-@bot.commands(help='Can only be used by Queueue_', aliases=['l'])
+@bot.command(help='Can only be used by Queueue_', aliases=['l'])
 @commands.is_owner()
 async def loan(ctx, *args):
 	mc_name = args[0]
-	dc_id = qb.get_dc_id_from_username(mc_name)
-	user = await bot.fetch_user(int(dc_id))
-	amount = build_amount_list(args[1:len(args)-2])
+	dc_id = await qb.get_dc_id_from_username(mc_name)
+	amount = build_amount(args[1:len(args)-2])
 	amount_string = get_amount_as_string(amount)
 	days = args[len(args)-2]
 
-	qb.loan(mc_name, amount, days)
+	await scheduler.run(await scheduler.account_ids([mc_name]), qb.qbank.loan, mc_name, amount, days)
 	await ctx.send(f"**{amount_string}** has been loaned to {mc_name}")
-	await user.send(f"A loan of {amount_string} has been deposited into your account")
+	dms.send(dc_id, f"A loan of {amount_string} has been deposited into your account")
+
+def parse_batch(filename, data):
+	"""Parses a batch file into a list of (operation, Minecraft username, recipient, amount) tuples, and a list of (row, error) for rows that couldn't be parsed
+	
+	JSON files hold a list of objects, CSV files a header row; both use the fields operation, player, recipient and amount, where amount is written like a command, e.g. "10nb 5d"
+	Raises a MalformedFileError if the file isn't UTF-8 text, or can't be read as CSV or JSON
+	"""
+	try:
+		text = data.decode('utf-8-sig')
+		if filename.lower().endswith('.json'):
+			rows = json.loads(text)
+		else:
+			rows = list(csv.DictReader(io.StringIO(text)))
+	except (UnicodeDecodeError, json.JSONDecodeError, csv.Error) as e:
+		raise MalformedFileError(f"{filename} isn't a valid UTF-8 CSV or JSON file: {e}")
+	if not isinstance(rows, list):
+		raise MalformedFileError(f"{filename} should hold a list of rows")
+	
+	operations = []
+	errors = []
+	for i, row in enumerate(rows, start=1):
+		try:
+			operation = (row.get('operation') or '').strip().lower()
+			mc_name = (row.get('player') or '').strip()
+			recipient = (row.get('recipient') or '').strip() or None
+			amount = build_amount(str(row.get('amount') or '').split())
+			if not mc_name:
+				raise ValueError("Missing player")
+			operations.append((operation, mc_name, recipient, amount))
+		except (ValueError, AttributeError) as e:
+			errors.append((i, f"Invalid row: {e}"))
+	return operations, errors
+
+def build_batch_report(operations, results):
+	report = io.StringIO()
+	writer = csv.writer(report)
+	writer.writerow(['row', 'operation', 'player', 'recipient', 'amount', 'applied', 'message'])
+	for i, (operation, result) in enumerate(zip(operations, results), start=1):
+		writer.writerow([i, operation[0], operation[1], operation[2] or '', get_amount_as_string(operation[3]), result[0], result[1]])
+	return discord.File(io.BytesIO(report.getvalue().encode('utf-8')), filename='batch_results.csv')
+
+def statement_rows(opening, entries):
+	"""Yields the CSV rows of a statement, starting with the opening balance and keeping a running balance, so the entries are never all in memory
+	"""
+	yield ['entry', 'time', 'type', 'counterparty', 'change', 'balance']
+	balance = opening
+	yield ['', '', 'opening balance', '', '', get_amount_as_string(balance)]
+	for entry_id, created_at, entry_type, counterparty, amount in entries:
+		balance += amount
+		yield [entry_id, created_at, entry_type, counterparty or '', get_amount_as_string(amount), get_amount_as_string(balance)]
+
+def write_statement(qbank, dc_id, start, end, compress):
+	"""Streams the statement for the account associated with the discord id into a temporary file, gzipped if compress is set, and returns the file
+	
+	Runs on the QBank thread pool, since it reads the ledger through a server-side cursor as it writes
+	"""
+	account_id = qbank.get_account_id_from_dc_id(dc_id)
+	opening = qbank.balance_as_of(account_id, start) if start is not None else ZERO
+	
+	file = tempfile.TemporaryFile()
+	try:
+		stream = gzip.GzipFile(fileobj=file, mode='wb') if compress else file
+		text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+		csv.writer(text).writerows(statement_rows(opening, qbank.iter_ledger(account_id, start, end)))
+		text.flush()
+		text.detach()
+		if compress:
+			#closing the GzipFile writes its trailer but leaves the underlying file open
+			stream.close()
+		file.seek(0)
+		return file
+	except BaseException:
+		file.close()
+		raise
+
+def parse_statement_args(args):
+	"""Reads q!statement's optional from date, to date (both YYYY-MM-DD and inclusive) and gzip flag, returns (start, end, compress)
+	"""
+	compress = any(arg.lower() in ("gz", "gzip") for arg in args)
+	dates = [dt.date.fromisoformat(arg) for arg in args if arg.lower() not in ("gz", "gzip")]
+	if len(dates) > 2:
+		raise ValueError("Too many dates")
+	start = dates[0] if dates else None
+	end = dates[1] + dt.timedelta(days=1) if len(dates) > 1 else None
+	return start, end, compress
+
+@bot.command(help='Can only be used by Queueue_\nApplies the deposits, withdrawals and transfers in an attached CSV or JSON file\nUsage: q!batch (with the file attached)')
+@commands.is_owner()
+async def batch(ctx):
+	if not ctx.message.attachments:
+		await ctx.send("Attach a CSV or JSON file with operation, player, recipient and amount fields")
+		return
+	
+	attachment = ctx.message.attachments[0]
+	try:
+		operations, errors = parse_batch(attachment.filename, await attachment.read())
+	except MalformedFileError as e:
+		await ctx.send(f"Nothing was applied, {e}")
+		return
+	if errors:
+		error_list = "\n".join(f"Row {row}: {error}" for row, error in errors[:20])
+		await ctx.send(f"Nothing was applied, {len(errors)} row(s) couldn't be read:\n```{error_list}```")
+		return
+	
+	account_ids = await scheduler.account_ids({name for operation in operations for name in operation[1:3] if name})
+	results = await scheduler.run(account_ids, qb.qbank.apply_batch, operations)
+	applied = sum(1 for result in results if result[0])
+	await ctx.send(f"Applied {applied} of {len(operations)} operations", file=build_batch_report(operations, results))
+
+@bot.command(help='Can only be used by Queueue_\nPays interest into every opted in account, once per period\nUsage: q!accrueinterest {period, defaults to the current month}', aliases=['ai'])
+@commands.is_owner()
+async def accrueinterest(ctx, period=None):
+	stats = await qb.accrue_interest(period)
+	await ctx.send(f"Paid interest into {stats['accounts_paid']} accounts for period {stats['period']} in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} accounts/sec)")
 
 @bot.command(help='Updates Minecraft usernames in the database', aliases=['un'])
 @commands.is_owner()
 async def updatenames(ctx):
-	qb.update_player_names()
-	await ctx.send("Names have been updated")
+	message = await ctx.send("Updating names...")
+	loop = asyncio.get_running_loop()
+	
+	#called from the worker thread after every chunk of accounts
+	def progress(checked, total):
+		asyncio.run_coroutine_threadsafe(message.edit(content=f"Updating names... checked {checked}/{total} accounts"), loop)
+	
+	stats = await qb.update_player_names(progress)
+	await ctx.send(f"Names have been updated: checked {stats['checked']} accounts, {stats['changed']} names changed, {stats['failed']} lookups failed")
+
+@bot.command(help='Can only be used by Queueue_\nShows timings and query counts for each command, and cache statistics')
+@commands.is_owner()
+async def stats(ctx):
+	await ctx.send(format_stats(await qb.account_cache_stats()))
+
+@bot.command(help='Can only be used by Queueue_\nShows the bank totals and checks them against a full recompute, add repair to fix any mismatch\nUsage: q!banktotals {repair, optional}', aliases=['bt'])
+@commands.is_owner()
+async def banktotals(ctx, repair=None):
+	verification = await qb.verify_bank_totals(repair == "repair")
+	totals = "\n".join(f"{total}: {get_amount_as_string(amount)}" for total, amount in verification["stored"].items())
+	if verification["ok"]:
+		await ctx.send(f"```{totals}```The totals match a full recompute")
+	elif repair == "repair":
+		await ctx.send(f"```{totals}```Repaired mismatched totals: {', '.join(verification['mismatched'])}")
+	else:
+		await ctx.send(f"```{totals}```Mismatched totals: {', '.join(verification['mismatched'])}, use q!banktotals repair to fix them")
 	
 bot.run(TOKEN)
\ No newline at end of file
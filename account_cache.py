@@ -0,0 +1,137 @@
+#account_cache.py
+import threading
+from collections import OrderedDict, namedtuple
+
+#an account row, with the balance as an Amount
+Account = namedtuple('Account', ['account_id', 'mc_uuid', 'mc_name', 'dc_id', 'balance'])
+
+class AccountCache:
+
+	def __init__(self, max_size=4096):
+		"""Creates an LRU cache of up to max_size accounts, which can be looked up by account id, discord id or uuid
+
+		Every change to the cache advances its generation, so a reader can snapshot the generation before a database read and only cache the result if nothing was written in between
+		Writers bracket their writes to an account with begin_write and end_write, and while a write is in flight readers can't cache the account, since they may have read the row from before the write committed
+		"""
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+
+		self._accounts = OrderedDict()
+		self._dc_ids = {}
+		self._uuids = {}
+		self._generation = 0
+		#account id to the number of writes in flight, and the sequence number of the last write to begin
+		self._writes = {}
+		self._last_write = {}
+		self._sequence = 0
+		self._lock = threading.Lock()
+
+	def get_by_id(self, account_id):
+		with self._lock:
+			return self._get(account_id)
+
+	def get_by_dc_id(self, dc_id):
+		with self._lock:
+			return self._get(self._dc_ids.get(str(dc_id)))
+
+	def get_by_uuid(self, uuid):
+		with self._lock:
+			return self._get(self._uuids.get(uuid))
+
+	def generation(self):
+		with self._lock:
+			return self._generation
+
+	def put(self, account, generation=None):
+		"""Caches the account, unless a generation is given and the cache has changed since, or a write to the account is in flight
+		"""
+		with self._lock:
+			if generation is not None and generation != self._generation:
+				return
+			if account.account_id not in self._writes:
+				self._put(account)
+
+	def put_many(self, accounts, generation=None):
+		"""Caches every account in the list without a write in flight, unless a generation is given and the cache has changed since
+		"""
+		with self._lock:
+			if generation is not None and generation != self._generation:
+				return
+			for account in accounts:
+				if account.account_id not in self._writes:
+					self._put(account)
+
+	def begin_write(self, account_id):
+		"""Drops the account from the cache and marks a write to it as in flight, returns the dropped account (or None) and a token for end_write
+		"""
+		with self._lock:
+			self._sequence += 1
+			self._writes[account_id] = self._writes.get(account_id, 0) + 1
+			self._last_write[account_id] = self._sequence
+			self._generation += 1
+			return self._remove(account_id), self._sequence
+
+	def end_write(self, account_id, token, account=None):
+		"""Ends a write begun with begin_write, caching account (the row as written) if it's given and no other write to the account began since
+		
+		Pass no account if the write was rolled back, the account then stays out of the cache until it is read again
+		"""
+		with self._lock:
+			latest = self._last_write[account_id] == token
+			count = self._writes[account_id] - 1
+			if count:
+				self._writes[account_id] = count
+			else:
+				del self._writes[account_id]
+				del self._last_write[account_id]
+			self._generation += 1
+			self._remove(account_id)
+			if account is not None and latest and not count:
+				self._put(account)
+
+	def pop(self, account_id):
+		"""Removes the account from the cache and returns it, or None if it wasn't cached
+		"""
+		with self._lock:
+			self._generation += 1
+			return self._remove(account_id)
+
+	def clear(self):
+		with self._lock:
+			self._generation += 1
+			self._accounts.clear()
+			self._dc_ids.clear()
+			self._uuids.clear()
+
+	def stats(self):
+		"""Returns a dict with the cache's hit and miss counts and current size
+		"""
+		with self._lock:
+			return {"hits": self.hits, "misses": self.misses, "size": len(self._accounts)}
+
+	def _get(self, account_id):
+		account = self._accounts.get(account_id)
+		if account is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		self._accounts.move_to_end(account_id)
+		return account
+
+	def _put(self, account):
+		self._remove(account.account_id)
+		self._generation += 1
+		self._accounts[account.account_id] = account
+		self._dc_ids[str(account.dc_id)] = account.account_id
+		self._uuids[account.mc_uuid] = account.account_id
+		while len(self._accounts) > self.max_size:
+			self._remove(next(iter(self._accounts)))
+
+	def _remove(self, account_id):
+		account = self._accounts.pop(account_id, None)
+		if account is not None:
+			self._dc_ids.pop(str(account.dc_id), None)
+			self._uuids.pop(account.mc_uuid, None)
+		return account
+	#end AccountCache
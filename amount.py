@@ -0,0 +1,146 @@
+#amount.py
+from functools import total_ordering
+
+#how many of each denomination make up one of the next larger denomination
+SCRAP_PER_INGOT = 4
+INGOTS_PER_BLOCK = 9
+SCRAP_PER_BLOCK = SCRAP_PER_INGOT * INGOTS_PER_BLOCK
+DIAMONDS_PER_BLOCK = 9
+
+@total_ordering
+class Amount:
+	"""An immutable amount of currency
+
+	Netherite and diamonds are separate currency families with no exchange rate between them, so an amount is stored as two integer totals, one in netherite scrap and one in diamonds
+	Amounts may be negative, e.g. the difference between two balances
+	Amounts are ordered by netherite first and diamonds second
+	"""
+	__slots__ = ('netherite', 'diamonds')
+
+	def __init__(self, netherite=0, diamonds=0):
+		object.__setattr__(self, 'netherite', int(netherite))
+		object.__setattr__(self, 'diamonds', int(diamonds))
+
+	@classmethod
+	def from_denominations(cls, denominations):
+		"""Creates an amount from a [netherite blocks, netherite ingots, netherite scrap, diamond blocks, diamonds] sequence, such as a balance row
+		"""
+		nb, ni, ns, db, d = denominations
+		return cls(nb * SCRAP_PER_BLOCK + ni * SCRAP_PER_INGOT + ns, db * DIAMONDS_PER_BLOCK + d)
+
+	def denominations(self):
+		"""Returns the amount as a [netherite blocks, netherite ingots, netherite scrap, diamond blocks, diamonds] list, using the largest denominations possible
+		"""
+		nb, ns = self._split(self.netherite, SCRAP_PER_BLOCK)
+		ni, ns = self._split(ns, SCRAP_PER_INGOT)
+		db, d = self._split(self.diamonds, DIAMONDS_PER_BLOCK)
+		return [nb, ni, ns, db, d]
+
+	def any_negative(self):
+		"""Returns true if either currency family is below zero
+		"""
+		return self.netherite < 0 or self.diamonds < 0
+
+	def any_positive(self):
+		"""Returns true if either currency family is above zero
+		"""
+		return self.netherite > 0 or self.diamonds > 0
+
+	def at_most(self, limit):
+		"""Returns this amount with each currency family capped at the limit's
+		"""
+		return Amount(min(self.netherite, limit.netherite), min(self.diamonds, limit.diamonds))
+
+	def __add__(self, other):
+		if not isinstance(other, Amount):
+			return NotImplemented
+		return Amount(self.netherite + other.netherite, self.diamonds + other.diamonds)
+
+	def __sub__(self, other):
+		if not isinstance(other, Amount):
+			return NotImplemented
+		return Amount(self.netherite - other.netherite, self.diamonds - other.diamonds)
+
+	def __neg__(self):
+		return Amount(-self.netherite, -self.diamonds)
+
+	def __eq__(self, other):
+		if not isinstance(other, Amount):
+			return NotImplemented
+		return self.netherite == other.netherite and self.diamonds == other.diamonds
+
+	def __lt__(self, other):
+		if not isinstance(other, Amount):
+			return NotImplemented
+		return (self.netherite, self.diamonds) < (other.netherite, other.diamonds)
+
+	def __hash__(self):
+		return hash((self.netherite, self.diamonds))
+
+	def __bool__(self):
+		return self.netherite != 0 or self.diamonds != 0
+
+	def __iter__(self):
+		return iter(self.denominations())
+
+	def __setattr__(self, name, value):
+		raise AttributeError("Amount is immutable")
+
+	def __delattr__(self, name):
+		raise AttributeError("Amount is immutable")
+
+	def __reduce__(self):
+		return (Amount, (self.netherite, self.diamonds))
+
+	def __repr__(self):
+		return f"Amount(netherite={self.netherite}, diamonds={self.diamonds})"
+
+	@staticmethod
+	def _split(total, size):
+		"""Splits a total into (larger units, remainder), keeping the sign of the total on both parts
+		"""
+		larger, remainder = divmod(abs(total), size)
+		if total < 0:
+			return (-larger, -remainder)
+		return (larger, remainder)
+	#end Amount
+
+ZERO = Amount()
+
+#suffixes for different currency denominations, in the order of Amount.denominations()
+suffixes = ["nb", "ni", "ns", "db", "d"]
+
+def build_amount(args):
+	result = [0,0,0,0,0]
+	for i in range(len(args)):
+		for suffix in suffixes:
+			value = args[i]
+			
+			if value.endswith(suffix):
+				value = value.removesuffix(suffix)
+				result[suffixes.index(suffix)] += int(value)
+	
+	return Amount.from_denominations(result)
+
+def get_last_nonzero_index(amount):
+	try:
+		return [i for i, e in enumerate(amount) if e != 0][-1]
+	except IndexError as e:
+		return -1
+
+def get_amount_as_string(amount):
+	amount = amount.denominations()
+	result = ""
+	last_nonzero = get_last_nonzero_index(amount)
+	
+	if last_nonzero != -1:
+		for i in range(5):
+			if amount[i] != 0:
+				if i < last_nonzero:
+					result += str(amount[i]) + suffixes[i] + " "
+				else:
+					result += str(amount[i]) + suffixes[i]
+	else:
+		result = "0nb 0ni 0ns 0db 0d"
+		
+	return result
@@ -0,0 +1,105 @@
+#async_qbank.py
+import os
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from QBank import QBank
+from exceptions import *
+
+logger = logging.getLogger(__name__)
+
+class AsyncQBank:
+
+	def __init__(self, qbank=None, max_workers=None, ready_timeout=None):
+		"""Creates an awaitable facade over a QBank object
+
+		Every public QBank method is available under the same name as a coroutine that runs the method on a dedicated, bounded thread pool, so slow queries and player lookups don't block the event loop
+		The pool has max_workers threads, QBANK_WORKERS from .env, or one per pooled connection by default
+		Without a qbank, a lazy QBank is created, which doesn't touch the database until start() warms it up in the background
+		Until it is warmed up, operations wait up to ready_timeout seconds (QBANK_READY_TIMEOUT from .env, 30 by default) for it, then raise a NotReadyError
+		"""
+		if qbank is None:
+			qbank = QBank(lazy=True)
+		if max_workers is None:
+			max_workers = int(os.getenv('QBANK_WORKERS', qbank.pool.size))
+		if ready_timeout is None:
+			ready_timeout = float(os.getenv('QBANK_READY_TIMEOUT', 30))
+		self.qbank = qbank
+		self.ready_timeout = ready_timeout
+		self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qbank")
+		self._ready = asyncio.Event()
+		if qbank.schema_version is not None:
+			self._ready.set()
+
+	def __getattr__(self, name):
+		attr = getattr(self.qbank, name)
+		if name.startswith('_') or not callable(attr):
+			return attr
+
+		@functools.wraps(attr)
+		async def method(*args, **kwargs):
+			return await self.run(attr, *args, **kwargs)
+		return method
+
+	async def start(self, preload=500, retry_seconds=5):
+		"""Warms the QBank up on the thread pool, retrying with backoff until the database is reachable, then preloads the caches with up to preload recently active accounts
+
+		Operations waiting in run() go ahead as soon as the warm up succeeds, before the preload finishes
+		Returns a dict with the seconds the warm up and preload took and the number of accounts preloaded
+		"""
+		loop = asyncio.get_running_loop()
+		start = time.perf_counter()
+		attempt = 0
+		while True:
+			try:
+				version = await loop.run_in_executor(self.executor, self.qbank.warm_up)
+				break
+			except Exception:
+				attempt += 1
+				delay = min(retry_seconds * 2 ** (attempt - 1), 300)
+				logger.exception("warming up QBank failed attempt=%d retry_in=%.0f", attempt, delay)
+				await asyncio.sleep(delay)
+		warm_up_seconds = time.perf_counter() - start
+		self._ready.set()
+		logger.info("QBank ready schema_version=%d seconds=%.3f", version, warm_up_seconds)
+		
+		preloaded = 0
+		if preload:
+			try:
+				preloaded = await loop.run_in_executor(self.executor, self.qbank.preload, preload)
+			except Exception:
+				logger.exception("preloading caches failed")
+		return {"warm_up_seconds": warm_up_seconds, "preload_seconds": time.perf_counter() - start - warm_up_seconds, "preloaded": preloaded}
+
+	def is_ready(self):
+		return self._ready.is_set()
+
+	async def wait_until_ready(self):
+		"""Waits, without a timeout, until start() has warmed the QBank up
+		"""
+		await self._ready.wait()
+
+	async def run(self, func, *args, **kwargs):
+		"""Runs func with the given arguments on the QBank thread pool and returns its result
+
+		func runs in a copy of the caller's context, so context variables such as the current bot command carry over to the worker thread
+		Waits for start() to finish warming the QBank up first, raising a NotReadyError if that takes longer than ready_timeout
+		"""
+		if not self._ready.is_set():
+			try:
+				await asyncio.wait_for(self._ready.wait(), self.ready_timeout)
+			except asyncio.TimeoutError:
+				raise NotReadyError("The bank is still starting up, please try again in a minute")
+		loop = asyncio.get_running_loop()
+		context = contextvars.copy_context()
+		return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+	def close(self):
+		"""Waits for running operations to finish, then closes the thread pool and the QBank's connections
+		"""
+		self.executor.shutdown(wait=True)
+		self.qbank.close()
+	#end AsyncQBank
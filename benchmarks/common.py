@@ -0,0 +1,145 @@
+#benchmarks/common.py
+"""Shared helpers for the benchmarks: a stand-in for the Mojang API, database round trip counting and latency statistics
+"""
+import json
+import time
+import uuid
+import weakref
+import threading
+from contextlib import contextmanager
+
+def fake_lookup(mc_name):
+	"""Stands in for the Mojang API, every name is a valid player with a stable uuid
+	"""
+	return (str(uuid.uuid5(uuid.NAMESPACE_OID, mc_name.lower())), mc_name)
+
+class CountingCursor:
+	"""Wraps a cursor, counting every statement it sends to the server
+	"""
+
+	def __init__(self, cursor, counter):
+		self._cursor = cursor
+		self._counter = counter
+
+	def execute(self, *args, **kwargs):
+		self._counter.add()
+		return self._cursor.execute(*args, **kwargs)
+
+	def executemany(self, *args, **kwargs):
+		self._counter.add()
+		return self._cursor.executemany(*args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(self._cursor, name)
+	#end CountingCursor
+
+class CountingConnection:
+	"""Wraps a database connection, counting statements sent through its cursors along with commits and rollbacks
+	"""
+
+	def __init__(self, db, counter):
+		self._db = db
+		self._counter = counter
+
+	def cursor(self, *args, **kwargs):
+		return CountingCursor(self._db.cursor(*args, **kwargs), self._counter)
+
+	def commit(self):
+		self._counter.add()
+		return self._db.commit()
+
+	def rollback(self):
+		self._counter.add()
+		return self._db.rollback()
+
+	def __getattr__(self, name):
+		return getattr(self._db, name)
+	#end CountingConnection
+
+class CountingPool:
+	"""Wraps a ConnectionPool so every database round trip made through it is counted
+
+	Use it in place of a QBank's pool: qb.pool = CountingPool(qb.pool)
+	"""
+
+	def __init__(self, pool):
+		self.pool = pool
+		self.round_trips = 0
+		self._lock = threading.Lock()
+		#one wrapper per pooled connection, so statements the backend prepares on a connection are found again next time it is borrowed
+		self._connections = weakref.WeakKeyDictionary()
+
+	def add(self):
+		with self._lock:
+			self.round_trips += 1
+
+	@contextmanager
+	def connection(self):
+		with self.pool.connection() as db:
+			with self._lock:
+				connection = self._connections.get(db)
+				if connection is None:
+					connection = self._connections[db] = CountingConnection(db, self)
+			yield connection
+
+	def __getattr__(self, name):
+		return getattr(self.pool, name)
+	#end CountingPool
+
+def percentile(sorted_values, fraction):
+	"""Returns the value at the given fraction (0 to 1) of an already sorted list, using the nearest rank
+	"""
+	if not sorted_values:
+		return 0.0
+	index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+	return sorted_values[index]
+
+def measure(func, args_list, pool=None):
+	"""Calls func once with each tuple of arguments in args_list and returns its timing statistics
+
+	If a CountingPool is given, the database round trips per call are included
+	"""
+	latencies = []
+	round_trips = pool.round_trips if pool is not None else 0
+	start = time.perf_counter()
+	for args in args_list:
+		call_start = time.perf_counter()
+		func(*args)
+		latencies.append(time.perf_counter() - call_start)
+	elapsed = time.perf_counter() - start
+	latencies.sort()
+
+	ops = len(latencies)
+	result = {
+		"ops": ops,
+		"seconds": elapsed,
+		"ops_per_sec": ops / elapsed if elapsed > 0 else 0.0,
+		"p50_ms": percentile(latencies, 0.50) * 1000,
+		"p99_ms": percentile(latencies, 0.99) * 1000
+	}
+	if pool is not None:
+		result["round_trips_per_op"] = (pool.round_trips - round_trips) / ops if ops else 0.0
+	return result
+
+def save_results(path, results, **metadata):
+	"""Writes the results to path as JSON, along with the time of the run and any metadata given
+	"""
+	document = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **metadata, "results": results}
+	with open(path, 'w') as file:
+		json.dump(document, file, indent=2)
+
+def load_results(path):
+	with open(path) as file:
+		return json.load(file)["results"]
+
+def print_results(results, baseline=None):
+	"""Prints a table of results, with the change in ops/sec against a baseline run's results if given
+	"""
+	print(f"{'benchmark':<32} {'ops/sec':>12} {'p50 ms':>10} {'p99 ms':>10} {'trips/op':>9}")
+	for name, result in results.items():
+		line = f"{name:<32} {result['ops_per_sec']:>12.1f} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f}"
+		line += f" {result['round_trips_per_op']:>9.1f}" if "round_trips_per_op" in result else f" {'-':>9}"
+		if baseline and name in baseline and baseline[name]["ops_per_sec"] > 0:
+			change = result["ops_per_sec"] / baseline[name]["ops_per_sec"] - 1
+			line += f" {change:+.1%}"
+		print(line)
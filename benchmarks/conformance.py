@@ -0,0 +1,216 @@
+#benchmarks/conformance.py
+"""Checks that every storage backend behaves the same by running one set of QBank checks against each of them
+
+SQLite runs in memory, MySQL runs against the database configured in .env, which should be a scratch database
+Every check creates its own accounts and compares changes rather than totals, so it can run against a database that already holds data
+Usage: python -m benchmarks.conformance [--backends sqlite,mysql]
+"""
+import os
+import sys
+import secrets
+import argparse
+import traceback
+import datetime as dt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from QBank import QBank
+from exceptions import *
+import metrics
+import replicas
+from amount import Amount, ZERO
+from storage import MySQLBackend, SQLiteBackend
+from benchmarks.common import fake_lookup
+
+BACKENDS = {
+	"sqlite": lambda: SQLiteBackend(":memory:"),
+	"mysql": MySQLBackend
+}
+
+def new_players(qb, *balances):
+	"""Creates an account for each starting balance, returns their (Minecraft name, discord id, account id) tuples
+	"""
+	token = secrets.token_hex(4)
+	players = []
+	for i, balance in enumerate(balances):
+		mc_name = f"c{token}{i}"
+		qb.create_new_account(mc_name, f"conf-{mc_name}", balance)
+		players.append((mc_name, f"conf-{mc_name}", qb.get_account_id_from_mc_name(mc_name)))
+	return players
+
+def expect(condition, message):
+	if not condition:
+		raise AssertionError(message)
+
+def expect_raises(error, func, *args):
+	try:
+		func(*args)
+	except error:
+		return
+	raise AssertionError(f"{func.__name__} didn't raise {error.__name__}")
+
+def check_accounts(qb):
+	(alice, alice_dc, alice_id), = new_players(qb, Amount(36, 10))
+	expect(qb.account_exists_dc_id(alice_dc), "new account not found by discord id")
+	expect(qb.get_player_name(alice_dc) == alice, "wrong name for discord id")
+	expect(qb.get_dc_id_from_username(alice) == alice_dc, "wrong discord id for name")
+	expect(qb.get_player_name_from_account_id(alice_id) == alice, "wrong name for account id")
+	expect(qb.check_balance_account_id(alice_id) == Amount(36, 10), "starting balance not deposited")
+	expect_raises(DuplicateAccountError, qb.create_new_account, alice, "conf-other")
+	expect_raises(AccountNotFoundError, qb.check_balance_dc_id, "conf-nobody")
+
+def check_deposits_and_withdrawals(qb):
+	(alice, alice_dc, alice_id), = new_players(qb, ZERO)
+	qb.deposit(alice, Amount(40, 20))
+	qb.withdraw(alice, Amount(4, 2))
+	expect(qb.check_balance_mc_name(alice) == Amount(36, 18), "deposit and withdrawal don't add up")
+	expect_raises(InsufficientFundsError, qb.withdraw, alice, Amount(0, 19))
+	expect(qb.check_balance_dc_id(alice_dc) == Amount(36, 18), "failed withdrawal changed the balance")
+
+def check_transfers(qb):
+	(alice, alice_dc, alice_id), (bob, bob_dc, bob_id) = new_players(qb, Amount(0, 50), ZERO)
+	qb.client_transfer(alice_dc, bob, Amount(0, 20))
+	qb.manager_transfer(bob, alice, Amount(0, 5))
+	expect(qb.check_balance_account_id(alice_id) == Amount(0, 35), "sender balance wrong after transfers")
+	expect(qb.check_balance_account_id(bob_id) == Amount(0, 15), "recipient balance wrong after transfers")
+	expect_raises(InsufficientFundsError, qb.client_transfer, bob_dc, alice, Amount(0, 16))
+	expect_raises(Exception, qb.transfer, alice_id, alice_id, Amount(0, 1))
+	expect(qb.check_balance_account_id(bob_id) == Amount(0, 15), "failed transfer changed the balance")
+
+def check_history(qb):
+	(alice, alice_dc, alice_id), (bob, bob_dc, bob_id) = new_players(qb, Amount(0, 10), ZERO)
+	for i in range(3):
+		qb.client_transfer(alice_dc, bob, Amount(0, 1))
+	history = qb.get_transactions(alice_dc)
+	expect([row[1] for row in history] == ["deposit", "transfer", "transfer", "transfer"], "history has the wrong transactions")
+	expect([row[0] for row in history] == sorted(row[0] for row in history), "history isn't oldest first")
+	expect(history[1][9:11] == (alice, bob), "history has the wrong names")
+	first_page = qb.get_transactions_page(alice_dc, limit=3)
+	second_page = qb.get_transactions_page(alice_dc, before_id=first_page[-1][0], limit=3)
+	expect(list(first_page) + list(second_page) == history[::-1], "pages don't cover the history newest first")
+	expect(qb.get_recent_transactions(alice_dc) == history[-5:], "recent transactions are wrong")
+
+def check_loans(qb):
+	(alice, alice_dc, alice_id), = new_players(qb, ZERO)
+	before = qb.get_loanable_amount()
+	qb.loan(alice, Amount(0, 72), -1)
+	expect(qb.account_has_unpaid_loan(alice_id), "loan not recorded")
+	expect_raises(MultipleLoansError, qb.loan, alice, Amount(0, 1), 7)
+	outstanding = qb.get_outstanding_loan_balance(alice_id)
+	expect(outstanding == Amount(0, 72) + qb.calculate_loan_interest(Amount(0, 72)), "outstanding balance isn't principal plus interest")
+	expect(any(loan[1] == alice and loan[3] == outstanding for loan in qb.get_past_due_loans()), "past due loan not found")
+	expect(qb.get_loanable_amount() == before, "taking a loan changed the loanable amount")
+
+	qb.loan_payment_direct(alice_dc, Amount(0, 70))
+	expect(qb.get_outstanding_loan_balance(alice_id) == outstanding - Amount(0, 70), "direct payment not applied")
+	change = qb.loan_payment_indirect(alice, Amount(0, 100))
+	expect(change == Amount(0, 100) - (outstanding - Amount(0, 70)), "indirect payment gave the wrong change")
+	expect(not qb.account_has_unpaid_loan(alice_id), "paid off loan still unpaid")
+
+def check_batch(qb):
+	(alice, alice_dc, alice_id), (bob, bob_dc, bob_id) = new_players(qb, Amount(0, 10), ZERO)
+	results = qb.apply_batch([
+		("deposit", alice, None, Amount(0, 5)),
+		("transfer", alice, bob, Amount(0, 12)),
+		("withdraw", bob, None, Amount(0, 20))
+	])
+	expect([result[0] for result in results] == [True, True, False], "batch applied the wrong operations")
+	expect(qb.check_balance_account_id(alice_id) == Amount(0, 3), "batch left the wrong balance")
+	results = qb.apply_batch([("deposit", alice, None, Amount(0, 1)), ("launder", alice, None, Amount(0, 1))])
+	expect(not any(result[0] for result in results), "invalid batch was partly applied")
+
+def check_interest(qb):
+	(alice, alice_dc, alice_id), = new_players(qb, Amount(72, 36))
+	period = f"conf-{secrets.token_hex(4)}"
+	qb.accrue_interest(period)
+	expect(qb.check_balance_account_id(alice_id) == Amount(73, 37), "interest not paid")
+	qb.accrue_interest(period)
+	expect(qb.check_balance_account_id(alice_id) == Amount(73, 37), "interest paid twice for one period")
+
+def check_rollback(qb):
+	(alice, alice_dc, alice_id), = new_players(qb, Amount(0, 10))
+	try:
+		with qb.connection():
+			qb.deposit(alice, Amount(0, 5))
+			raise RuntimeError("rolled back")
+	except RuntimeError:
+		pass
+	expect(qb.check_balance_account_id(alice_id) == Amount(0, 10), "rolled back deposit is visible")
+
+def check_ledger(qb):
+	(alice, alice_dc, alice_id), (bob, bob_dc, bob_id) = new_players(qb, Amount(9, 50), ZERO)
+	qb.client_transfer(alice_dc, bob, Amount(0, 20))
+	qb.take_balance_snapshots()
+	qb.loan(bob, Amount(36, 0), 7)
+	qb.loan_payment_direct(bob_dc, Amount(10, 0))
+	tomorrow = dt.date.today() + dt.timedelta(days=1)
+	expect(qb.balance_as_of(bob_id, tomorrow) == qb.check_balance_account_id(bob_id), "balance as of now doesn't match the balance")
+	expect(qb.balance_as_of(alice_id, tomorrow) == Amount(9, 30), "balance as of now doesn't match after a snapshot")
+	expect(qb.balance_as_of(bob_id, dt.date(2000, 1, 1)) == ZERO, "balance before the account existed isn't zero")
+	statement = qb.get_statement(bob_id, dt.date.today(), tomorrow)
+	expect([entry[2] for entry in statement["entries"]] == ["transfer", "deposit", "repayment"], "statement has the wrong entries")
+	expect(statement["entries"][0][3] == alice, "statement has the wrong counterparty")
+	expect(statement["closing"] == Amount(26, 20), "statement doesn't add up to the balance")
+
+def check_read_routing(qb):
+	(alice, alice_dc, alice_id), = new_players(qb, Amount(0, 10))
+	#start cold, so loading the account on a cache miss is part of the check and must not pin the session to the primary
+	qb.accounts.clear()
+	with replicas.session():
+		before = metrics.READS.values()
+		qb.get_transactions_page(alice_dc, limit=1)
+		qb.deposit(alice, Amount(0, 3))
+		page = qb.get_transactions_page(alice_dc, limit=1)
+		after = metrics.READS.values()
+	expect(page[0][1] == "deposit" and Amount.from_denominations(page[0][4:9]) == Amount(0, 3), "read after a write didn't see the write")
+	reads = {target: after.get((target,), 0) - before.get((target,), 0) for target in ["primary", "replica"]}
+	if qb.replicas.choose() is None:
+		expect(reads == {"primary": 2, "replica": 0}, f"reads went to the wrong database: {reads}")
+	else:
+		expect(reads == {"primary": 1, "replica": 1}, f"reads before and after a write weren't split: {reads}")
+
+def check_bank_totals(qb):
+	(alice, alice_dc, alice_id), (bob, bob_dc, bob_id) = new_players(qb, Amount(36, 20), ZERO)
+	before = qb.get_bank_totals()
+	qb.client_transfer(alice_dc, bob, Amount(0, 5))
+	qb.withdraw(alice, Amount(9, 0))
+	qb.loan(bob, Amount(0, 9), 7)
+	qb.loan_payment_direct(bob_dc, Amount(0, 4))
+	qb.apply_batch([("deposit", alice, None, Amount(0, 3)), ("transfer", bob, alice, Amount(0, 1))])
+	after = qb.get_bank_totals()
+	expect(after["deposits"] - before["deposits"] == Amount(-9, 8), "deposits total didn't follow the balances")
+	expect(after["principal"] - before["principal"] == Amount(0, 5), "principal total didn't follow the loan")
+	expect(after["interest"] - before["interest"] == qb.calculate_loan_interest(Amount(0, 9)), "interest total didn't follow the loan")
+	try:
+		with qb.connection():
+			qb.deposit(alice, Amount(0, 50))
+			raise RuntimeError("rolled back")
+	except RuntimeError:
+		pass
+	expect(qb.get_bank_totals() == after, "rolled back deposit changed the totals")
+	verification = qb.verify_bank_totals()
+	expect(verification["ok"], f"bank totals don't match a recompute: {verification['mismatched']}")
+
+CHECKS = [check_accounts, check_deposits_and_withdrawals, check_transfers, check_history, check_loans, check_batch, check_interest, check_rollback, check_ledger, check_read_routing, check_bank_totals]
+
+def run(backend_names):
+	"""Runs every check against each named backend, returns the number of failed checks
+	"""
+	failures = 0
+	for name in backend_names:
+		qb = QBank(player_lookup=fake_lookup, backend=BACKENDS[name]())
+		for check in CHECKS:
+			try:
+				check(qb)
+				print(f"{name:<8} {check.__name__:<32} ok")
+			except Exception:
+				failures += 1
+				print(f"{name:<8} {check.__name__:<32} FAILED")
+				traceback.print_exc()
+		qb.close()
+	return failures
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Runs the same QBank checks against each storage backend")
+	parser.add_argument('--backends', default="sqlite", help="comma separated backends to check: sqlite, mysql")
+	args = parser.parse_args()
+	sys.exit(1 if run(args.backends.split(",")) else 0)
@@ -0,0 +1,101 @@
+#benchmarks/operations.py
+"""Measures the throughput, latency and database round trips of individual QBank operations
+
+Runs against the database configured in .env (see storage.py), which should be a scratch database, with player lookups answered by a stand-in for the Mojang API
+The history benchmarks need accounts with 10, 1,000 and 100,000 transactions, which are created on the first run and reused after that
+Results are printed and saved as JSON, and can be compared against an earlier run's JSON
+Usage: python -m benchmarks.operations [--ops N] [--output FILE] [--compare FILE]
+"""
+import os
+import sys
+import time
+import secrets
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from QBank import QBank
+from exceptions import *
+from amount import Amount, ZERO
+from benchmarks.common import fake_lookup, CountingPool, measure, save_results, load_results, print_results
+
+HISTORY_SIZES = [10, 1000, 100000]
+
+def ensure_account(qb, mc_name, balance=ZERO):
+	"""Creates the account unless it already exists, tops it up to at least balance and returns its account id
+	"""
+	try:
+		qb.create_new_account(mc_name, f"bench-{mc_name}")
+	except DuplicateAccountError:
+		pass
+	current = qb.check_balance_mc_name(mc_name)
+	shortfall = Amount(max(0, balance.netherite - current.netherite), max(0, balance.diamonds - current.diamonds))
+	if shortfall:
+		qb.deposit(mc_name, shortfall)
+	return qb.get_account_id_from_mc_name(mc_name)
+
+def ensure_history(qb, mc_name, size, chunk_size=5000):
+	"""Pads the account's history with deposits until it holds at least size transactions
+	"""
+	account_id = ensure_account(qb, mc_name)
+	with qb.connection() as cursor:
+		query = "SELECT COUNT(*) FROM transactions WHERE sender_account_id = %s OR recipient_account_id = %s"
+		data = [account_id, account_id]
+		cursor.execute(query, data)
+		missing = size - cursor.fetchone()[0]
+	while missing > 0:
+		count = min(missing, chunk_size)
+		qb.create_transactions([("deposit", None, account_id, Amount(diamonds=1))] * count)
+		missing -= count
+
+def run(ops=500):
+	qb = QBank(player_lookup=fake_lookup)
+	pool = CountingPool(qb.pool)
+	qb.pool = pool
+	one = Amount(diamonds=1)
+	results = {}
+
+	ensure_account(qb, "bench_0", Amount(diamonds=ops * 10))
+	ensure_account(qb, "bench_1", Amount(diamonds=ops * 10))
+	for size in HISTORY_SIZES:
+		ensure_history(qb, f"hist_{size}", size)
+
+	token = secrets.token_hex(3)
+	new_names = [(f"c{token}{i}", f"bench-c{token}{i}") for i in range(ops)]
+	results["create_new_account"] = measure(qb.create_new_account, new_names, pool)
+	results["check_balance_dc_id"] = measure(qb.check_balance_dc_id, [("bench-bench_0",)] * ops, pool)
+	results["deposit"] = measure(qb.deposit, [("bench_0", one)] * ops, pool)
+	results["withdraw"] = measure(qb.withdraw, [("bench_0", one)] * ops, pool)
+	transfers = [("bench-bench_0", "bench_1", one), ("bench-bench_1", "bench_0", one)] * (ops // 2)
+	results["client_transfer"] = measure(qb.client_transfer, transfers, pool)
+
+	for size in HISTORY_SIZES:
+		repeats = max(3, min(ops, 100000 // size))
+		results[f"get_transactions_{size}"] = measure(qb.get_transactions, [(f"bench-hist_{size}",)] * repeats, pool)
+
+	results["get_loanable_amount"] = measure(qb.get_loanable_amount, [()] * ops, pool)
+
+	a = Amount(1234, 5678)
+	b = Amount(432, 876)
+	denominations = a.denominations()
+	arithmetic_ops = ops * 200
+	results["amount_add"] = measure(Amount.__add__, [(a, b)] * arithmetic_ops)
+	results["amount_subtract"] = measure(Amount.__sub__, [(a, b)] * arithmetic_ops)
+	results["amount_denominations"] = measure(Amount.denominations, [(a,)] * arithmetic_ops)
+	results["amount_from_denominations"] = measure(Amount.from_denominations, [(denominations,)] * arithmetic_ops)
+	results["calculate_loan_interest"] = measure(qb.calculate_loan_interest, [(a,)] * arithmetic_ops)
+	results["calculate_balance_interest"] = measure(qb.calculate_balance_interest, [(a,)] * arithmetic_ops)
+
+	qb.close()
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Measures QBank operation throughput, latency and database round trips")
+	parser.add_argument('--ops', type=int, default=500, help="calls per database benchmark")
+	parser.add_argument('--output', default=f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json", help="file to save the results to")
+	parser.add_argument('--compare', help="results file from an earlier run to compare against")
+	args = parser.parse_args()
+
+	results = run(args.ops)
+	save_results(args.output, results, ops=args.ops)
+	print_results(results, load_results(args.compare) if args.compare else None)
+	print(f"Saved results to {args.output}")
@@ -0,0 +1,59 @@
+#benchmarks/prepared.py
+"""Measures what prepared statements save on balance reads and transfers, by running the same operations with and without them
+
+Runs against the database configured in .env (see storage.py), which should be a scratch database
+Balance reads skip the account cache, so every read reaches the database
+Usage: python -m benchmarks.prepared [--ops N] [--output FILE] [--compare FILE]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from QBank import QBank
+from amount import Amount
+from storage import backend_from_env
+from benchmarks.common import fake_lookup, CountingPool, measure, save_results, load_results, print_results
+from benchmarks.operations import ensure_account
+
+def uncached_balance(qb, account_id):
+	qb.accounts.pop(account_id)
+	return qb.check_balance_account_id(account_id)
+
+def run(ops=2000):
+	results = {}
+	for mode, prepared in [("text", False), ("prepared", True)]:
+		backend = backend_from_env()
+		backend.prepared_statements = prepared
+		qb = QBank(player_lookup=fake_lookup, backend=backend)
+		pool = CountingPool(qb.pool)
+		qb.pool = pool
+
+		sender = ensure_account(qb, "bench_0", Amount(diamonds=ops * 2))
+		recipient = ensure_account(qb, "bench_1", Amount(diamonds=ops * 2))
+		#warm up, so each pooled connection has prepared its statements before timing starts
+		for i in range(qb.pool.size * 2):
+			uncached_balance(qb, sender)
+			qb.transfer(sender, recipient, Amount(diamonds=1))
+
+		results[f"balance_read_{mode}"] = measure(uncached_balance, [(qb, sender)] * ops, pool)
+		transfers = [(sender, recipient, Amount(diamonds=1)), (recipient, sender, Amount(diamonds=1))] * (ops // 2)
+		results[f"transfer_{mode}"] = measure(qb.transfer, transfers, pool)
+		qb.close()
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Compares balance reads and transfers with and without prepared statements")
+	parser.add_argument('--ops', type=int, default=2000, help="calls per benchmark")
+	parser.add_argument('--output', default=f"bench-prepared-{time.strftime('%Y%m%d-%H%M%S')}.json", help="file to save the results to")
+	parser.add_argument('--compare', help="results file from an earlier run to compare against")
+	args = parser.parse_args()
+
+	results = run(args.ops)
+	save_results(args.output, results, ops=args.ops)
+	print_results(results, load_results(args.compare) if args.compare else None)
+	for operation in ["balance_read", "transfer"]:
+		text, prepared = results[f"{operation}_text"], results[f"{operation}_prepared"]
+		print(f"{operation}: prepared statements change ops/sec by {prepared['ops_per_sec'] / text['ops_per_sec'] - 1:+.1%}")
+	print(f"Saved results to {args.output}")
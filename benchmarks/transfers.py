@@ -0,0 +1,68 @@
+#benchmarks/transfers.py
+"""Measures transfer throughput under concurrent transfers between overlapping accounts
+
+Runs against the database configured in .env (see storage.py), which should be a scratch database
+Usage: python -m benchmarks.transfers [--accounts N] [--threads N] [--transfers N]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from QBank import QBank
+from exceptions import *
+from amount import Amount, ZERO
+from benchmarks.common import fake_lookup
+
+def setup_accounts(qb, count, starting_balance):
+	"""Creates (or reuses) count benchmark accounts, each holding at least starting_balance, and returns their account ids
+	"""
+	account_ids = []
+	for i in range(count):
+		mc_name = f"bench_{i}"
+		try:
+			qb.create_new_account(mc_name, f"bench-{i}")
+		except DuplicateAccountError:
+			pass
+		qb.deposit(mc_name, starting_balance)
+		account_ids.append(qb.get_account_id_from_mc_name(mc_name))
+	return account_ids
+
+def total_holdings(qb, account_ids):
+	return sum((qb.check_balance_account_id(account_id) for account_id in account_ids), ZERO)
+
+def run(accounts=4, threads=8, transfers=2000):
+	qb = QBank(player_lookup=fake_lookup)
+	account_ids = setup_accounts(qb, accounts, Amount(diamonds=900))
+	before = total_holdings(qb, account_ids)
+	rng = random.Random(0)
+	pairs = [tuple(rng.sample(account_ids, 2)) for i in range(transfers)]
+	failures = []
+
+	def transfer(pair):
+		try:
+			qb.transfer(pair[0], pair[1], Amount(diamonds=1))
+		except InsufficientFundsError as e:
+			failures.append(e)
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=threads) as executor:
+		list(executor.map(transfer, pairs))
+	elapsed = time.perf_counter() - start
+
+	after = total_holdings(qb, account_ids)
+	print(f"{transfers} transfers between {accounts} accounts on {threads} threads in {elapsed:.2f}s")
+	print(f"{transfers / elapsed:.1f} transfers/sec, {len(failures)} rejected for insufficient funds")
+	print(f"Total holdings {'conserved' if before == after else f'CHANGED from {before} to {after}'}")
+	qb.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Measures concurrent transfer throughput")
+	parser.add_argument('--accounts', type=int, default=4)
+	parser.add_argument('--threads', type=int, default=8)
+	parser.add_argument('--transfers', type=int, default=2000)
+	args = parser.parse_args()
+	run(args.accounts, args.threads, args.transfers)
@@ -14,4 +14,15 @@ class NoTransactionsError(Exception):
 	pass
 
 class MultipleLoansError(Exception):
-	pass
\ No newline at end of file
+	pass
+
+class PoolTimeoutError(Exception):
+	pass
+
+class NotReadyError(Exception):
+	pass
+class MigrationError(Exception):
+	pass
+
+class MalformedFileError(Exception):
+	pass
@@ -0,0 +1,314 @@
+#metrics.py
+"""In-process counters and histograms for QBank and the bot, exported in the Prometheus text format
+
+The metrics QBank records are defined at the bottom of this module
+Queries are labelled with the bot command and the outermost QBank method they were issued from, which are tracked in context variables
+"""
+import os
+import time
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#the bot command and outermost QBank method currently running, used to label queries
+current_command = contextvars.ContextVar('current_command', default="none")
+current_method = contextvars.ContextVar('current_method', default=None)
+
+def _escape(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=""):
+	pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+
+	def __init__(self, name, help, labels=()):
+		"""Creates a counter, which holds a separate running total for every combination of label values
+		"""
+		self.name = name
+		self.help = help
+		self.labels = tuple(labels)
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def inc(self, amount=1, **labels):
+		key = tuple(labels[label] for label in self.labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def total(self, **labels):
+		"""Returns the sum of the totals whose labels match the given ones, e.g. every method's queries for one command
+		"""
+		indexes = [(self.labels.index(label), value) for label, value in labels.items()]
+		with self._lock:
+			return sum(value for key, value in self._values.items() if all(key[i] == match for i, match in indexes))
+
+	def values(self):
+		"""Returns a dict of label values to totals
+		"""
+		with self._lock:
+			return dict(self._values)
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+		for key, value in sorted(self.values().items()):
+			lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+		return lines
+	#end Counter
+
+class Gauge:
+
+	def __init__(self, name, help, labels=()):
+		"""Creates a gauge, which holds a current value that can go up and down for every combination of label values
+		"""
+		self.name = name
+		self.help = help
+		self.labels = tuple(labels)
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def set(self, value, **labels):
+		key = tuple(labels[label] for label in self.labels)
+		with self._lock:
+			self._values[key] = value
+
+	def inc(self, amount=1, **labels):
+		key = tuple(labels[label] for label in self.labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def dec(self, amount=1, **labels):
+		self.inc(-amount, **labels)
+
+	def values(self):
+		"""Returns a dict of label values to current values
+		"""
+		with self._lock:
+			return dict(self._values)
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+		for key, value in sorted(self.values().items()):
+			lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+		return lines
+	#end Gauge
+
+class Histogram:
+
+	def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		"""Creates a histogram of observed values (usually seconds), counted into fixed buckets for every combination of label values
+		"""
+		self.name = name
+		self.help = help
+		self.labels = tuple(labels)
+		self.buckets = tuple(buckets)
+		self._series = {}
+		self._lock = threading.Lock()
+
+	def observe(self, value, **labels):
+		key = tuple(labels[label] for label in self.labels)
+		with self._lock:
+			series = self._series.get(key)
+			if series is None:
+				series = self._series[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					series["buckets"][i] += 1
+					break
+			series["count"] += 1
+			series["sum"] += value
+
+	@contextmanager
+	def time(self, **labels):
+		"""Observes how long the with block took, in seconds
+		"""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - start, **labels)
+
+	def series(self):
+		"""Returns a dict of label values to {"buckets", "count", "sum"} dicts, where buckets holds the (non-cumulative) count for each bucket
+		"""
+		with self._lock:
+			return {key: {"buckets": list(series["buckets"]), "count": series["count"], "sum": series["sum"]} for key, series in self._series.items()}
+
+	def quantile(self, series, fraction):
+		"""Estimates a quantile of one series as the upper bound of the bucket it falls in, or infinity if it is past the last bucket
+		"""
+		target = fraction * series["count"]
+		seen = 0
+		for bound, count in zip(self.buckets, series["buckets"]):
+			seen += count
+			if seen >= target and seen > 0:
+				return bound
+		return float("inf")
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+		for key, series in sorted(self.series().items()):
+			cumulative = 0
+			for bound, count in zip(self.buckets, series["buckets"]):
+				cumulative += count
+				bucket_labels = _format_labels(self.labels, key, f'le="{bound}"')
+				lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+			bucket_labels = _format_labels(self.labels, key, 'le="+Inf"')
+			lines.append(f"{self.name}_bucket{bucket_labels} {series['count']}")
+			lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series['sum']}")
+			lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series['count']}")
+		return lines
+	#end Histogram
+
+class Registry:
+
+	def __init__(self):
+		self._metrics = []
+
+	def counter(self, name, help, labels=()):
+		counter = Counter(name, help, labels)
+		self._metrics.append(counter)
+		return counter
+
+	def gauge(self, name, help, labels=()):
+		gauge = Gauge(name, help, labels)
+		self._metrics.append(gauge)
+		return gauge
+
+	def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		histogram = Histogram(name, help, labels, buckets)
+		self._metrics.append(histogram)
+		return histogram
+
+	def render(self):
+		"""Returns every metric in the Prometheus text exposition format
+		"""
+		lines = []
+		for metric in self._metrics:
+			lines.extend(metric.render())
+		return "\n".join(lines) + "\n"
+	#end Registry
+
+REGISTRY = Registry()
+
+COMMAND_SECONDS = REGISTRY.histogram("qbank_command_seconds", "Time taken by each bot command", ["command"])
+COMMAND_ERRORS = REGISTRY.counter("qbank_command_errors_total", "Bot commands that raised an error", ["command"])
+METHOD_SECONDS = REGISTRY.histogram("qbank_method_seconds", "Time taken by each QBank method called from outside QBank", ["method"])
+QUERIES = REGISTRY.counter("qbank_queries_total", "SQL statements sent to the database", ["command", "method"])
+POOL_ACQUIRE_SECONDS = REGISTRY.histogram("qbank_pool_acquire_seconds", "Time spent waiting for a pooled database connection")
+PLAYER_LOOKUP_SECONDS = REGISTRY.histogram("qbank_player_lookup_seconds", "Time taken by Mojang API lookups", ["outcome"])
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge("qbank_scheduler_queue_depth", "Operations waiting for account locks in the bot's scheduler")
+SCHEDULER_RUNNING = REGISTRY.gauge("qbank_scheduler_running", "Operations holding their account locks in the bot's scheduler")
+SCHEDULER_LOCK_WAIT_SECONDS = REGISTRY.histogram("qbank_scheduler_lock_wait_seconds", "Time operations spent waiting for their account locks")
+USER_LOOKUPS = REGISTRY.counter("qbank_user_lookups_total", "Discord users resolved by the bot, by where they were found", ["source"])
+DM_QUEUE_DEPTH = REGISTRY.gauge("qbank_dm_queue_depth", "Notifications waiting in the bot's DM queue")
+STATEMENTS_PREPARED = REGISTRY.counter("qbank_statements_prepared_total", "Statements prepared by the storage backend, once per pooled connection and statement name", ["name"])
+STARTUP_SECONDS = REGISTRY.gauge("qbank_startup_seconds", "Seconds from the bot starting until each part of it was ready", ["stage"])
+READS = REGISTRY.counter("qbank_reads_total", "Read-only QBank operations, by the database that served them", ["target"])
+REPLICA_LAG_SECONDS = REGISTRY.gauge("qbank_replica_lag_seconds", "Last measured replication lag of each replica", ["replica"])
+DMS_SENT = REGISTRY.counter("qbank_dms_total", "DMs sent by the bot's DM queue, each of which may hold several notifications", ["outcome"])
+
+class InstrumentedCursor:
+	"""Wraps a database cursor, counting every statement it executes in QUERIES
+	"""
+
+	def __init__(self, cursor):
+		self._cursor = cursor
+
+	def execute(self, *args, **kwargs):
+		QUERIES.inc(command=current_command.get(), method=current_method.get() or "none")
+		return self._cursor.execute(*args, **kwargs)
+
+	def executemany(self, *args, **kwargs):
+		QUERIES.inc(command=current_command.get(), method=current_method.get() or "none")
+		return self._cursor.executemany(*args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(self._cursor, name)
+	#end InstrumentedCursor
+
+def _timed_method(name, func):
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		#only the outermost method is timed, methods called from other methods count towards their caller
+		if current_method.get() is not None:
+			return func(*args, **kwargs)
+		token = current_method.set(name)
+		start = time.perf_counter()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			METHOD_SECONDS.observe(time.perf_counter() - start, method=name)
+			current_method.reset(token)
+	return wrapper
+
+def instrument_methods(cls):
+	"""Class decorator timing every public method of the class in METHOD_SECONDS and labelling the queries it issues with its name
+
+	Generator methods and context managers are left alone, since their work happens after they return
+	"""
+	for name, func in list(vars(cls).items()):
+		if name.startswith('_') or not inspect.isfunction(func) or inspect.isgeneratorfunction(inspect.unwrap(func)):
+			continue
+		setattr(cls, name, _timed_method(name, func))
+	return cls
+
+def timed_lookup(lookup):
+	"""Wraps a player lookup function, timing its calls in PLAYER_LOOKUP_SECONDS by outcome
+	"""
+	@functools.wraps(lookup)
+	def wrapper(*args, **kwargs):
+		start = time.perf_counter()
+		outcome = "error"
+		try:
+			result = lookup(*args, **kwargs)
+			outcome = "found" if result is not None else "not_found"
+			return result
+		finally:
+			PLAYER_LOOKUP_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+	return wrapper
+
+def write_file(path, registry=REGISTRY):
+	"""Writes the metrics to path in the Prometheus text format, replacing the file atomically so readers never see a partial dump
+	"""
+	temp_path = f"{path}.tmp"
+	with open(temp_path, 'w') as file:
+		file.write(registry.render())
+	os.replace(temp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		body = self.server.registry.render().encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		logger.debug("metrics request %s", format % args)
+	#end _MetricsHandler
+
+def start_http_server(port, host="127.0.0.1", registry=REGISTRY):
+	"""Serves the metrics at http://host:port/metrics from a daemon thread and returns the server
+	"""
+	server = ThreadingHTTPServer((host, port), _MetricsHandler)
+	server.registry = registry
+	threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+	logger.info("serving metrics host=%s port=%s", host, port)
+	return server
@@ -0,0 +1,385 @@
+#migrations.py
+"""Versioned schema migrations for the QBank database
+
+Each migration is a (version, description, function) entry in MIGRATIONS, applied in order by migrate()
+Migrations check the current state of the schema before changing it, so they are safe to re-run after a crash and can upgrade databases created before the schema_version table existed
+"""
+import logging
+from amount import SCRAP_PER_INGOT, SCRAP_PER_BLOCK, DIAMONDS_PER_BLOCK
+from exceptions import MigrationError
+
+logger = logging.getLogger(__name__)
+
+def column_type(cursor, table, column):
+	"""Returns the data type of the column, or None if the column doesn't exist
+	"""
+	query = "SELECT data_type FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s"
+	cursor.execute(query, [table, column])
+	record = cursor.fetchone()
+	if not record:
+		return None
+	return record[0].lower()
+
+def index_exists(cursor, table, index):
+	query = "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s"
+	cursor.execute(query, [table, index])
+	return cursor.fetchone()[0] > 0
+
+def add_index(cursor, table, index, definition):
+	"""Adds the index to the table unless an index with that name already exists
+	"""
+	if not index_exists(cursor, table, index):
+		cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+def check_unique(cursor, table, column, index):
+	"""Raises a MigrationError listing the rows that share a value of the column, which would stop the unique index from being added
+	"""
+	cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL GROUP BY {column} HAVING COUNT(*) > 1")
+	values = [record[0] for record in cursor.fetchall()]
+	if values:
+		cursor.execute(f"SELECT {column}, account_id FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(values))}) ORDER BY {column}, account_id", values)
+		duplicates = {}
+		for value, account_id in cursor.fetchall():
+			duplicates.setdefault(value, []).append(str(account_id))
+		report = "; ".join(f"{column} {value!r} is shared by account ids {', '.join(ids)}" for value, ids in duplicates.items())
+		logger.error("duplicate rows block unique index table=%s index=%s duplicates=%d", table, index, len(values))
+		raise MigrationError(f"Can't add unique index {index} to {table}, merge or remove the duplicate accounts and retry: {report}")
+
+def add_unique_index(cursor, table, index, column):
+	"""Adds a unique index on the column unless an index with that name already exists, after checking no rows share a value
+	"""
+	if not index_exists(cursor, table, index):
+		check_unique(cursor, table, column, index)
+		cursor.execute(f"ALTER TABLE {table} ADD UNIQUE INDEX {index} ({column})")
+
+def create_base_tables(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS accounts (
+						account_id INT(11) NOT NULL AUTO_INCREMENT PRIMARY KEY,
+						mc_uuid CHAR(36),
+						mc_name VARCHAR(16),
+						dc_id VARCHAR(255),
+						netherite_blocks INT UNSIGNED DEFAULT 0,
+						netherite_ingots INT UNSIGNED DEFAULT 0,
+						netherite_scrap INT UNSIGNED DEFAULT 0,
+						diamond_blocks INT UNSIGNED DEFAULT 0,
+						diamonds INT UNSIGNED DEFAULT 0,
+						opted_into_interest BOOLEAN DEFAULT TRUE)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS transactions (
+						transaction_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+						transaction_type VARCHAR(10) NOT NULL,
+						sender_account_id INT(11),
+						recipient_account_id INT(11),
+						netherite_blocks INT UNSIGNED,
+						netherite_ingots INT UNSIGNED,
+						netherite_scrap INT UNSIGNED,
+						diamond_blocks INT UNSIGNED,
+						diamonds INT UNSIGNED)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS loans (
+						loan_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+						loanee_id INT(11),
+						loanee_name INT(11),
+						borrowed_date VARCHAR(20),
+						due_date VARCHAR(20),
+						loaned_nb INT UNSIGNED DEFAULT 0,
+						loaned_ni INT UNSIGNED DEFAULT 0,
+						loaned_ns INT UNSIGNED DEFAULT 0,
+						loaned_db INT UNSIGNED DEFAULT 0,
+						loaned_d INT UNSIGNED DEFAULT 0,
+						interest_nb INT UNSIGNED DEFAULT 0,
+						interest_ni INT UNSIGNED DEFAULT 0,
+						interest_ns INT UNSIGNED DEFAULT 0,
+						interest_db INT UNSIGNED DEFAULT 0,
+						interest_d INT UNSIGNED DEFAULT 0,
+						outstanding_nb INT UNSIGNED DEFAULT 0,
+						outstanding_ni INT UNSIGNED DEFAULT 0,
+						outstanding_ns INT UNSIGNED DEFAULT 0,
+						outstanding_db INT UNSIGNED DEFAULT 0,
+						outstanding_d INT UNSIGNED DEFAULT 0,
+						paid BOOLEAN DEFAULT FALSE)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS player_cache (
+						lookup_name VARCHAR(16) NOT NULL PRIMARY KEY,
+						mc_uuid CHAR(36),
+						mc_name VARCHAR(16),
+						fetched_at DOUBLE NOT NULL)""")
+
+def add_lookup_indexes(cursor):
+	add_unique_index(cursor, "accounts", "uq_accounts_mc_uuid", "mc_uuid")
+	add_unique_index(cursor, "accounts", "uq_accounts_dc_id", "dc_id")
+	add_index(cursor, "transactions", "ix_transactions_sender", "INDEX ix_transactions_sender (sender_account_id)")
+	add_index(cursor, "transactions", "ix_transactions_recipient", "INDEX ix_transactions_recipient (recipient_account_id)")
+	add_index(cursor, "loans", "ix_loans_loanee_paid", "INDEX ix_loans_loanee_paid (loanee_id, paid)")
+
+def add_transaction_timestamps(cursor):
+	if column_type(cursor, "transactions", "created_at") is None:
+		cursor.execute("ALTER TABLE transactions ADD COLUMN created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP")
+
+def convert_loan_dates(cursor):
+	"""Converts the "%y/%m/%d" VARCHAR loan dates into DATE columns, and fixes the type of loanee_name
+	"""
+	for column in ["borrowed_date", "due_date"]:
+		if column_type(cursor, "loans", column) == "date":
+			continue
+		if column_type(cursor, "loans", f"{column}_new") is None:
+			cursor.execute(f"ALTER TABLE loans ADD COLUMN {column}_new DATE")
+		cursor.execute(f"UPDATE loans SET {column}_new = STR_TO_DATE({column}, '%y/%m/%d') WHERE {column} IS NOT NULL")
+		cursor.execute(f"ALTER TABLE loans DROP COLUMN {column}, CHANGE COLUMN {column}_new {column} DATE")
+
+	if column_type(cursor, "loans", "loanee_name") != "varchar":
+		cursor.execute("ALTER TABLE loans MODIFY COLUMN loanee_name VARCHAR(16)")
+
+def create_loanable_summary(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS loanable_summary (
+						summary_id TINYINT NOT NULL PRIMARY KEY,
+						netherite BIGINT NOT NULL,
+						diamonds BIGINT NOT NULL,
+						refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP)""")
+
+def create_interest_accruals(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS interest_accruals (
+						period VARCHAR(16) NOT NULL PRIMARY KEY,
+						last_account_id INT(11) NOT NULL DEFAULT 0,
+						accounts_paid INT UNSIGNED NOT NULL DEFAULT 0,
+						completed BOOLEAN NOT NULL DEFAULT FALSE,
+						started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+						completed_at TIMESTAMP NULL)""")
+
+def add_due_date_index(cursor):
+	add_index(cursor, "loans", "ix_loans_paid_due_date", "INDEX ix_loans_paid_due_date (paid, due_date)")
+
+def create_job_checkpoints(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS job_checkpoints (
+						job_name VARCHAR(32) NOT NULL PRIMARY KEY,
+						last_account_id INT(11) NOT NULL,
+						updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP)""")
+
+def open_ledger(cursor):
+	"""Records every account's current balance as its opening ledger entry, unless the ledger already has entries
+	"""
+	cursor.execute("SELECT COUNT(*) FROM ledger")
+	if cursor.fetchone()[0] == 0:
+		cursor.execute("INSERT INTO ledger (account_id, entry_type, netherite, diamonds) "
+					f"SELECT account_id, 'opening', netherite_blocks * {SCRAP_PER_BLOCK} + netherite_ingots * {SCRAP_PER_INGOT} + netherite_scrap, diamond_blocks * {DIAMONDS_PER_BLOCK} + diamonds FROM accounts")
+
+def create_ledger(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS ledger (
+						entry_id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+						account_id INT(11) NOT NULL,
+						entry_type VARCHAR(10) NOT NULL,
+						counterparty_account_id INT(11),
+						netherite BIGINT NOT NULL,
+						diamonds BIGINT NOT NULL,
+						created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+						INDEX ix_ledger_account_created (account_id, created_at))""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS balance_snapshots (
+						snapshot_id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+						account_id INT(11) NOT NULL,
+						last_entry_id BIGINT NOT NULL,
+						netherite BIGINT NOT NULL,
+						diamonds BIGINT NOT NULL,
+						taken_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+						INDEX ix_balance_snapshots_account_taken (account_id, taken_at))""")
+
+	open_ledger(cursor)
+
+def sum_amount_sql(columns, prefix=""):
+	"""Returns SQL selecting the sum of the denomination columns as {prefix}netherite and {prefix}diamonds totals, in scrap and diamonds
+	"""
+	nb, ni, ns, db, d = columns
+	return (f"COALESCE(SUM({nb} * {SCRAP_PER_BLOCK} + {ni} * {SCRAP_PER_INGOT} + {ns}), 0) AS {prefix}netherite, "
+			f"COALESCE(SUM({db} * {DIAMONDS_PER_BLOCK} + {d}), 0) AS {prefix}diamonds")
+
+#recomputes the bank_totals columns from every account and unpaid loan, selecting them in the same order as the row stores them
+RECOMPUTE_BANK_TOTALS = ("SELECT deposits.netherite AS deposits_netherite, deposits.diamonds AS deposits_diamonds, opted_in.netherite AS opted_in_netherite, opted_in.diamonds AS opted_in_diamonds, "
+		"loans.outstanding_netherite - loans.interest_netherite AS principal_netherite, loans.outstanding_diamonds - loans.interest_diamonds AS principal_diamonds, loans.interest_netherite, loans.interest_diamonds FROM "
+		f"(SELECT {sum_amount_sql(['netherite_blocks', 'netherite_ingots', 'netherite_scrap', 'diamond_blocks', 'diamonds'])} FROM accounts) deposits CROSS JOIN "
+		f"(SELECT {sum_amount_sql(['netherite_blocks', 'netherite_ingots', 'netherite_scrap', 'diamond_blocks', 'diamonds'])} FROM accounts WHERE opted_into_interest = TRUE) opted_in CROSS JOIN "
+		f"(SELECT {sum_amount_sql(['outstanding_nb', 'outstanding_ni', 'outstanding_ns', 'outstanding_db', 'outstanding_d'], 'outstanding_')}, {sum_amount_sql(['interest_nb', 'interest_ni', 'interest_ns', 'interest_db', 'interest_d'], 'interest_')} FROM loans WHERE paid = FALSE) loans")
+
+def fill_bank_totals(cursor):
+	"""Sets the bank_totals row to totals recomputed from the accounts and unpaid loans, creating the row if needed
+	"""
+	cursor.execute("DELETE FROM bank_totals")
+	cursor.execute("INSERT INTO bank_totals (totals_id, deposits_netherite, deposits_diamonds, opted_in_netherite, opted_in_diamonds, principal_netherite, principal_diamonds, interest_netherite, interest_diamonds) "
+				f"SELECT 1, recomputed.* FROM ({RECOMPUTE_BANK_TOTALS}) recomputed")
+
+def create_bank_totals(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS bank_totals (
+						totals_id TINYINT NOT NULL PRIMARY KEY,
+						deposits_netherite BIGINT NOT NULL,
+						deposits_diamonds BIGINT NOT NULL,
+						opted_in_netherite BIGINT NOT NULL,
+						opted_in_diamonds BIGINT NOT NULL,
+						principal_netherite BIGINT NOT NULL,
+						principal_diamonds BIGINT NOT NULL,
+						interest_netherite BIGINT NOT NULL,
+						interest_diamonds BIGINT NOT NULL)""")
+	fill_bank_totals(cursor)
+	#the loanable amount is now read from bank_totals, which never goes out of date
+	cursor.execute("DROP TABLE IF EXISTS loanable_summary")
+
+MIGRATIONS = [
+	(1, "Create accounts, transactions, loans and player_cache tables", create_base_tables),
+	(2, "Index account, transaction and loan lookups", add_lookup_indexes),
+	(3, "Add timestamps to transactions", add_transaction_timestamps),
+	(4, "Store loan dates as DATE columns", convert_loan_dates),
+	(5, "Add the precomputed loanable amount summary", create_loanable_summary),
+	(6, "Track interest accrual progress", create_interest_accruals),
+	(7, "Index unpaid loans by due date", add_due_date_index),
+	(8, "Add checkpoints for resumable jobs", create_job_checkpoints),
+	(9, "Add the balance ledger and balance snapshots", create_ledger),
+	(10, "Replace the loanable summary with incrementally maintained bank totals", create_bank_totals),
+]
+
+def create_sqlite_tables(cursor):
+	"""Creates the tables and indexes in the shape the MySQL migrations up to version 8 leave them in, for a new SQLite database
+	"""
+	cursor.execute("""CREATE TABLE IF NOT EXISTS accounts (
+						account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+						mc_uuid CHAR(36),
+						mc_name VARCHAR(16),
+						dc_id VARCHAR(255),
+						netherite_blocks INT UNSIGNED DEFAULT 0,
+						netherite_ingots INT UNSIGNED DEFAULT 0,
+						netherite_scrap INT UNSIGNED DEFAULT 0,
+						diamond_blocks INT UNSIGNED DEFAULT 0,
+						diamonds INT UNSIGNED DEFAULT 0,
+						opted_into_interest BOOLEAN DEFAULT TRUE)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS transactions (
+						transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+						transaction_type VARCHAR(10) NOT NULL,
+						sender_account_id INT(11),
+						recipient_account_id INT(11),
+						netherite_blocks INT UNSIGNED,
+						netherite_ingots INT UNSIGNED,
+						netherite_scrap INT UNSIGNED,
+						diamond_blocks INT UNSIGNED,
+						diamonds INT UNSIGNED,
+						created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS loans (
+						loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+						loanee_id INT(11),
+						loanee_name VARCHAR(16),
+						borrowed_date DATE,
+						due_date DATE,
+						loaned_nb INT UNSIGNED DEFAULT 0,
+						loaned_ni INT UNSIGNED DEFAULT 0,
+						loaned_ns INT UNSIGNED DEFAULT 0,
+						loaned_db INT UNSIGNED DEFAULT 0,
+						loaned_d INT UNSIGNED DEFAULT 0,
+						interest_nb INT UNSIGNED DEFAULT 0,
+						interest_ni INT UNSIGNED DEFAULT 0,
+						interest_ns INT UNSIGNED DEFAULT 0,
+						interest_db INT UNSIGNED DEFAULT 0,
+						interest_d INT UNSIGNED DEFAULT 0,
+						outstanding_nb INT UNSIGNED DEFAULT 0,
+						outstanding_ni INT UNSIGNED DEFAULT 0,
+						outstanding_ns INT UNSIGNED DEFAULT 0,
+						outstanding_db INT UNSIGNED DEFAULT 0,
+						outstanding_d INT UNSIGNED DEFAULT 0,
+						paid BOOLEAN DEFAULT FALSE)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS player_cache (
+						lookup_name VARCHAR(16) NOT NULL PRIMARY KEY,
+						mc_uuid CHAR(36),
+						mc_name VARCHAR(16),
+						fetched_at DOUBLE NOT NULL)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS loanable_summary (
+						summary_id TINYINT NOT NULL PRIMARY KEY,
+						netherite BIGINT NOT NULL,
+						diamonds BIGINT NOT NULL,
+						refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS interest_accruals (
+						period VARCHAR(16) NOT NULL PRIMARY KEY,
+						last_account_id INT(11) NOT NULL DEFAULT 0,
+						accounts_paid INT UNSIGNED NOT NULL DEFAULT 0,
+						completed BOOLEAN NOT NULL DEFAULT FALSE,
+						started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+						completed_at TIMESTAMP NULL)""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS job_checkpoints (
+						job_name VARCHAR(32) NOT NULL PRIMARY KEY,
+						last_account_id INT(11) NOT NULL,
+						updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)""")
+
+	#the accounts table may already exist from before the schema was versioned
+	check_unique(cursor, "accounts", "mc_uuid", "uq_accounts_mc_uuid")
+	check_unique(cursor, "accounts", "dc_id", "uq_accounts_dc_id")
+	cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_accounts_mc_uuid ON accounts (mc_uuid)")
+	cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_accounts_dc_id ON accounts (dc_id)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS ix_transactions_sender ON transactions (sender_account_id)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS ix_transactions_recipient ON transactions (recipient_account_id)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS ix_loans_loanee_paid ON loans (loanee_id, paid)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS ix_loans_paid_due_date ON loans (paid, due_date)")
+
+def create_sqlite_ledger(cursor):
+	#SQLite's CURRENT_TIMESTAMP is in UTC, while MySQL's is in local time like the dates QBank queries the ledger with
+	cursor.execute("""CREATE TABLE IF NOT EXISTS ledger (
+						entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+						account_id INT(11) NOT NULL,
+						entry_type VARCHAR(10) NOT NULL,
+						counterparty_account_id INT(11),
+						netherite BIGINT NOT NULL,
+						diamonds BIGINT NOT NULL,
+						created_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')))""")
+
+	cursor.execute("""CREATE TABLE IF NOT EXISTS balance_snapshots (
+						snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+						account_id INT(11) NOT NULL,
+						last_entry_id BIGINT NOT NULL,
+						netherite BIGINT NOT NULL,
+						diamonds BIGINT NOT NULL,
+						taken_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')))""")
+
+	cursor.execute("CREATE INDEX IF NOT EXISTS ix_ledger_account_created ON ledger (account_id, created_at)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS ix_balance_snapshots_account_taken ON balance_snapshots (account_id, taken_at)")
+
+	open_ledger(cursor)
+
+#SQLite databases start from the schema as of version 8, each later MySQL migration needs a SQLite counterpart with the same version here
+SQLITE_MIGRATIONS = [
+	(8, "Create the SQLite schema", create_sqlite_tables),
+	(9, "Add the balance ledger and balance snapshots", create_sqlite_ledger),
+	(10, "Replace the loanable summary with incrementally maintained bank totals", create_bank_totals),
+]
+
+def schema_version(cursor):
+	"""Returns the version the schema has been migrated to, raises if it was never migrated
+	"""
+	cursor.execute("SELECT MAX(version) FROM schema_version")
+	return cursor.fetchone()[0] or 0
+
+def migrate(cursor, migrations=MIGRATIONS, commit=None):
+	"""Applies every pending migration in order and returns the resulting schema version
+
+	Each migration is committed as soon as it has been applied, with commit(cursor) if given
+	"""
+	cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+						version INT NOT NULL PRIMARY KEY,
+						description VARCHAR(255),
+						applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)""")
+	cursor.execute("SELECT MAX(version) FROM schema_version")
+	version = cursor.fetchone()[0] or 0
+
+	for migration_version, description, apply in migrations:
+		if migration_version <= version:
+			continue
+		apply(cursor)
+		query = "INSERT INTO schema_version (version, description) VALUES (%s, %s)"
+		data = [migration_version, description]
+		cursor.execute(query, data)
+		if commit is None:
+			cursor.execute("COMMIT")
+		else:
+			commit(cursor)
+		logger.info("applied migration version=%d description=%s", migration_version, description)
+		version = migration_version
+
+	return version
@@ -0,0 +1,116 @@
+#notifications.py
+import asyncio
+import logging
+from collections import OrderedDict
+import discord
+from rate_limit import AsyncRateLimiter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+#Discord's limit on the length of one message
+MAX_MESSAGE_LENGTH = 2000
+
+class UserResolver:
+
+	def __init__(self, bot, max_size=1024):
+		"""Creates a resolver of Discord user ids to users, which checks the bot's gateway cache first and keeps an LRU cache of up to max_size users it had to fetch
+		"""
+		self.bot = bot
+		self.max_size = max_size
+		self._users = OrderedDict()
+
+	async def resolve(self, user_id):
+		"""Returns the user with the given id, only asking the Discord API if the user isn't cached
+		"""
+		user_id = int(user_id)
+		user = self.bot.get_user(user_id)
+		if user is not None:
+			metrics.USER_LOOKUPS.inc(source="gateway")
+			return user
+
+		user = self._users.get(user_id)
+		if user is not None:
+			self._users.move_to_end(user_id)
+			metrics.USER_LOOKUPS.inc(source="cache")
+			return user
+
+		user = await self.bot.fetch_user(user_id)
+		metrics.USER_LOOKUPS.inc(source="fetch")
+		self._users[user_id] = user
+		while len(self._users) > self.max_size:
+			self._users.popitem(last=False)
+		return user
+	#end UserResolver
+
+def coalesce(messages, max_length=MAX_MESSAGE_LENGTH):
+	"""Joins messages into as few Discord messages as possible, one per line, never splitting a message
+	"""
+	chunks = []
+	for message in messages:
+		if chunks and len(chunks[-1]) + 1 + len(message) <= max_length:
+			chunks[-1] += "\n" + message
+		else:
+			chunks.append(message)
+	return chunks
+
+class DMQueue:
+
+	def __init__(self, resolver, window=1.0, rate=1.0, burst=5):
+		"""Creates a queue of DMs, sent in the background so commands don't wait on the Discord API
+
+		Notifications to the same user within window seconds of the first are sent together as one message
+		Sends are limited to rate per second on average, with bursts of up to burst at once
+		"""
+		self.resolver = resolver
+		self.window = window
+		self.limiter = AsyncRateLimiter(rate, burst)
+
+		#user id to the notifications waiting for them, and the ids whose window has closed, in order
+		self._pending = {}
+		self._ready = asyncio.Queue()
+		self._worker = None
+
+	def start(self):
+		"""Starts sending queued DMs from a background task, must be called from the event loop
+		"""
+		if self._worker is None or self._worker.done():
+			self._worker = asyncio.create_task(self._run())
+
+	def send(self, user_id, message):
+		"""Queues a DM to the user with the given id and returns straight away
+		
+		An id that isn't a discord id, e.g. one typed in by hand with q!createaccountwithbalance, is logged and the DM dropped, as the change being notified about has already been made
+		"""
+		try:
+			user_id = int(user_id)
+		except (TypeError, ValueError):
+			metrics.DMS_SENT.inc(outcome="invalid")
+			logger.warning("dropping DM to invalid user id user_id=%r", user_id)
+			return
+		metrics.DM_QUEUE_DEPTH.inc()
+		if user_id in self._pending:
+			self._pending[user_id].append(message)
+			return
+		self._pending[user_id] = [message]
+		asyncio.get_running_loop().call_later(self.window, self._ready.put_nowait, user_id)
+
+	async def _run(self):
+		while True:
+			user_id = await self._ready.get()
+			messages = self._pending.pop(user_id)
+			metrics.DM_QUEUE_DEPTH.dec(len(messages))
+			#a failed DM is logged and dropped, there is no one to report it to and it shouldn't stop the queue
+			try:
+				user = await self.resolver.resolve(user_id)
+				for chunk in coalesce(messages):
+					await self.limiter.acquire()
+					await user.send(chunk)
+					metrics.DMS_SENT.inc(outcome="sent")
+			except discord.Forbidden:
+				metrics.DMS_SENT.inc(outcome="forbidden")
+				logger.info("user doesn't accept DMs user_id=%s dropped=%d", user_id, len(messages))
+			except Exception:
+				metrics.DMS_SENT.inc(outcome="error")
+				logger.exception("sending DM failed user_id=%s dropped=%d", user_id, len(messages))
+	#end DMQueue
@@ -0,0 +1,202 @@
+#player_cache.py
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from mcuuid.api import GetPlayerData
+
+logger = logging.getLogger(__name__)
+
+def mojang_lookup(mc_name):
+	"""Looks the player up through the Mojang API, returns (uuid, name) or None if no such player exists
+	"""
+	player = GetPlayerData(mc_name)
+	if player.valid:
+		return (player.uuid, player.username)
+	return None
+
+class PlayerCacheTable:
+
+	def __init__(self, connection, read_connection=None):
+		"""Creates a persistent store for the player cache in the player_cache table
+
+		connection is a callable returning a context manager that yields a cursor, such as QBank.connection, and read_connection one used for reads, such as QBank.read_connection
+		"""
+		self.connection = connection
+		self.read_connection = read_connection or connection
+
+	def get(self, key):
+		"""Returns the stored (uuid, name, fetched_at) entry for the key, or None if there isn't one
+		"""
+		with self.read_connection() as cursor:
+			query = "SELECT mc_uuid, mc_name, fetched_at FROM player_cache WHERE lookup_name = %s"
+			data = [key]
+			cursor.execute(query, data)
+			record = cursor.fetchone()
+		if not record:
+			return None
+		return tuple(record)
+
+	def put(self, key, entry):
+		"""Stores the (uuid, name, fetched_at) entry under the key, replacing any existing entry
+		"""
+		with self.connection() as cursor:
+			query = "INSERT INTO player_cache (lookup_name, mc_uuid, mc_name, fetched_at) VALUES (%s, %s, %s, %s) AS new ON DUPLICATE KEY UPDATE mc_uuid = new.mc_uuid, mc_name = new.mc_name, fetched_at = new.fetched_at"
+			data = [key] + list(entry)
+			cursor.execute(query, data)
+	#end PlayerCacheTable
+
+class PlayerCache:
+
+	def __init__(self, lookup=mojang_lookup, store=None, max_size=1024, ttl=86400, negative_ttl=600, lookup_timeout=5, retry_after=60, max_retry_after=3600, clock=time.time):
+		"""Creates a two-tier cache of Minecraft name to uuid lookups
+
+		lookup is called with a player name and returns (uuid, name), or None if the name is invalid; it may raise if the upstream is unavailable
+		Entries are kept in an in-process LRU of max_size entries, backed by store (e.g. a PlayerCacheTable) so they survive restarts
+		Valid entries are fresh for ttl seconds and invalid names for negative_ttl seconds
+		Stale entries are served straight away while they are refreshed in the background, with at most one refresh in flight per name
+		A refresh that fails or takes longer than lookup_timeout seconds pauses background refreshes for retry_after seconds, doubling with each failure in a row up to max_retry_after
+		clock returns the current time in seconds, entries are timestamped with it
+		"""
+		self.lookup = lookup
+		self.store = store
+		self.max_size = max_size
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.lookup_timeout = lookup_timeout
+		self.retry_after = retry_after
+		self.max_retry_after = max_retry_after
+		self.clock = clock
+
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="player-lookup")
+
+		#key to the future of the refresh in flight for it, and the backoff after failed refreshes
+		self._refreshing = {}
+		self._failures = 0
+		self._paused_until = None
+
+	def get_uuid(self, mc_name):
+		"""Returns the uuid for the given player name, or None if no such player exists
+
+		Only waits on the lookup when there is no entry at all, so callers should look players up before opening a write transaction, as the refresh stores its result in its own
+		"""
+		key = mc_name.lower()
+		entry = self._get_entry(key)
+
+		if entry is None:
+			return self._start_refresh(key, mc_name).result()[0]
+
+		if not self._is_fresh(entry) and not self._paused():
+			self._start_refresh(key, mc_name)
+		return entry[0]
+
+	def remember(self, uuid, mc_name):
+		"""Records a known uuid for the given player name, e.g. after looking the player up by uuid
+		"""
+		self._put(mc_name.lower(), (uuid, mc_name, self.clock()))
+
+	def prime(self, entries):
+		"""Loads (key, uuid, name, fetched_at) rows already read from the store into the in-process cache, without writing them back
+		"""
+		for key, uuid, mc_name, fetched_at in entries:
+			self._remember_entry(key, (uuid, mc_name, fetched_at))
+
+	def invalidate(self, mc_name):
+		"""Removes the in-process entry for the given player name, so the next lookup goes back to the store
+		"""
+		with self._lock:
+			self._entries.pop(mc_name.lower(), None)
+
+	def close(self):
+		"""Waits for any refreshes in flight to finish, and stops taking new ones
+		"""
+		self._executor.shutdown(wait=True)
+
+	def _start_refresh(self, key, mc_name):
+		"""Returns the future of the refresh in flight for the key, starting one if there isn't one
+		"""
+		with self._lock:
+			future = self._refreshing.get(key)
+			if future is None:
+				future = self._executor.submit(self._refresh, key, mc_name)
+				self._refreshing[key] = future
+			return future
+
+	def _refresh(self, key, mc_name):
+		started = self.clock()
+		try:
+			entry = self._lookup_entry(key, mc_name)
+			if self.store is not None:
+				self.store.put(key, entry)
+		except Exception as e:
+			self._back_off()
+			logger.warning("player lookup failed name=%s error=%r", mc_name, e)
+			raise
+		finally:
+			with self._lock:
+				self._refreshing.pop(key, None)
+
+		elapsed = self.clock() - started
+		if elapsed > self.lookup_timeout:
+			self._back_off()
+			logger.warning("player lookup was slow name=%s seconds=%.2f", mc_name, elapsed)
+		else:
+			with self._lock:
+				self._failures = 0
+				self._paused_until = None
+		return entry
+
+	def _back_off(self):
+		with self._lock:
+			self._failures += 1
+			pause = min(self.retry_after * 2 ** (self._failures - 1), self.max_retry_after)
+			self._paused_until = self.clock() + pause
+
+	def _paused(self):
+		with self._lock:
+			return self._paused_until is not None and self.clock() < self._paused_until
+
+	def _lookup_entry(self, key, mc_name):
+		"""Looks the player up and keeps the result in the in-process cache, without storing it
+		"""
+		result = self.lookup(mc_name)
+		if result is None:
+			entry = (None, None, self.clock())
+		else:
+			entry = (result[0], result[1], self.clock())
+		self._remember_entry(key, entry)
+		return entry
+
+	def _is_fresh(self, entry):
+		ttl = self.ttl if entry[0] is not None else self.negative_ttl
+		return self.clock() - entry[2] < ttl
+
+	def _get_entry(self, key):
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+				return entry
+
+		if self.store is None:
+			return None
+		entry = self.store.get(key)
+		if entry is not None:
+			self._remember_entry(key, entry)
+		return entry
+
+	def _put(self, key, entry):
+		self._remember_entry(key, entry)
+		if self.store is not None:
+			self.store.put(key, entry)
+
+	def _remember_entry(self, key, entry):
+		with self._lock:
+			self._entries[key] = entry
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+	#end PlayerCache
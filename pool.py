@@ -0,0 +1,145 @@
+#pool.py
+import time
+import threading
+from contextlib import contextmanager
+import metrics
+from exceptions import *
+
+class ConnectionPool:
+
+	def __init__(self, connect, size=5, max_overflow=10, idle_timeout=300, timeout=30, health_check=None, on_discard=None):
+		"""Creates a new pool of reusable database connections
+
+		connect is called with no arguments whenever the pool needs a new connection
+		Up to size connections are kept idle for reuse, and up to max_overflow extra connections are opened under load and closed when returned
+		Idle connections older than idle_timeout seconds are discarded on checkout, and health_check (if given) is called on every other connection before it is handed out
+		on_discard (if given) is called with every connection the pool closes, just before it is closed
+		"""
+		self.connect = connect
+		self.size = size
+		self.max_overflow = max_overflow
+		self.idle_timeout = idle_timeout
+		self.timeout = timeout
+		self.health_check = health_check
+		self.on_discard = on_discard
+
+		self._idle = []
+		self._open = 0
+		self._lock = threading.Condition()
+		self._closed = False
+
+	def acquire(self):
+		"""Checks a connection out of the pool, opening a new one if none are idle and the pool isn't full
+
+		Raises a PoolTimeoutError if no connection becomes available within the pool's timeout
+		"""
+		deadline = time.monotonic() + self.timeout
+		while True:
+			conn = None
+			with self._lock:
+				if self._closed:
+					raise PoolTimeoutError("The connection pool has been closed")
+
+				if self._idle:
+					conn, last_used = self._idle.pop()
+					if time.monotonic() - last_used > self.idle_timeout:
+						self._discard(conn)
+						continue
+				elif self._open < self.size + self.max_overflow:
+					self._open += 1
+				else:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						raise PoolTimeoutError(f"No database connection became available within {self.timeout} seconds")
+					self._lock.wait(remaining)
+					continue
+
+			if conn is None:
+				try:
+					return self.connect()
+				except BaseException:
+					with self._lock:
+						self._open -= 1
+						self._lock.notify()
+					raise
+
+			if self._healthy(conn):
+				return conn
+			with self._lock:
+				self._discard(conn)
+
+	def release(self, conn):
+		"""Returns a connection to the pool, closing it instead if the pool already holds enough idle connections
+		"""
+		with self._lock:
+			if self._closed or len(self._idle) >= self.size:
+				self._discard(conn)
+			else:
+				self._idle.append((conn, time.monotonic()))
+			self._lock.notify()
+
+	def invalidate(self, conn):
+		"""Closes a connection that is no longer usable instead of returning it to the pool
+		"""
+		with self._lock:
+			self._discard(conn)
+			self._lock.notify()
+
+	def warm(self):
+		"""Opens connections until the pool holds size of them, so the first operations don't wait for a connection to be opened
+		"""
+		#borrowing size connections at once takes every idle one and opens the rest
+		conns = []
+		try:
+			for i in range(self.size):
+				conns.append(self.acquire())
+		finally:
+			for conn in conns:
+				self.release(conn)
+
+	@contextmanager
+	def connection(self):
+		"""Borrows a connection for the duration of a with block
+		"""
+		with metrics.POOL_ACQUIRE_SECONDS.time():
+			conn = self.acquire()
+		try:
+			yield conn
+		except BaseException:
+			if self._healthy(conn):
+				self.release(conn)
+			else:
+				self.invalidate(conn)
+			raise
+		else:
+			self.release(conn)
+
+	def close(self):
+		"""Closes every idle connection and stops handing out new ones
+		"""
+		with self._lock:
+			self._closed = True
+			while self._idle:
+				conn, last_used = self._idle.pop()
+				self._discard(conn)
+			self._lock.notify_all()
+
+	def _healthy(self, conn):
+		if self.health_check is None:
+			return True
+		try:
+			return bool(self.health_check(conn))
+		except Exception:
+			return False
+
+	def _discard(self, conn):
+		"""Closes the connection and frees its slot, must be called while holding the lock
+		"""
+		self._open -= 1
+		if self.on_discard is not None:
+			self.on_discard(conn)
+		try:
+			conn.close()
+		except Exception:
+			pass
+	#end ConnectionPool
@@ -0,0 +1,79 @@
+#rate_limit.py
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+
+	def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+		"""Creates a thread-safe token bucket allowing rate calls per second on average, and up to burst calls at once
+
+		clock returns the current time in seconds and sleep waits for a number of seconds, both can be replaced to test without waiting
+		"""
+		self.rate = rate
+		self.burst = burst
+		self.clock = clock
+		self.sleep = sleep
+		self._tokens = burst
+		self._updated = clock()
+		self._lock = threading.Lock()
+
+	def acquire(self):
+		"""Blocks until the caller is allowed to make another call
+		"""
+		while True:
+			with self._lock:
+				now = self.clock()
+				self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+				self._updated = now
+				if self._tokens >= 1:
+					self._tokens -= 1
+					return
+				wait = (1 - self._tokens) / self.rate
+			self.sleep(wait)
+	#end RateLimiter
+
+class AsyncRateLimiter:
+
+	def __init__(self, rate, burst=1, clock=time.monotonic, sleep=asyncio.sleep):
+		"""Creates a token bucket like RateLimiter for coroutines on one event loop, waiting without blocking the loop
+		"""
+		self.rate = rate
+		self.burst = burst
+		self.clock = clock
+		self.sleep = sleep
+		self._tokens = burst
+		self._updated = clock()
+
+	async def acquire(self):
+		"""Waits until the caller is allowed to make another call
+		"""
+		while True:
+			now = self.clock()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			if self._tokens >= 1:
+				self._tokens -= 1
+				return
+			await self.sleep((1 - self._tokens) / self.rate)
+	#end AsyncRateLimiter
+
+def with_retries(func, *args, attempts=3, backoff=1.0, limiter=None, sleep=time.sleep):
+	"""Calls func with the given arguments, retrying with exponential backoff if it raises
+
+	Waits on the limiter (if given) before every attempt, and re-raises the last exception once all attempts have failed
+	sleep waits between attempts, and can be replaced to test without waiting
+	"""
+	for attempt in range(attempts):
+		if limiter is not None:
+			limiter.acquire()
+		try:
+			return func(*args)
+		except Exception as e:
+			if attempt == attempts - 1:
+				raise
+			logger.debug("retrying func=%s attempt=%d error=%r", getattr(func, '__name__', func), attempt + 1, e)
+			sleep(backoff * 2 ** attempt)
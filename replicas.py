@@ -0,0 +1,113 @@
+#replicas.py
+"""Routing of QBank's read-only queries to replica databases
+
+Replicas are configured on the storage backend (see MySQLBackend), and a replica is only used while its replication lag is within the allowed maximum
+Once a session has written to the primary, its reads stay on the primary for the rest of the session, so it always sees its own writes
+To try it locally, run a second MySQL instance replicating from the first (e.g. on port 3307), set MYSQL_REPLICAS=127.0.0.1:3307 and run python -m benchmarks.conformance --backends mysql
+"""
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class ReadSession:
+	"""One logical unit of work, such as a bot command, whose reads stick to the primary after it has written
+	"""
+
+	def __init__(self):
+		self.wrote = False
+	#end ReadSession
+
+#the session the current operation belongs to, QBank's worker threads see the same ReadSession object as the command that started them
+current_session = contextvars.ContextVar('current_session', default=None)
+
+@contextmanager
+def session():
+	"""Runs the with block as one ReadSession, and yields it
+	"""
+	read_session = ReadSession()
+	token = current_session.set(read_session)
+	try:
+		yield read_session
+	finally:
+		current_session.reset(token)
+
+class Replica:
+
+	def __init__(self, backend, lag_check_seconds=5):
+		"""Wraps a replica's backend and connection pool, measuring its replication lag at most every lag_check_seconds
+		"""
+		self.backend = backend
+		self.name = backend.key()
+		self.pool = backend.create_pool()
+		self.lag_check_seconds = lag_check_seconds
+
+		self._lag = float("inf")
+		self._checked_at = None
+		self._lock = threading.Lock()
+
+	def lag(self):
+		"""Returns the replica's last measured lag in seconds, measuring it again if the last measurement is too old
+
+		A replica that can't be reached or isn't replicating counts as infinitely far behind
+		While one thread measures the lag, other threads get the previous measurement instead of waiting
+		"""
+		if self._checked_at is not None and time.monotonic() - self._checked_at < self.lag_check_seconds:
+			return self._lag
+		if not self._lock.acquire(blocking=False):
+			return self._lag
+		try:
+			try:
+				with self.pool.connection() as db:
+					cursor = self.backend.cursor(db)
+					try:
+						lag = self.backend.replica_lag(cursor)
+					finally:
+						cursor.close()
+						db.rollback()
+				self._lag = float("inf") if lag is None else float(lag)
+			except Exception as e:
+				logger.warning("checking replica lag failed replica=%s error=%r", self.name, e)
+				self._lag = float("inf")
+			self._checked_at = time.monotonic()
+			metrics.REPLICA_LAG_SECONDS.set(self._lag, replica=self.name)
+			return self._lag
+		finally:
+			self._lock.release()
+
+	def close(self):
+		self.pool.close()
+	#end Replica
+
+class ReplicaSet:
+
+	def __init__(self, replicas, max_lag=5):
+		"""Chooses between replicas in turn, skipping any lagging more than max_lag seconds behind the primary
+		"""
+		self.replicas = list(replicas)
+		self.max_lag = max_lag
+		self._next = 0
+		self._lock = threading.Lock()
+
+	def choose(self):
+		"""Returns the replica to send the next read to, or None if the read should go to the primary
+		"""
+		if not self.replicas:
+			return None
+		with self._lock:
+			start = self._next
+			self._next = (self._next + 1) % len(self.replicas)
+		for i in range(len(self.replicas)):
+			replica = self.replicas[(start + i) % len(self.replicas)]
+			if replica.lag() <= self.max_lag:
+				return replica
+		return None
+
+	def close(self):
+		for replica in self.replicas:
+			replica.close()
+	#end ReplicaSet
@@ -0,0 +1,88 @@
+#scheduler.py
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from exceptions import *
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class AccountScheduler:
+
+	def __init__(self, qb):
+		"""Creates a scheduler that runs operations on an AsyncQBank's thread pool, one at a time per account
+
+		Operations on different accounts run in parallel, while an operation on an account waits for the ones already holding its lock
+		Operations on several accounts, like transfers, take their locks in ascending account id order, so two of them can never each hold a lock the other is waiting for
+		"""
+		self.qb = qb
+		#account id to [lock, number of operations holding or waiting for it], entries are dropped once nobody needs them
+		self._locks = {}
+
+	@asynccontextmanager
+	async def hold(self, *account_ids):
+		"""Holds the locks of the given accounts for the duration of the async with block, account ids of None are ignored
+		"""
+		account_ids = sorted({account_id for account_id in account_ids if account_id is not None})
+		entries = []
+		for account_id in account_ids:
+			entry = self._locks.setdefault(account_id, [asyncio.Lock(), 0])
+			entry[1] += 1
+			entries.append((account_id, entry))
+
+		acquired = []
+		metrics.SCHEDULER_QUEUE_DEPTH.inc()
+		start = time.perf_counter()
+		try:
+			try:
+				for account_id, entry in entries:
+					await entry[0].acquire()
+					acquired.append(entry[0])
+			finally:
+				waited = time.perf_counter() - start
+				metrics.SCHEDULER_QUEUE_DEPTH.dec()
+				metrics.SCHEDULER_LOCK_WAIT_SECONDS.observe(waited)
+
+			logger.debug("acquired account locks accounts=%s waited=%.3f", account_ids, waited)
+			metrics.SCHEDULER_RUNNING.inc()
+			try:
+				yield
+			finally:
+				metrics.SCHEDULER_RUNNING.dec()
+		finally:
+			for lock in reversed(acquired):
+				lock.release()
+			for account_id, entry in entries:
+				entry[1] -= 1
+				if entry[1] == 0:
+					del self._locks[account_id]
+
+	async def run(self, account_ids, func, *args, **kwargs):
+		"""Runs func with the given arguments on the QBank thread pool once it holds the locks of every account in account_ids, and returns its result
+		"""
+		async with self.hold(*account_ids):
+			return await self.qb.run(func, *args, **kwargs)
+
+	async def account_ids(self, mc_names=(), dc_ids=()):
+		"""Looks up the account ids of the given Minecraft names and discord ids, skipping any without an account
+
+		Players without an account are left out rather than raising, the operation itself reports them when it runs
+		"""
+		return await self.qb.run(self._account_ids, list(mc_names), list(dc_ids))
+
+	def _account_ids(self, mc_names, dc_ids):
+		result = []
+		for lookup, keys in [(self.qb.qbank.get_account_id_from_mc_name, mc_names), (self.qb.qbank.get_account_id_from_dc_id, dc_ids)]:
+			for key in keys:
+				try:
+					result.append(lookup(key))
+				except (AccountNotFoundError, InvalidPlayerError):
+					pass
+		return result
+
+	def pending(self):
+		"""Returns the number of accounts with an operation holding or waiting for their lock
+		"""
+		return len(self._locks)
+	#end AccountScheduler
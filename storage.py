@@ -0,0 +1,311 @@
+#storage.py
+"""The databases QBank can keep its data in
+
+QBank's queries are written for MySQL; other backends translate them into their own dialect as they are executed
+The backend is chosen with QBANK_BACKEND in .env: mysql (the default) or sqlite, which stores the bank in the file at SQLITE_PATH, or in memory if SQLITE_PATH is :memory:
+"""
+import os
+import re
+import abc
+import sqlite3
+import weakref
+import threading
+import datetime as dt
+import functools
+import mysql.connector as mysql
+import migrations
+import metrics
+from pool import ConnectionPool
+
+class PreparedStatement:
+	"""One query prepared on one connection, executed again with new data without being parsed again
+	"""
+
+	def __init__(self, cursor, query):
+		self._cursor = cursor
+		self.query = query
+
+	def execute(self, data=()):
+		return self._cursor.execute(self.query, data)
+
+	def executemany(self, data):
+		return self._cursor.executemany(self.query, data)
+
+	def fetchone(self):
+		#prepared statements are only used for single row lookups, reading every row leaves nothing unread on the connection
+		rows = self._cursor.fetchall()
+		return rows[0] if rows else None
+
+	def fetchall(self):
+		return self._cursor.fetchall()
+
+	@property
+	def rowcount(self):
+		return self._cursor.rowcount
+	#end PreparedStatement
+
+class Backend(abc.ABC):
+
+	#the schema migrations for this database, applied in order by migrate()
+	migrations = migrations.MIGRATIONS
+
+	def __init__(self):
+		#whether prepare() prepares statements on the server, set PREPARED_STATEMENTS=0 in .env to send every query as text instead
+		self.prepared_statements = os.getenv('PREPARED_STATEMENTS', '1') != '0'
+		#connection to {statement name: PreparedStatement}, a statement's cursor keeps its connection alive, so entries are dropped by forget() when the pool discards the connection
+		self._statements = weakref.WeakKeyDictionary()
+		self._statements_lock = threading.Lock()
+
+	@abc.abstractmethod
+	def connect(self):
+		"""Opens a new connection to the database
+		"""
+
+	def create_pool(self):
+		"""Creates a pool of connections to the database, sized by MYSQL_POOL_SIZE, MYSQL_POOL_MAX_OVERFLOW, MYSQL_POOL_IDLE_TIMEOUT and MYSQL_POOL_TIMEOUT in .env
+		"""
+		return ConnectionPool(
+			self.connect,
+			size = int(os.getenv('MYSQL_POOL_SIZE', 5)),
+			max_overflow = int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', 10)),
+			idle_timeout = float(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', 300)),
+			timeout = float(os.getenv('MYSQL_POOL_TIMEOUT', 30)),
+			health_check = self.is_healthy,
+			on_discard = self.forget
+		)
+
+	@abc.abstractmethod
+	def cursor(self, db, buffered=True):
+		"""Returns a cursor on the connection that accepts QBank's queries, buffered cursors fetch every result row as soon as a query is executed
+		"""
+
+	def begin(self, db, write=True):
+		"""Starts a database transaction on the connection, called at the start of every QBank.connection() block
+
+		write is False for blocks that only read
+		"""
+		pass
+
+	def is_healthy(self, db):
+		return True
+
+	def discard_results(self, db):
+		"""Throws away any result rows an unbuffered cursor left unread, so the connection can be reused
+		"""
+		pass
+
+	def prepare(self, db, name, query):
+		"""Returns the named query as a PreparedStatement on the connection, preparing it the first time the name is used on that connection
+		"""
+		with self._statements_lock:
+			statements = self._statements.setdefault(db, {})
+		statement = statements.get(name)
+		if statement is None:
+			cursor = self.prepared_cursor(db) if self.prepared_statements else self.cursor(db)
+			statement = statements[name] = PreparedStatement(cursor, query)
+			metrics.STATEMENTS_PREPARED.inc(name=name)
+		return statement
+
+	def forget(self, db):
+		"""Drops the statements prepared on a connection that is being closed
+		"""
+		with self._statements_lock:
+			self._statements.pop(db, None)
+
+	def prepared_cursor(self, db):
+		"""Returns a cursor that prepares the statements it executes on the server and reuses them while the query stays the same
+		"""
+		return self.cursor(db)
+
+	def key(self):
+		"""Returns a string identifying the database, under which its schema version can be cached, or None if it can't be cached
+		"""
+		return None
+
+	def replicas(self):
+		"""Returns a backend for each replica of the database that read-only queries can be sent to
+		"""
+		return []
+
+	def replica_lag(self, cursor):
+		"""Returns how many seconds the replica the cursor is connected to is behind its primary, or None if it isn't replicating
+		"""
+		return None
+
+	def migrate(self, cursor):
+		"""Creates or upgrades the schema, returns the resulting schema version
+		"""
+		return migrations.migrate(cursor, self.migrations, self.commit)
+
+	def commit(self, cursor):
+		"""Commits the work done so far on the cursor's connection, leaving it in a transaction for the rest of the QBank.connection() block
+		"""
+		cursor.execute("COMMIT")
+	#end Backend
+
+class MySQLBackend(Backend):
+
+	name = "mysql"
+
+	def __init__(self, host=None, user=None, password=None, database=None, auth_plugin=None, port=None, replica_hosts=None):
+		"""Stores the bank in a MySQL database, connecting with the given host and credentials or the ones given in .env
+
+		replica_hosts is a list of "host" or "host:port" replicas of the database, or MYSQL_REPLICAS from .env as a comma separated list, which are reached with the same credentials
+		"""
+		super().__init__()
+		self.host = host or os.getenv('MYSQL_HOST')
+		self.port = int(port or os.getenv('MYSQL_PORT', 3306))
+		if replica_hosts is None:
+			replica_hosts = [replica.strip() for replica in os.getenv('MYSQL_REPLICAS', '').split(',') if replica.strip()]
+		self.replica_hosts = replica_hosts
+		self.user = user or os.getenv('MYSQL_USER')
+		self.password = password or os.getenv('MYSQL_PASSWORD')
+		self.database = database or os.getenv('DATABASE')
+		self.auth_plugin = auth_plugin or os.getenv('AUTH_PLUGIN')
+
+	def connect(self):
+		return mysql.connect(
+			host = self.host,
+			port = self.port,
+			user = self.user,
+			passwd = self.password,
+			auth_plugin = self.auth_plugin,
+			database = self.database
+		)
+
+	def cursor(self, db, buffered=True):
+		return db.cursor(buffered=buffered)
+
+	def prepared_cursor(self, db):
+		return db.cursor(prepared=True)
+
+	def key(self):
+		return f"mysql://{self.user}@{self.host}:{self.port}/{self.database}"
+
+	def replicas(self):
+		backends = []
+		for replica in self.replica_hosts:
+			host, _, port = replica.partition(":")
+			backends.append(MySQLBackend(host, self.user, self.password, self.database, self.auth_plugin, port or 3306, replica_hosts=[]))
+		return backends
+
+	def replica_lag(self, cursor):
+		#SHOW REPLICA STATUS replaced SHOW SLAVE STATUS in MySQL 8.0.22, along with the names of its columns
+		try:
+			cursor.execute("SHOW REPLICA STATUS")
+		except mysql.Error:
+			cursor.execute("SHOW SLAVE STATUS")
+		record = cursor.fetchone()
+		if record is None:
+			return None
+		status = dict(zip([column[0] for column in cursor.description], record))
+		return status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+
+	def is_healthy(self, db):
+		return db.is_connected()
+
+	def discard_results(self, db):
+		db.consume_results()
+	#end MySQLBackend
+
+@functools.lru_cache(maxsize=512)
+def sqlite_query(query):
+	"""Translates one of QBank's MySQL queries into SQLite's dialect
+
+	SQLite has no row locks, instead every transaction that may write takes the database's write lock up front (see SQLiteBackend.begin), so FOR UPDATE is simply dropped
+	Upserts name the inserted row with an alias, e.g. VALUES (...) AS new ON DUPLICATE KEY UPDATE x = new.x, which SQLite calls excluded
+	"""
+	query = query.replace("%s", "?")
+	query = query.replace(" FOR UPDATE", "")
+	query = query.replace("INSERT IGNORE", "INSERT OR IGNORE")
+	query = query.replace("CURDATE()", "date('now', 'localtime')")
+	upsert = re.search(r" AS (\w+) ON DUPLICATE KEY UPDATE ", query)
+	if upsert:
+		updates = re.sub(rf"\b{upsert.group(1)}\.", "excluded.", query[upsert.end():])
+		query = query[:upsert.start()] + " ON CONFLICT DO UPDATE SET " + updates
+	return query
+
+class SQLiteCursor:
+	"""Wraps a sqlite3 cursor, translating QBank's queries as they are executed
+	"""
+
+	def __init__(self, cursor):
+		self._cursor = cursor
+
+	def execute(self, query, data=()):
+		return self._cursor.execute(sqlite_query(query), tuple(data))
+
+	def executemany(self, query, data):
+		return self._cursor.executemany(sqlite_query(query), [tuple(row) for row in data])
+
+	def __getattr__(self, name):
+		return getattr(self._cursor, name)
+	#end SQLiteCursor
+
+class SQLiteConnection(sqlite3.Connection):
+	"""A sqlite3 connection that can be weakly referenced, so prepared statements can be kept per connection
+	"""
+	pass
+
+sqlite3.register_adapter(dt.date, lambda value: value.isoformat())
+sqlite3.register_adapter(dt.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATE", lambda value: dt.date.fromisoformat(value.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda value: dt.datetime.fromisoformat(value.decode()))
+
+class SQLiteBackend(Backend):
+
+	name = "sqlite"
+	migrations = migrations.SQLITE_MIGRATIONS
+
+	def __init__(self, path=":memory:", timeout=30):
+		"""Stores the bank in the SQLite database at path, or in memory if path is :memory:
+
+		Connections wait up to timeout seconds for another connection's transaction to finish
+		"""
+		super().__init__()
+		self.path = path
+		self.timeout = timeout
+
+	def connect(self):
+		#sqlite3 keeps its own cache of compiled statements per connection, which prepare() relies on
+		db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=256, factory=SQLiteConnection)
+		if self.path != ":memory:":
+			db.execute("PRAGMA journal_mode = WAL")
+		return db
+
+	def create_pool(self):
+		"""Creates a pool of connections to the database
+
+		An in-memory database only exists within its one connection, so the pool holds exactly that connection and never closes it for being idle
+		"""
+		if self.path != ":memory:":
+			return super().create_pool()
+		return ConnectionPool(self.connect, size=1, max_overflow=0, idle_timeout=float("inf"), timeout=float(os.getenv('MYSQL_POOL_TIMEOUT', 30)), on_discard=self.forget)
+
+	def cursor(self, db, buffered=True):
+		return SQLiteCursor(db.cursor())
+
+	def begin(self, db, write=True):
+		#a read-only block takes no lock until it reads, so it never waits for, or holds up, another connection's writes
+		db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+
+	def key(self):
+		#every in-memory database is a new, empty one
+		if self.path == ":memory:":
+			return None
+		return f"sqlite://{os.path.abspath(self.path)}"
+
+	def commit(self, cursor):
+		cursor.execute("COMMIT")
+		cursor.execute("BEGIN IMMEDIATE")
+	#end SQLiteBackend
+
+def backend_from_env():
+	"""Creates the backend chosen by QBANK_BACKEND in .env
+	"""
+	name = os.getenv('QBANK_BACKEND', 'mysql').lower()
+	if name == "mysql":
+		return MySQLBackend()
+	if name == "sqlite":
+		return SQLiteBackend(os.getenv('SQLITE_PATH', 'qbank.db'), float(os.getenv('SQLITE_TIMEOUT', 30)))
+	raise ValueError(f"Unknown QBANK_BACKEND {name}, expected mysql or sqlite")
@@ -0,0 +1,8 @@
+#tests/conftest.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def pytest_configure(config):
+	config.addinivalue_line("markers", "mysql: runs against the MySQL database configured in .env, which should be a scratch database, skipped unless MYSQL_HOST is set")
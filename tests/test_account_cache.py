@@ -0,0 +1,68 @@
+#tests/test_account_cache.py
+import threading
+from account_cache import Account, AccountCache
+from amount import Amount
+from QBank import QBank
+from storage import SQLiteBackend
+from benchmarks.common import fake_lookup
+
+def account(balance):
+	return Account(1, "uuid-a", "alice", "1001", Amount(0, balance))
+
+def test_reader_cant_cache_an_account_with_a_write_in_flight():
+	cache = AccountCache()
+	generation = cache.generation()
+	dropped, token = cache.begin_write(1)
+	cache.put(account(10), cache.generation())
+	assert cache.get_by_id(1) is None
+	cache.end_write(1, token, account(15))
+	cache.put(account(10), generation)
+	assert cache.get_by_id(1) == account(15)
+
+def test_older_write_isnt_cached_over_a_newer_one():
+	cache = AccountCache()
+	cache.put(account(10))
+	dropped, first = cache.begin_write(1)
+	assert dropped == account(10)
+	dropped, second = cache.begin_write(1)
+	cache.end_write(1, second, account(20))
+	assert cache.get_by_id(1) is None
+	cache.end_write(1, first, account(15))
+	assert cache.get_by_id(1) is None
+
+def test_rolled_back_write_leaves_the_account_uncached():
+	cache = AccountCache()
+	cache.put(account(10))
+	dropped, token = cache.begin_write(1)
+	cache.end_write(1, token)
+	assert cache.get_by_id(1) is None
+	cache.put(account(10))
+	assert cache.get_by_id(1) == account(10)
+
+def test_read_just_before_a_commit_doesnt_cache_the_old_balance(tmp_path):
+	qb = QBank(player_lookup=fake_lookup, backend=SQLiteBackend(str(tmp_path / "bank.db")))
+	try:
+		qb.create_new_account("alice", "1001", Amount(0, 10))
+		account_id = qb.get_account_id_from_mc_name("alice")
+		qb.accounts.clear()
+
+		#a reader on another thread misses the cache and reads the committed row while the deposit is about to commit
+		write_bank_totals = qb._write_bank_totals
+		seen = []
+		def read_then_write_bank_totals():
+			#every connection() block calls this, only the deposit's starts a reader
+			if not seen:
+				seen.append(None)
+				reader = threading.Thread(target=lambda: seen.append(qb.check_balance_account_id(account_id)))
+				reader.start()
+				reader.join()
+			write_bank_totals()
+		qb._write_bank_totals = read_then_write_bank_totals
+
+		qb.deposit("alice", Amount(0, 5))
+		qb._write_bank_totals = write_bank_totals
+
+		assert seen == [None, Amount(0, 10)]
+		assert qb.check_balance_account_id(account_id) == Amount(0, 15)
+	finally:
+		qb.close()
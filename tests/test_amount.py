@@ -0,0 +1,84 @@
+#tests/test_amount.py
+import pickle
+import pytest
+from amount import Amount, ZERO, SCRAP_PER_BLOCK, SCRAP_PER_INGOT, DIAMONDS_PER_BLOCK, build_amount, get_amount_as_string
+
+def test_addition_and_subtraction_work_per_currency_family():
+	a = Amount(40, 20)
+	b = Amount(3, 25)
+	assert a + b == Amount(43, 45)
+	assert a - b == Amount(37, -5)
+	assert a - a == ZERO
+	assert -a == Amount(-40, -20)
+	assert a + ZERO == a
+
+def test_arithmetic_with_other_types_is_rejected():
+	with pytest.raises(TypeError):
+		Amount(1, 1) + 1
+	with pytest.raises(TypeError):
+		Amount(1, 1) - 1
+	assert Amount(1, 1) != (1, 1)
+
+def test_ordering_compares_netherite_before_diamonds():
+	assert Amount(1, 0) > Amount(0, 1000)
+	assert Amount(1, 2) < Amount(1, 3)
+	assert Amount(-1, 5) < ZERO
+	assert sorted([Amount(2, 0), Amount(0, 9), Amount(1, 50)]) == [Amount(0, 9), Amount(1, 50), Amount(2, 0)]
+	assert max(Amount(1, 1), Amount(1, 2)) == Amount(1, 2)
+
+def test_sign_checks_and_truthiness():
+	assert Amount(-1, 5).any_negative() and Amount(-1, 5).any_positive()
+	assert not ZERO.any_negative() and not ZERO.any_positive()
+	assert not ZERO
+	assert Amount(0, -1)
+
+def test_at_most_caps_each_family_separately():
+	assert Amount(10, 2).at_most(Amount(4, 9)) == Amount(4, 2)
+
+def test_denominations_use_the_largest_denominations():
+	assert Amount(SCRAP_PER_BLOCK + SCRAP_PER_INGOT + 1, DIAMONDS_PER_BLOCK + 1).denominations() == [1, 1, 1, 1, 1]
+	assert Amount(SCRAP_PER_INGOT * 10, 0).denominations() == [1, 1, 0, 0, 0]
+	assert ZERO.denominations() == [0, 0, 0, 0, 0]
+
+def test_netherite_and_diamonds_never_mix_when_normalized():
+	#36 scrap make a netherite block and 9 diamonds a diamond block, but no amount of one becomes the other
+	assert Amount.from_denominations([0, 0, 100, 0, 0]) == Amount(100, 0)
+	assert Amount.from_denominations([0, 0, 0, 0, 100]) == Amount(0, 100)
+	assert Amount.from_denominations([0, 9, 0, 0, 9]).denominations() == [1, 0, 0, 1, 0]
+
+def test_negative_amounts_split_keeping_their_sign():
+	assert Amount._split(-40, SCRAP_PER_BLOCK) == (-1, -4)
+	assert Amount._split(40, SCRAP_PER_BLOCK) == (1, 4)
+	assert Amount._split(-3, SCRAP_PER_BLOCK) == (0, -3)
+	assert Amount(-41, -10).denominations() == [-1, -1, -1, -1, -1]
+
+@pytest.mark.parametrize("amount", [ZERO, Amount(1, 0), Amount(0, 1), Amount(41, 10), Amount(-41, -10), Amount(-5, 7), Amount(10 ** 9 + 7, 10 ** 9 + 7)])
+def test_denominations_round_trip(amount):
+	assert Amount.from_denominations(amount.denominations()) == amount
+	assert Amount.from_denominations(list(amount)) == amount
+
+def test_amounts_are_immutable_and_hashable():
+	amount = Amount(1, 2)
+	with pytest.raises(AttributeError):
+		amount.netherite = 5
+	assert {Amount(1, 2): "a"}[Amount(1, 2)] == "a"
+	assert pickle.loads(pickle.dumps(amount)) == amount
+
+def test_build_amount_adds_up_denominations():
+	assert build_amount(["1nb", "2ni", "3ns", "4db", "5d"]) == Amount.from_denominations([1, 2, 3, 4, 5])
+	assert build_amount(["10d", "5d"]) == Amount(0, 15)
+	assert build_amount(["40ns"]) == Amount(40, 0)
+	assert build_amount([]) == ZERO
+
+def test_build_amount_rejects_malformed_numbers():
+	with pytest.raises(ValueError):
+		build_amount(["xd"])
+
+def test_amount_string_skips_zero_denominations():
+	assert get_amount_as_string(Amount(SCRAP_PER_BLOCK + 1, 2)) == "1nb 1ns 2d"
+	assert get_amount_as_string(Amount(0, DIAMONDS_PER_BLOCK)) == "1db"
+	assert get_amount_as_string(ZERO) == "0nb 0ni 0ns 0db 0d"
+
+@pytest.mark.parametrize("amount", [ZERO, Amount(1, 0), Amount(0, 1), Amount(41, 10), Amount(-41, -10), Amount(-5, 7), Amount(123456, 789)])
+def test_amount_string_round_trips(amount):
+	assert build_amount(get_amount_as_string(amount).split()) == amount
@@ -0,0 +1,24 @@
+#tests/test_conformance.py
+"""Runs the checks from benchmarks/conformance.py as tests, against in-memory SQLite and, with -m mysql and MYSQL_HOST set, against MySQL
+"""
+import os
+import pytest
+from dotenv import load_dotenv
+from QBank import QBank
+from benchmarks.common import fake_lookup
+from benchmarks.conformance import BACKENDS, CHECKS
+
+load_dotenv()
+
+@pytest.fixture(scope="module", params=[
+	"sqlite",
+	pytest.param("mysql", marks=[pytest.mark.mysql, pytest.mark.skipif(not os.getenv('MYSQL_HOST'), reason="MYSQL_HOST isn't set")])
+])
+def qb(request):
+	qb = QBank(player_lookup=fake_lookup, backend=BACKENDS[request.param]())
+	yield qb
+	qb.close()
+
+@pytest.mark.parametrize("check", CHECKS, ids=[check.__name__ for check in CHECKS])
+def test_conformance(qb, check):
+	check(qb)
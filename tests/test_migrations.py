@@ -0,0 +1,51 @@
+#tests/test_migrations.py
+import sqlite3
+import pytest
+from exceptions import MigrationError
+from QBank import QBank
+from storage import SQLiteBackend
+from benchmarks.common import fake_lookup
+
+def create_unversioned_accounts(path, rows):
+	"""Creates an accounts table as it was before the schema was versioned, without its unique indexes
+	"""
+	db = sqlite3.connect(path)
+	db.execute("CREATE TABLE accounts (account_id INTEGER PRIMARY KEY AUTOINCREMENT, mc_uuid CHAR(36), mc_name VARCHAR(16), dc_id VARCHAR(255), "
+			"netherite_blocks INT DEFAULT 0, netherite_ingots INT DEFAULT 0, netherite_scrap INT DEFAULT 0, diamond_blocks INT DEFAULT 0, diamonds INT DEFAULT 0, opted_into_interest BOOLEAN DEFAULT TRUE)")
+	db.executemany("INSERT INTO accounts (mc_uuid, mc_name, dc_id) VALUES (?, ?, ?)", rows)
+	db.commit()
+	db.close()
+
+def migrate(path):
+	qb = QBank(player_lookup=fake_lookup, backend=SQLiteBackend(path), lazy=True)
+	try:
+		return qb.ensure_schema()
+	finally:
+		qb.close()
+
+def test_duplicate_accounts_stop_the_unique_indexes_with_a_report(tmp_path):
+	path = str(tmp_path / "bank.db")
+	create_unversioned_accounts(path, [("uuid-a", "alice", "1001"), ("uuid-b", "bob", "1002"), ("uuid-a", "alice", "1003"), ("uuid-c", "carol", "1002")])
+	with pytest.raises(MigrationError) as error:
+		migrate(path)
+	assert "uq_accounts_mc_uuid" in str(error.value)
+	assert "'uuid-a' is shared by account ids 1, 3" in str(error.value)
+
+	db = sqlite3.connect(path)
+	assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name LIKE 'uq_accounts_%'").fetchone()[0] == 0
+	db.execute("DELETE FROM accounts WHERE account_id = 3")
+	db.commit()
+	db.close()
+
+	with pytest.raises(MigrationError, match="dc_id '1002' is shared by account ids 2, 4"):
+		migrate(path)
+
+def test_accounts_without_duplicates_are_migrated(tmp_path):
+	path = str(tmp_path / "bank.db")
+	create_unversioned_accounts(path, [("uuid-a", "alice", "1001"), ("uuid-b", "bob", "1002"), (None, "nobody", None), (None, "nobody", None)])
+	assert migrate(path) == SQLiteBackend.migrations[-1][0]
+
+	db = sqlite3.connect(path)
+	with pytest.raises(sqlite3.IntegrityError):
+		db.execute("INSERT INTO accounts (mc_uuid, mc_name, dc_id) VALUES ('uuid-a', 'alice', '2001')")
+	db.close()
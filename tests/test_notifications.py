@@ -0,0 +1,144 @@
+#tests/test_notifications.py
+import asyncio
+from types import SimpleNamespace
+import discord
+import metrics
+from notifications import UserResolver, DMQueue, coalesce
+from rate_limit import AsyncRateLimiter
+
+class FakeUser:
+
+	def __init__(self, user_id, forbidden=False):
+		self.id = user_id
+		self.forbidden = forbidden
+		self.sent = []
+
+	async def send(self, message):
+		if self.forbidden:
+			raise discord.Forbidden(SimpleNamespace(status=403, reason="Forbidden"), "Cannot send messages to this user")
+		self.sent.append(message)
+	#end FakeUser
+
+class FakeBot:
+	"""Stands in for the bot, with some users in its gateway cache and the rest only fetchable from the API
+	"""
+
+	def __init__(self, gateway=(), fetchable=()):
+		self.gateway = {user.id: user for user in gateway}
+		self.fetchable = {user.id: user for user in fetchable}
+		self.fetched = []
+
+	def get_user(self, user_id):
+		return self.gateway.get(user_id)
+
+	async def fetch_user(self, user_id):
+		self.fetched.append(user_id)
+		return self.fetchable[user_id]
+	#end FakeBot
+
+class FakeClock:
+
+	def __init__(self):
+		self.now = 0.0
+		self.sleeps = []
+
+	def __call__(self):
+		return self.now
+
+	async def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+	#end FakeClock
+
+def lookups(source):
+	return metrics.USER_LOOKUPS.total(source=source)
+
+def dms(outcome):
+	return metrics.DMS_SENT.total(outcome=outcome)
+
+async def wait_for_sends(users, count):
+	"""Waits until count DMs have been sent between the given users
+	"""
+	async def sent():
+		while sum(len(user.sent) for user in users) < count:
+			await asyncio.sleep(0.001)
+	await asyncio.wait_for(sent(), 1)
+
+def test_resolver_checks_the_gateway_then_its_cache_then_the_api():
+	gateway = FakeUser(1)
+	fetched = FakeUser(2)
+	bot = FakeBot(gateway=[gateway], fetchable=[fetched])
+	resolver = UserResolver(bot)
+	counts = [lookups(source) for source in ("gateway", "cache", "fetch")]
+	async def main():
+		assert await resolver.resolve("1") is gateway
+		assert await resolver.resolve(2) is fetched
+		assert await resolver.resolve(2) is fetched
+	asyncio.run(main())
+	assert bot.fetched == [2]
+	assert [lookups(source) - count for source, count in zip(("gateway", "cache", "fetch"), counts)] == [1, 1, 1]
+
+def test_resolver_evicts_the_least_recently_used_user():
+	users = [FakeUser(i) for i in range(3)]
+	bot = FakeBot(fetchable=users)
+	resolver = UserResolver(bot, max_size=2)
+	async def main():
+		await resolver.resolve(0)
+		await resolver.resolve(1)
+		await resolver.resolve(0)
+		await resolver.resolve(2)
+		await resolver.resolve(0)
+		await resolver.resolve(1)
+	asyncio.run(main())
+	assert bot.fetched == [0, 1, 2, 1]
+
+def test_coalesce_joins_lines_without_splitting_a_message():
+	assert coalesce(["a", "b", "c"]) == ["a\nb\nc"]
+	assert coalesce(["aaa", "bbb", "cc", "d"], max_length=7) == ["aaa\nbbb", "cc\nd"]
+	assert coalesce(["a" * 10, "b"], max_length=5) == ["a" * 10, "b"]
+	assert coalesce([]) == []
+
+def test_dms_within_the_window_are_sent_together():
+	alice, bob = FakeUser(1), FakeUser(2)
+	async def main():
+		queue = DMQueue(UserResolver(FakeBot(gateway=[alice, bob])), window=0.02, rate=100, burst=10)
+		queue.start()
+		queue.send(1, "first")
+		queue.send("2", "for bob")
+		queue.send(1, "second")
+		await wait_for_sends([alice, bob], 2)
+		queue.send(1, "after the window")
+		await wait_for_sends([alice, bob], 3)
+	asyncio.run(main())
+	assert alice.sent == ["first\nsecond", "after the window"]
+	assert bob.sent == ["for bob"]
+
+def test_sends_past_the_burst_wait_on_the_rate_limit():
+	users = [FakeUser(i) for i in range(4)]
+	clock = FakeClock()
+	async def main():
+		queue = DMQueue(UserResolver(FakeBot(gateway=users)), window=0)
+		queue.limiter = AsyncRateLimiter(2, burst=2, clock=clock, sleep=clock.sleep)
+		queue.start()
+		for user in users:
+			queue.send(user.id, f"to {user.id}")
+		await wait_for_sends(users, 4)
+	asyncio.run(main())
+	assert clock.sleeps == [0.5, 0.5]
+
+def test_forbidden_and_invalid_dms_are_dropped_without_stopping_the_queue():
+	closed, reachable = FakeUser(1, forbidden=True), FakeUser(2)
+	forbidden, invalid, depth = dms("forbidden"), dms("invalid"), metrics.DM_QUEUE_DEPTH.values().get((), 0)
+	async def main():
+		queue = DMQueue(UserResolver(FakeBot(gateway=[closed, reachable])), window=0)
+		queue.start()
+		queue.send("not an id", "dropped")
+		queue.send(None, "dropped")
+		queue.send(1, "dropped")
+		queue.send(2, "delivered")
+		await wait_for_sends([reachable], 1)
+	asyncio.run(main())
+	assert reachable.sent == ["delivered"]
+	assert dms("forbidden") == forbidden + 1
+	assert dms("invalid") == invalid + 2
+	assert metrics.DM_QUEUE_DEPTH.values().get((), 0) == depth
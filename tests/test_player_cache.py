@@ -0,0 +1,200 @@
+#tests/test_player_cache.py
+import time
+import threading
+import pytest
+from player_cache import PlayerCache
+
+class FakeClock:
+
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self):
+		return self.now
+
+	def advance(self, seconds):
+		self.now += seconds
+	#end FakeClock
+
+class FakeLookup:
+	"""A lookup that knows a fixed set of players, counts its calls per name, and can be made to fail, hang, or take time on a fake clock
+	"""
+
+	def __init__(self, players):
+		self.players = players
+		self.calls = {}
+		self.error = None
+		self.release = None
+		self.clock = None
+		self.delay = 0
+
+	def __call__(self, mc_name):
+		self.calls[mc_name] = self.calls.get(mc_name, 0) + 1
+		if self.release is not None:
+			self.release.wait()
+		if self.delay:
+			self.clock.advance(self.delay)
+		if self.error is not None:
+			raise self.error
+		uuid = self.players.get(mc_name.lower())
+		return (uuid, mc_name) if uuid else None
+	#end FakeLookup
+
+class FakeStore:
+
+	def __init__(self):
+		self.entries = {}
+
+	def get(self, key):
+		return self.entries.get(key)
+
+	def put(self, key, entry):
+		self.entries[key] = entry
+	#end FakeStore
+
+def new_cache(**kwargs):
+	lookup = FakeLookup({"alice": "uuid-a", "bob": "uuid-b", "carol": "uuid-c"})
+	clock = FakeClock()
+	lookup.clock = clock
+	options = {"ttl": 100, "negative_ttl": 10, "lookup_timeout": 5, "retry_after": 60}
+	options.update(kwargs)
+	return PlayerCache(lookup, clock=clock, **options), lookup, clock
+
+def wait_for_refreshes(cache):
+	deadline = time.monotonic() + 1
+	while cache._refreshing:
+		assert time.monotonic() < deadline, "refresh didn't finish"
+		time.sleep(0.001)
+
+def test_fresh_entry_is_served_without_a_lookup():
+	cache, lookup, clock = new_cache()
+	assert cache.get_uuid("Alice") == "uuid-a"
+	clock.advance(99)
+	assert cache.get_uuid("alice") == "uuid-a"
+	assert lookup.calls == {"Alice": 1}
+
+def test_stale_entry_is_served_then_refreshed_in_the_background():
+	cache, lookup, clock = new_cache()
+	cache.get_uuid("alice")
+	clock.advance(101)
+	lookup.players["alice"] = "uuid-a2"
+	assert cache.get_uuid("alice") == "uuid-a"
+	wait_for_refreshes(cache)
+	assert cache.get_uuid("alice") == "uuid-a2"
+	assert lookup.calls["alice"] == 2
+
+def test_stale_entry_is_served_without_waiting_on_a_hung_lookup():
+	cache, lookup, clock = new_cache()
+	cache.get_uuid("alice")
+	clock.advance(101)
+	lookup.release = threading.Event()
+	try:
+		for i in range(5):
+			assert cache.get_uuid("alice") == "uuid-a"
+	finally:
+		lookup.release.set()
+	wait_for_refreshes(cache)
+	#only one refresh per name is in flight however many callers see the stale entry
+	assert lookup.calls["alice"] == 2
+
+def test_concurrent_cold_misses_share_one_lookup():
+	cache, lookup, clock = new_cache()
+	lookup.release = threading.Event()
+	results = []
+	threads = [threading.Thread(target=lambda: results.append(cache.get_uuid("alice"))) for i in range(3)]
+	for thread in threads:
+		thread.start()
+	time.sleep(0.02)
+	lookup.release.set()
+	for thread in threads:
+		thread.join()
+	assert results == ["uuid-a"] * 3
+	assert lookup.calls == {"alice": 1}
+
+def test_failed_refreshes_back_off_exponentially():
+	cache, lookup, clock = new_cache()
+	cache.get_uuid("alice")
+	clock.advance(101)
+	lookup.error = ConnectionError("upstream down")
+	assert cache.get_uuid("alice") == "uuid-a"
+	wait_for_refreshes(cache)
+	assert lookup.calls["alice"] == 2
+
+	clock.advance(59)
+	assert cache.get_uuid("alice") == "uuid-a"
+	assert lookup.calls["alice"] == 2
+	clock.advance(2)
+	cache.get_uuid("alice")
+	wait_for_refreshes(cache)
+	assert lookup.calls["alice"] == 3
+
+	#the second failure in a row pauses refreshes for twice as long
+	clock.advance(61)
+	cache.get_uuid("alice")
+	assert lookup.calls["alice"] == 3
+	lookup.error = None
+	lookup.players["alice"] = "uuid-a2"
+	clock.advance(60)
+	cache.get_uuid("alice")
+	wait_for_refreshes(cache)
+	assert cache.get_uuid("alice") == "uuid-a2"
+	assert lookup.calls["alice"] == 4
+
+def test_slow_refresh_backs_off_but_keeps_its_result():
+	cache, lookup, clock = new_cache()
+	cache.get_uuid("alice")
+	cache.get_uuid("bob")
+	clock.advance(101)
+	lookup.delay = 6
+	lookup.players["alice"] = "uuid-a2"
+	cache.get_uuid("alice")
+	wait_for_refreshes(cache)
+	assert cache.get_uuid("alice") == "uuid-a2"
+	assert cache.get_uuid("bob") == "uuid-b"
+	assert lookup.calls["bob"] == 1
+
+def test_missing_player_without_a_stale_entry_raises_the_lookup_error():
+	cache, lookup, clock = new_cache()
+	lookup.error = ConnectionError("upstream down")
+	with pytest.raises(ConnectionError):
+		cache.get_uuid("alice")
+
+def test_invalid_name_is_cached_for_the_negative_ttl():
+	cache, lookup, clock = new_cache()
+	assert cache.get_uuid("nobody") is None
+	clock.advance(9)
+	assert cache.get_uuid("nobody") is None
+	assert lookup.calls["nobody"] == 1
+	clock.advance(2)
+	lookup.players["nobody"] = "uuid-n"
+	assert cache.get_uuid("nobody") is None
+	wait_for_refreshes(cache)
+	assert cache.get_uuid("nobody") == "uuid-n"
+	assert lookup.calls["nobody"] == 2
+
+def test_least_recently_used_entry_is_evicted():
+	cache, lookup, clock = new_cache(max_size=2)
+	cache.get_uuid("alice")
+	cache.get_uuid("bob")
+	cache.get_uuid("alice")
+	cache.get_uuid("carol")
+	cache.get_uuid("alice")
+	cache.get_uuid("bob")
+	assert lookup.calls == {"alice": 1, "bob": 2, "carol": 1}
+
+def test_entries_survive_in_the_store():
+	store = FakeStore()
+	cache, lookup, clock = new_cache(store=store)
+	cache.get_uuid("alice")
+	restarted = PlayerCache(lookup, store=store, clock=clock, ttl=100)
+	assert restarted.get_uuid("alice") == "uuid-a"
+	assert lookup.calls == {"alice": 1}
+
+def test_refreshed_entry_is_stored():
+	store = FakeStore()
+	cache, lookup, clock = new_cache(store=store)
+	cache.get_uuid("alice")
+	clock.advance(101)
+	cache.get_uuid("alice")
+	wait_for_refreshes(cache)
+	assert store.entries["alice"][2] == clock.now
@@ -0,0 +1,142 @@
+#tests/test_pool.py
+import threading
+import pytest
+from pool import ConnectionPool
+from exceptions import PoolTimeoutError
+from amount import Amount
+from QBank import QBank
+from storage import SQLiteBackend
+from benchmarks.common import fake_lookup
+
+class FakeConnection:
+
+	def __init__(self, number):
+		self.number = number
+		self.closed = False
+		self.healthy = True
+
+	def close(self):
+		self.closed = True
+	#end FakeConnection
+
+def new_pool(**kwargs):
+	opened = []
+	discarded = []
+	def connect():
+		opened.append(FakeConnection(len(opened)))
+		return opened[-1]
+	options = {"size": 2, "max_overflow": 1, "timeout": 0.05, "health_check": lambda conn: conn.healthy, "on_discard": discarded.append}
+	options.update(kwargs)
+	return ConnectionPool(connect, **options), opened, discarded
+
+def test_released_connections_are_reused():
+	pool, opened, discarded = new_pool()
+	with pool.connection() as first:
+		pass
+	with pool.connection() as second:
+		pass
+	assert first is second
+	assert len(opened) == 1
+
+def test_overflow_connections_are_closed_on_release():
+	pool, opened, discarded = new_pool()
+	conns = [pool.acquire() for i in range(3)]
+	with pytest.raises(PoolTimeoutError):
+		pool.acquire()
+	for conn in conns:
+		pool.release(conn)
+	assert discarded == [conns[2]] and conns[2].closed
+	assert not conns[0].closed and not conns[1].closed
+
+def test_waiting_acquire_gets_a_released_connection():
+	pool, opened, discarded = new_pool(size=1, max_overflow=0, timeout=5)
+	conn = pool.acquire()
+	threading.Timer(0.05, pool.release, [conn]).start()
+	assert pool.acquire() is conn
+
+def test_unhealthy_connection_is_discarded_after_an_error():
+	pool, opened, discarded = new_pool()
+	with pytest.raises(RuntimeError):
+		with pool.connection() as conn:
+			conn.healthy = False
+			raise RuntimeError("connection lost")
+	assert discarded == [conn] and conn.closed
+	with pool.connection() as other:
+		assert other is not conn
+
+def test_healthy_connection_is_kept_after_an_error():
+	pool, opened, discarded = new_pool()
+	with pytest.raises(RuntimeError):
+		with pool.connection() as conn:
+			raise RuntimeError("bad query")
+	assert discarded == []
+	with pool.connection() as other:
+		assert other is conn
+
+def test_invalidate_frees_the_slot():
+	pool, opened, discarded = new_pool(size=1, max_overflow=0)
+	conn = pool.acquire()
+	pool.invalidate(conn)
+	assert discarded == [conn]
+	assert pool.acquire() is not conn
+
+def test_idle_connections_past_the_timeout_are_discarded():
+	pool, opened, discarded = new_pool(idle_timeout=-1)
+	with pool.connection() as conn:
+		pass
+	with pool.connection() as other:
+		assert other is not conn
+	assert discarded == [conn]
+
+def test_warm_opens_size_connections_once():
+	pool, opened, discarded = new_pool(size=3)
+	pool.warm()
+	assert len(opened) == 3
+	pool.warm()
+	assert len(opened) == 3
+	assert discarded == []
+
+def test_close_discards_idle_connections_and_refuses_new_ones():
+	pool, opened, discarded = new_pool()
+	pool.warm()
+	pool.close()
+	assert all(conn.closed for conn in opened)
+	with pytest.raises(PoolTimeoutError):
+		pool.acquire()
+
+def test_nested_connection_blocks_share_one_connection_and_transaction():
+	qb = QBank(player_lookup=fake_lookup, backend=SQLiteBackend(":memory:"))
+	try:
+		qb.create_new_account("alice", "1001", Amount(0, 10))
+		with qb.connection() as outer:
+			with qb.connection() as inner:
+				assert inner is outer
+			qb.deposit("alice", Amount(0, 5))
+			assert qb._local.cursor is outer
+		assert qb._local.cursor is None
+		assert qb.check_balance_mc_name("alice") == Amount(0, 15)
+
+		with pytest.raises(RuntimeError):
+			with qb.connection():
+				qb.deposit("alice", Amount(0, 5))
+				with qb.connection():
+					raise RuntimeError("rolled back")
+		assert qb.check_balance_mc_name("alice") == Amount(0, 15)
+	finally:
+		qb.close()
+
+def test_connection_blocks_on_different_threads_use_different_connections(tmp_path):
+	qb = QBank(player_lookup=fake_lookup, backend=SQLiteBackend(str(tmp_path / "bank.db")))
+	try:
+		cursors = []
+		def read():
+			with qb.connection(write=False) as cursor:
+				cursors.append(cursor)
+		with qb.connection(write=False) as cursor:
+			cursors.append(cursor)
+			thread = threading.Thread(target=read)
+			thread.start()
+			thread.join()
+		assert cursors[0] is not cursors[1]
+	finally:
+		qb.close()
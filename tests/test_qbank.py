@@ -0,0 +1,41 @@
+#tests/test_qbank.py
+import pytest
+from amount import Amount
+from exceptions import AccountNotFoundError
+from QBank import QBank
+from storage import SQLiteBackend, sqlite_query
+from benchmarks.common import fake_lookup
+
+@pytest.fixture
+def qb():
+	qb = QBank(player_lookup=fake_lookup, backend=SQLiteBackend(":memory:"))
+	yield qb
+	qb.close()
+
+def account_count(qb):
+	with qb.connection(write=False) as cursor:
+		cursor.execute("SELECT COUNT(*) FROM accounts")
+		return cursor.fetchone()[0]
+
+def test_update_balances_sets_every_balance_and_the_bank_totals(qb):
+	qb.create_new_account("alice", "1001", Amount(0, 10))
+	qb.create_new_account("bob", "1002", Amount(0, 20))
+	alice, bob = qb.get_account_id_from_mc_name("alice"), qb.get_account_id_from_mc_name("bob")
+	qb.update_balances({alice: Amount(1, 0), bob: Amount(0, 5)})
+	assert qb.check_balance_account_id(alice) == Amount(1, 0)
+	assert qb.check_balance_account_id(bob) == Amount(0, 5)
+	assert qb.get_bank_totals()["deposits"] == Amount(1, 5)
+	assert qb.verify_bank_totals()["ok"]
+
+def test_update_balances_never_creates_an_account(qb):
+	qb.create_new_account("alice", "1001", Amount(0, 10))
+	alice = qb.get_account_id_from_mc_name("alice")
+	with pytest.raises(AccountNotFoundError, match="12345"):
+		qb.update_balances({alice: Amount(0, 50), 12345: Amount(0, 5)})
+	assert account_count(qb) == 1
+	assert qb.check_balance_account_id(alice) == Amount(0, 10)
+	assert qb.verify_bank_totals()["ok"]
+
+def test_sqlite_upserts_use_excluded_for_the_row_alias():
+	query = sqlite_query("INSERT INTO t (k, v) VALUES (%s, %s) AS new ON DUPLICATE KEY UPDATE v = new.v, renewed = 1")
+	assert query == "INSERT INTO t (k, v) VALUES (?, ?) ON CONFLICT DO UPDATE SET v = excluded.v, renewed = 1"
@@ -0,0 +1,96 @@
+#tests/test_rate_limit.py
+import asyncio
+import pytest
+from rate_limit import RateLimiter, AsyncRateLimiter, with_retries
+
+class FakeClock:
+	"""A clock that only moves when something sleeps on it, recording every sleep
+	"""
+
+	def __init__(self):
+		self.now = 100.0
+		self.sleeps = []
+
+	def __call__(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+	async def async_sleep(self, seconds):
+		self.sleep(seconds)
+	#end FakeClock
+
+def test_burst_is_allowed_without_waiting():
+	clock = FakeClock()
+	limiter = RateLimiter(2, burst=3, clock=clock, sleep=clock.sleep)
+	for i in range(3):
+		limiter.acquire()
+	assert clock.sleeps == []
+
+def test_calls_past_the_burst_wait_for_a_token():
+	clock = FakeClock()
+	limiter = RateLimiter(2, burst=1, clock=clock, sleep=clock.sleep)
+	limiter.acquire()
+	limiter.acquire()
+	assert clock.sleeps == [0.5]
+	limiter.acquire()
+	assert clock.sleeps == [0.5, 0.5]
+
+def test_tokens_refill_over_time_up_to_the_burst():
+	clock = FakeClock()
+	limiter = RateLimiter(1, burst=2, clock=clock, sleep=clock.sleep)
+	limiter.acquire()
+	limiter.acquire()
+	clock.now += 10
+	limiter.acquire()
+	limiter.acquire()
+	assert clock.sleeps == []
+	limiter.acquire()
+	assert clock.sleeps == [1.0]
+
+def test_async_limiter_waits_without_blocking():
+	clock = FakeClock()
+	limiter = AsyncRateLimiter(4, burst=2, clock=clock, sleep=clock.async_sleep)
+	async def main():
+		for i in range(4):
+			await limiter.acquire()
+	asyncio.run(main())
+	assert clock.sleeps == [0.25, 0.25]
+
+class Flaky:
+
+	def __init__(self, failures):
+		self.failures = failures
+		self.calls = 0
+
+	def __call__(self, value):
+		self.calls += 1
+		if self.calls <= self.failures:
+			raise ConnectionError(f"failure {self.calls}")
+		return value
+	#end Flaky
+
+def test_with_retries_returns_after_transient_failures():
+	clock = FakeClock()
+	func = Flaky(2)
+	assert with_retries(func, "ok", attempts=3, backoff=0.5, sleep=clock.sleep) == "ok"
+	assert func.calls == 3
+	assert clock.sleeps == [0.5, 1.0]
+
+def test_with_retries_reraises_the_last_error_after_the_last_attempt():
+	clock = FakeClock()
+	func = Flaky(10)
+	with pytest.raises(ConnectionError, match="failure 4"):
+		with_retries(func, "ok", attempts=4, backoff=1.0, sleep=clock.sleep)
+	assert func.calls == 4
+	assert clock.sleeps == [1.0, 2.0, 4.0]
+
+def test_with_retries_waits_on_the_limiter_before_every_attempt():
+	clock = FakeClock()
+	limiter = RateLimiter(1, burst=1, clock=clock, sleep=clock.sleep)
+	func = Flaky(1)
+	with_retries(func, "ok", attempts=2, backoff=0, limiter=limiter, sleep=clock.sleep)
+	#the backoff sleep of 0 doesn't refill the bucket, so the second attempt waits a whole second for its token
+	assert clock.sleeps == [0, 1.0]
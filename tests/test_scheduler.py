@@ -0,0 +1,109 @@
+#tests/test_scheduler.py
+import asyncio
+import metrics
+from scheduler import AccountScheduler
+
+class FakeQBank:
+	"""Stands in for AsyncQBank, running the coroutine functions it's given on the event loop
+	"""
+
+	async def run(self, func, *args, **kwargs):
+		return await func(*args, **kwargs)
+	#end FakeQBank
+
+def gauge(metric):
+	return metric.values().get((), 0)
+
+def lock_waits():
+	return sum(series["count"] for series in metrics.SCHEDULER_LOCK_WAIT_SECONDS.series().values())
+
+def test_opposite_transfers_dont_deadlock():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		order = []
+		async def transfer(name):
+			order.append(name)
+			await asyncio.sleep(0.01)
+		await asyncio.wait_for(asyncio.gather(*[scheduler.run(ids, transfer, ids) for ids in [(1, 2), (2, 1)] * 10]), 5)
+		return order, scheduler.pending()
+	order, pending = asyncio.run(main())
+	assert len(order) == 20
+	assert pending == 0
+
+def test_locks_are_taken_in_account_id_order():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		async with scheduler.hold(1):
+			#hold(2, 1) waits for account 1 first, so it doesn't hold account 2 in the meantime
+			waiting = asyncio.create_task(scheduler.run([2, 1], asyncio.sleep, 0))
+			await asyncio.sleep(0.01)
+			async def hold_two():
+				async with scheduler.hold(2):
+					pass
+			await asyncio.wait_for(hold_two(), 1)
+			assert not waiting.done()
+		await asyncio.wait_for(waiting, 1)
+	asyncio.run(main())
+
+def test_operations_on_one_account_run_one_at_a_time():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		running = []
+		most = []
+		async def operation():
+			running.append(1)
+			most.append(len(running))
+			await asyncio.sleep(0.005)
+			running.pop()
+		await asyncio.gather(*[scheduler.run([7], operation) for i in range(5)])
+		return max(most)
+	assert asyncio.run(main()) == 1
+
+def test_operations_on_different_accounts_run_in_parallel():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		both = asyncio.Event()
+		started = []
+		async def operation():
+			started.append(1)
+			if len(started) == 2:
+				both.set()
+			await asyncio.wait_for(both.wait(), 1)
+		await asyncio.gather(scheduler.run([1], operation), scheduler.run([2], operation))
+	asyncio.run(main())
+
+def test_none_account_ids_are_ignored():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		async with scheduler.hold(None, 3, None):
+			return scheduler.pending()
+	assert asyncio.run(main()) == 1
+
+def test_queue_depth_running_and_lock_wait_metrics():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		queued, running, waits = gauge(metrics.SCHEDULER_QUEUE_DEPTH), gauge(metrics.SCHEDULER_RUNNING), lock_waits()
+		async with scheduler.hold(1):
+			assert gauge(metrics.SCHEDULER_RUNNING) == running + 1
+			waiting = asyncio.create_task(scheduler.run([1], asyncio.sleep, 0))
+			await asyncio.sleep(0.01)
+			assert gauge(metrics.SCHEDULER_QUEUE_DEPTH) == queued + 1
+		await waiting
+		assert gauge(metrics.SCHEDULER_QUEUE_DEPTH) == queued
+		assert gauge(metrics.SCHEDULER_RUNNING) == running
+		assert lock_waits() == waits + 2
+		assert scheduler.pending() == 0
+	asyncio.run(main())
+
+def test_cancelled_waiter_releases_its_place():
+	async def main():
+		scheduler = AccountScheduler(FakeQBank())
+		queued = gauge(metrics.SCHEDULER_QUEUE_DEPTH)
+		async with scheduler.hold(1):
+			waiting = asyncio.create_task(scheduler.run([1, 2], asyncio.sleep, 0))
+			await asyncio.sleep(0.01)
+			waiting.cancel()
+			await asyncio.gather(waiting, return_exceptions=True)
+		assert gauge(metrics.SCHEDULER_QUEUE_DEPTH) == queued
+		assert scheduler.pending() == 0
+	asyncio.run(main())